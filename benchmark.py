@@ -0,0 +1,906 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the issue tagging bot.
+
+Each benchmark is a subcommand:
+
+    $ ./benchmark.py fetch --num-issues 2000
+    $ ./benchmark.py load --num-issues 200000 --data-dir /tmp/synthetic-issue-data
+    $ ./benchmark.py records --num-issues 200000
+    $ ./benchmark.py labels --num-issues 200000
+    $ ./benchmark.py encode --num-issues 20000
+    $ ./benchmark.py pipeline --num-issues 20000 --batch-sizes 32 256
+    $ ./benchmark.py serve --concurrency 32 --max-batch-sizes 1 64
+    $ ./benchmark.py --output bench.jsonl stages --scales 10000 100000 1000000
+    $ ./benchmark.py imports
+
+Pass `--output` to append the results to a file as JSON lines, along with the
+git commit and machine they came from.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of this process so far, in MB.
+    """
+    # ru_maxrss is carried over from the parent process across fork and exec,
+    # so prefer the kernel's per-process high water mark where there is one.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def scratch_dir(path: Optional[str], name: str) -> Iterator[str]:
+    """
+    Yield `path` if it was given, and leave it in place afterwards so that it
+    can be reused by the next run.  Otherwise, yield `name` inside a new
+    temporary directory, which is removed (along with anything written next
+    to `name`, like an issue store) once the benchmark is done.
+    """
+    if path:
+        yield path
+        return
+    with tempfile.TemporaryDirectory(prefix=f"{name}-") as temp_dir:
+        yield str(Path(temp_dir) / name)
+
+
+def write_synthetic_corpus(data_dir: str, num_issues: int, seed: int = 42) -> None:
+    """
+    Write `num_issues` random issues to `data_dir`, in the same NNNNNN.json
+    format the fetcher writes.  Nothing is written if `data_dir` already has
+    json files in it, so a corpus can be reused between runs.
+    """
+    from issue_tagging_bot.stub_github import GITHUB_DATE_FORMAT, iter_stub_issues
+
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    if any(f.endswith(".json") for f in os.listdir(data_dir)):
+        return
+
+    def to_str(date: Optional[str]) -> Optional[str]:
+        # IssueData saves dates with str(datetime).
+        return None if date is None else str(datetime.strptime(date, GITHUB_DATE_FORMAT))
+
+    repo_url = "https://api.github.com/repos/NixOS/nixpkgs"
+    for issue in iter_stub_issues(num_issues, seed=seed):
+        number = issue["number"]
+        record = {
+            "id": issue["id"],
+            "url": repo_url + issue["url"],
+            "number": number,
+            "state": issue["state"],
+            "title": issue["title"],
+            "body": issue["body"],
+            "user_login": issue["user"]["login"],
+            "user_id": issue["user"]["id"],
+            "labels": [{"name": label["name"], "url": repo_url + label["url"]} for label in issue["labels"]],
+            "comments": issue["comments"],
+            "closed_at": to_str(issue["closed_at"]),
+            "created_at": to_str(issue["created_at"]),
+            "updated_at": to_str(issue["updated_at"]),
+            "is_issue": "pull_request" not in issue,
+        }
+        with open(Path(data_dir) / f"{number:06}.json", "w") as f:
+            f.write(json.dumps(record))
+
+
+def run_in_fresh_process(func: Callable[..., Any], *args: Any, imports: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Run `func(*args)` in a new process, and return how long it took and the
+    peak RSS of that process.  The modules in `imports` are imported before
+    the timing starts, so their import time and memory isn't counted.
+
+    If `func` returns a dict, it is merged into the result.  A function that
+    has to do some setup before the part that is being measured can time that
+    part itself and return it as `seconds`; the time for the whole call is
+    then still in `total_seconds`.
+
+    If `func` raises an exception, the result has an `error` instead.
+    """
+    # This uses a plain Process instead of a Pool, because Pool workers are
+    # daemonic and can't start process pools of their own.
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_timed_call, args=(queue, func, imports) + args)
+    process.start()
+    result: Dict[str, Any] = queue.get()
+    process.join()
+    return result
+
+
+def _timed_call(queue: Any, func: Callable[..., Any], imports: Sequence[str], *args: Any) -> None:
+    # Any processes `func` starts should use the platform's default start
+    # method, not the spawn method that was used to start this process.
+    multiprocessing.set_start_method(multiprocessing.get_all_start_methods()[0], force=True)
+    try:
+        for module in imports:
+            importlib.import_module(module)
+        rss_before = peak_rss_mb()
+        start_time = time.perf_counter()
+        returned = func(*args)
+        total_seconds = time.perf_counter() - start_time
+    except Exception as e:
+        # The parent is waiting on the queue, so it always has to get
+        # something.
+        queue.put({"error": f"{type(e).__name__}: {e}", "peak_rss_mb": peak_rss_mb()})
+        return
+
+    result: Dict[str, Any] = {
+        "seconds": total_seconds,
+        "total_seconds": total_seconds,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if isinstance(returned, dict):
+        result.update(returned)
+    queue.put(result)
+
+
+def bench_fetch(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Crawl a stub GitHub API with each of the fetcher modes, and compare how
+    many API requests each one makes per stored issue.
+    """
+    from github import Github  # type: ignore
+
+    from fetch_all_issues import Fetcher
+    from issue_tagging_bot.stub_github import StubGitHubServer, make_stub_issues
+
+    issues = make_stub_issues(args.num_issues)
+    results: List[Dict[str, Any]] = []
+
+    for mode in args.modes:
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            start_time = time.perf_counter()
+            fetcher = Fetcher(
+                lambda: Github("dummy-token", base_url=server.base_url, per_page=100),
+                data_dir_str=data_dir,
+                mode=mode,
+            )
+            fetcher.run()
+            elapsed = time.perf_counter() - start_time
+
+            stored = len([f for f in os.listdir(data_dir) if f.endswith(".json")])
+            # Requests to /rate_limit don't count against the rate limit, so
+            # they are reported separately.
+            api_requests = server.total_requests() - server.request_counts["rate_limit"]
+            results.append(
+                {
+                    "benchmark": "fetch",
+                    "mode": mode,
+                    "num_issues": args.num_issues,
+                    "stored_issues": stored,
+                    "api_requests": api_requests,
+                    "rate_limit_requests": server.request_counts["rate_limit"],
+                    "requests_per_stored_issue": api_requests / max(stored, 1),
+                    "seconds": elapsed,
+                }
+            )
+
+    return results
+
+
+def _load_with_read_json(data_dir: str) -> None:
+    """
+    The original implementation of `IssueFiles.data_frame`, which joins every
+    json file into one big string and parses it all at once.
+    """
+    import pandas as pd  # type: ignore
+
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    all_raws = ",".join(IssueFiles(data_dir).raws())
+    all_data = pd.read_json(f"[{all_raws}]", orient="records")
+    all_data[all_data.is_issue]
+
+
+def _load_issues(
+    data_dir: str, store_dir: Optional[str], columns: Optional[List[str]], num_processes: int = 1
+) -> None:
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    IssueFiles(data_dir, store_dir=store_dir, num_processes=num_processes).issues_data_frame(columns)
+
+
+def bench_load(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Time loading all the issues into a DataFrame with each of the loaders, and
+    record the peak memory used.
+    """
+    from issue_tagging_bot.issue_store import IssueStore
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    with scratch_dir(args.data_dir, "synthetic-issue-data") as data_dir:
+        write_synthetic_corpus(data_dir, args.num_issues)
+
+        store_dir = data_dir.rstrip("/") + "-store"
+        if not IssueStore(store_dir).exists():
+            IssueStore(store_dir, flush_every=50000).migrate(IssueFiles(data_dir).raws())
+
+        # The columns Stage1PreprocData and Stage2PreprocData actually use.
+        used_columns = ["number", "user_login", "title", "body", "labels"]
+
+        loaders = {
+            "read_json": (_load_with_read_json, data_dir),
+            "json_stream": (_load_issues, data_dir, None, None),
+            "json_stream_projected": (_load_issues, data_dir, None, used_columns),
+            "json_stream_parallel": (_load_issues, data_dir, None, None, args.num_processes),
+            "parquet": (_load_issues, data_dir, store_dir, None),
+            "parquet_projected": (_load_issues, data_dir, store_dir, used_columns),
+        }
+
+        results: List[Dict[str, Any]] = []
+        for name in args.loaders:
+            func, *func_args = loaders[name]
+            result = run_in_fresh_process(func, *func_args, imports=["issue_tagging_bot.issue_data"])
+            results.append({"benchmark": "load", "loader": name, "num_issues": args.num_issues, **result})
+        return results
+
+
+def _hold_and_encode_records(data_dir: str, representation: str) -> Dict[str, Any]:
+    """
+    Decode every issue into `representation` and keep them all in memory,
+    then encode them all back to json the way the fetcher used to
+    ("dict", with `MyEncoder`) or does now ("issue_data", with
+    `IssueData.to_json`).
+    """
+    from issue_tagging_bot.issue_data import IssueData, IssueFiles, MyEncoder
+
+    raws = list(IssueFiles(data_dir).raws())
+
+    start_time = time.perf_counter()
+    if representation == "dict":
+        records: List[Any] = [json.loads(raw_json) for raw_json in raws]
+    else:
+        records = [IssueData.from_json(raw_json) for raw_json in raws]
+    decode_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    if representation == "dict":
+        encoded = [MyEncoder().encode(record) for record in records]
+    else:
+        encoded = [record.to_json() for record in records]
+    encode_seconds = time.perf_counter() - start_time
+
+    return {
+        "decode_seconds": decode_seconds,
+        "encode_seconds": encode_seconds,
+        "round_trips": encoded == raws,
+    }
+
+
+def bench_records(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Compare the memory used by holding every issue as a plain dict and as an
+    `IssueData`, and the time to decode and encode them.
+    """
+    with scratch_dir(args.data_dir, "synthetic-issue-data") as data_dir:
+        write_synthetic_corpus(data_dir, args.num_issues)
+
+        results: List[Dict[str, Any]] = []
+        for representation in ["dict", "issue_data"]:
+            result = run_in_fresh_process(
+                _hold_and_encode_records, data_dir, representation, imports=["issue_tagging_bot.issue_data"]
+            )
+            results.append(
+                {"benchmark": "records", "representation": representation, "num_issues": args.num_issues, **result}
+            )
+        return results
+
+
+def _legacy_topic_matrix(data_dir: str) -> Dict[str, Any]:
+    """
+    The original way `Stage1PreprocData.preprocess` built the topic matrix,
+    from a set of label names per issue with a `MultiLabelBinarizer`.  Only
+    the time after the issues are loaded is counted.
+    """
+    import numpy as np  # type: ignore
+    from sklearn.preprocessing import MultiLabelBinarizer  # type: ignore
+
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    only_issues = IssueFiles(data_dir).issues_data_frame(["number", "labels"])
+
+    start_time = time.perf_counter()
+    label_series = only_issues.labels.apply(lambda val: set(map(lambda l: l["name"], val)))
+    mlb = MultiLabelBinarizer(sparse_output=True)
+    one_hot_labels = mlb.fit_transform(label_series)
+    topic_label_selector = np.char.startswith(mlb.classes_.astype(str), "6.")
+    one_hot_labels[:, topic_label_selector].tocsr()
+    return {"seconds": time.perf_counter() - start_time}
+
+
+def _label_index_topic_matrix(data_dir: str) -> Dict[str, Any]:
+    """
+    Build the topic matrix from the `LabelIndex`, the way
+    `Stage1PreprocData.preprocess` does now.  Only the time after the issues
+    and index are loaded (or built, for a corpus no fetcher has indexed) is
+    counted.
+    """
+    # Imported up front so that importing scipy isn't timed, just like sklearn
+    # (and scipy with it) isn't for the `MultiLabelBinarizer`.
+    import scipy.sparse  # type: ignore
+
+    from issue_tagging_bot.issue_data import IssueFiles
+    from issue_tagging_bot.label_index import LabelIndex
+
+    issue_files = IssueFiles(data_dir)
+    only_issues = issue_files.issues_data_frame(["number", "labels"])
+    label_index = LabelIndex.open(issue_files)
+
+    start_time = time.perf_counter()
+    rows = label_index.rows(only_issues["number"].to_numpy())
+    label_index.one_hot(label_index.topic_classes(rows), rows)
+    return {"seconds": time.perf_counter() - start_time}
+
+
+def bench_labels(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Compare building the one-hot topic matrix with a `MultiLabelBinarizer`
+    and from the `LabelIndex`.
+    """
+    with scratch_dir(args.data_dir, "synthetic-issue-data") as data_dir:
+        write_synthetic_corpus(data_dir, args.num_issues)
+
+        results: List[Dict[str, Any]] = []
+        for name, func in [("multi_label_binarizer", _legacy_topic_matrix), ("label_index", _label_index_topic_matrix)]:
+            result = run_in_fresh_process(func, data_dir, imports=["issue_tagging_bot.issue_data"])
+            results.append({"benchmark": "labels", "method": name, "num_issues": args.num_issues, **result})
+        return results
+
+
+def _legacy_to_encoded(stage2: Any) -> Any:
+    """
+    The original row-at-a-time implementation of
+    `Stage2PreprocData.process` and `Stage2PreprocData.to_encoded`.
+    """
+    import numpy as np  # type: ignore
+    import pandas as pd  # type: ignore
+
+    def create_input_text(row: pd.Series) -> pd.Series:
+        text = f"{row['user_login']}\n{row['title']}\n{row['body']}"[: stage2.input_text_len]
+        return pd.Series([row["number"], text], index=["issue_num", "issue_text"])
+
+    X = stage2.stage1.only_issues.apply(create_input_text, axis=1)
+
+    def to_ascii(c: str) -> int:
+        val = ord(c)
+        return 0 if val > 127 else val
+
+    def to_ascii_array(iss_bod: str) -> np.ndarray:
+        padded_issue_body = iss_bod.ljust(stage2.input_text_len, "\0")
+        return np.fromiter((to_ascii(c) for c in padded_issue_body), dtype="int8")
+
+    issue_body_ascii = np.concatenate([to_ascii_array(iss) for iss in X.iloc[:, 1]])
+    return X["issue_num"], issue_body_ascii.reshape((X.shape[0], stage2.input_text_len))
+
+
+def bench_encode(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Time turning the issues into the encoded (NUM_ISSUES, input_text_len)
+    matrix with the original implementation and the vectorized one, and check
+    that they give the same output.
+    """
+    import numpy as np  # type: ignore
+
+    from issue_tagging_bot.issue_data import IssueFiles, Stage1PreprocData, Stage2PreprocData
+
+    with scratch_dir(args.data_dir, "synthetic-issue-data") as data_dir:
+        write_synthetic_corpus(data_dir, args.num_issues)
+        stage2 = Stage2PreprocData(
+            Stage1PreprocData(IssueFiles(data_dir), cache_dir=None), input_text_len=args.input_text_len
+        )
+
+        start_time = time.perf_counter()
+        legacy_issue_nums, legacy_encoded = _legacy_to_encoded(stage2)
+        legacy_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        issue_nums, encoded, _ = stage2.to_encoded()
+        seconds = time.perf_counter() - start_time
+
+        return [
+            {
+                "benchmark": "encode",
+                "num_issues": encoded.shape[0],
+                "input_text_len": args.input_text_len,
+                "legacy_seconds": legacy_seconds,
+                "vectorized_seconds": seconds,
+                "speedup": legacy_seconds / seconds,
+                "identical": bool(np.array_equal(legacy_encoded, encoded) and legacy_issue_nums.equals(issue_nums)),
+            }
+        ]
+
+
+def bench_pipeline(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Time one pass over the training set with the original unbatched
+    Dataset and with `Stage2PreprocData.input_pipeline` at a few batch sizes,
+    without any model, and report examples per second.
+    """
+    from issue_tagging_bot.issue_data import IssueFiles, Stage1PreprocData, Stage2PreprocData
+
+    with scratch_dir(args.data_dir, "synthetic-issue-data") as data_dir, tempfile.TemporaryDirectory(
+        prefix="preproc-cache-"
+    ) as cache_dir:
+        write_synthetic_corpus(data_dir, args.num_issues)
+        stage2 = Stage2PreprocData(Stage1PreprocData(IssueFiles(data_dir), cache_dir=cache_dir), cache_dir=cache_dir)
+
+        def only_last_label(issue_body: Any, labels: Any, issue_num: Any) -> Any:
+            return (issue_body, labels[-1], issue_num)
+
+        # Create the encoded cache and the split outside of the timing.
+        stage2.split_indices()
+
+        def unbatched() -> Any:
+            # What train.py used to do.
+            train_set, _, _ = stage2.to_datasets()
+            return train_set.map(only_last_label)
+
+        pipelines: Dict[str, Callable[[], Any]] = {"unbatched": unbatched}
+        for batch_size in args.batch_sizes:
+            pipelines[f"batch{batch_size}"] = lambda batch_size=batch_size: stage2.to_batched_datasets(
+                batch_size=batch_size, map_func=only_last_label
+            )[0]
+            pipelines[f"batch{batch_size}_cached"] = lambda batch_size=batch_size: stage2.to_batched_datasets(
+                batch_size=batch_size, map_func=only_last_label, cache_dir=""
+            )[0]
+
+        results: List[Dict[str, Any]] = []
+        for name, make_dataset in pipelines.items():
+            dataset = make_dataset()
+            for epoch in range(args.epochs):
+                start_time = time.perf_counter()
+                num_examples = 0
+                for element in dataset:
+                    # Batched elements have an extra leading dimension.
+                    num_examples += element[0].shape[0] if len(element[0].shape) > 1 else 1
+                seconds = time.perf_counter() - start_time
+                results.append(
+                    {
+                        "benchmark": "pipeline",
+                        "pipeline": name,
+                        "epoch": epoch,
+                        "num_examples": num_examples,
+                        "seconds": seconds,
+                        "examples_per_second": num_examples / seconds,
+                    }
+                )
+        return results
+
+
+def _post_issues(url: str, payloads: List[bytes]) -> List[float]:
+    """
+    POST each of `payloads` to `url` one after another over a single
+    connection, and return the latency of each request in seconds.
+    """
+    import http.client
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port)
+    latencies: List[float] = []
+    for payload in payloads:
+        start_time = time.perf_counter()
+        connection.request("POST", parsed.path, body=payload, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start_time)
+        if response.status != 200:
+            raise RuntimeError(f"Got HTTP {response.status} from {url}")
+    connection.close()
+    return latencies
+
+
+def bench_serve(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Send webhook-style POSTs to a local inference server from many client
+    threads at once, and report the latency percentiles and throughput with
+    and without micro-batching.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np  # type: ignore
+
+    from issue_tagging_bot.inference import InferenceServer, TopicPredictor, load_model
+    from issue_tagging_bot.stub_github import TOPIC_LABELS, make_stub_issues
+
+    if args.model_dir is not None:
+        model, metadata = load_model(args.model_dir)
+        labels = metadata["labels"]
+    else:
+        # An untrained model with the same shape as the one train.py trains.
+        # The predictions are meaningless, but they take just as long.
+        import tensorflow as tf  # type: ignore
+
+        labels = TOPIC_LABELS
+        model = tf.keras.models.Sequential(
+            [
+                tf.keras.layers.Dense(300, input_shape=[args.input_text_len], activation="relu"),
+                tf.keras.layers.Dense(len(labels), activation="sigmoid"),
+            ]
+        )
+
+    issues = list(make_stub_issues(args.num_requests).values())
+    payloads = [json.dumps({"action": "opened", "issue": issue}).encode("utf-8") for issue in issues]
+    per_client = [payloads[i :: args.concurrency] for i in range(args.concurrency)]
+
+    results: List[Dict[str, Any]] = []
+    for max_batch_size in args.max_batch_sizes:
+        predictor = TopicPredictor(
+            model, labels, args.input_text_len, max_batch_size=max_batch_size, max_wait_seconds=args.max_wait_ms / 1000
+        )
+        with InferenceServer(predictor, port=0) as server:
+            # Warm up the model, so its first call isn't counted.
+            _post_issues(server.url + "/webhook", payloads[:2])
+            predictor.batch_sizes.clear()
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                latency_lists = list(executor.map(lambda p: _post_issues(server.url + "/webhook", p), per_client))
+            seconds = time.perf_counter() - start_time
+
+        latencies = np.concatenate(latency_lists) * 1000
+        results.append(
+            {
+                "benchmark": "serve",
+                "max_batch_size": max_batch_size,
+                "concurrency": args.concurrency,
+                "num_requests": len(latencies),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "requests_per_second": len(latencies) / seconds,
+                "mean_batch_size": float(np.mean(predictor.batch_sizes)),
+            }
+        )
+    return results
+
+
+def _stage_fetch(num_issues: int) -> Dict[str, Any]:
+    from github import Github  # type: ignore
+
+    from fetch_all_issues import Fetcher
+    from issue_tagging_bot.stub_github import StubGitHubServer, make_stub_issues
+
+    issues = make_stub_issues(num_issues)
+    with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+        start_time = time.perf_counter()
+        Fetcher(
+            lambda: Github("dummy-token", base_url=server.base_url, per_page=100), data_dir_str=data_dir, mode="listing"
+        ).run()
+        return {"seconds": time.perf_counter() - start_time, "fetched_issues": len(issues)}
+
+
+def _stage_load(data_dir: str, cache_dir: str) -> None:
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    IssueFiles(data_dir).issues_data_frame()
+
+
+def _stage_stage1(data_dir: str, cache_dir: str) -> None:
+    from issue_tagging_bot.issue_data import IssueFiles, Stage1PreprocData
+
+    # The cache is empty the first time, so this is the full preprocessing
+    # plus writing the cache that the later stages load from.
+    Stage1PreprocData(IssueFiles(data_dir), cache_dir=cache_dir)
+
+
+def _stage2(data_dir: str, cache_dir: str) -> Any:
+    from issue_tagging_bot.issue_data import IssueFiles, Stage1PreprocData, Stage2PreprocData
+
+    return Stage2PreprocData(Stage1PreprocData(IssueFiles(data_dir), cache_dir=cache_dir), cache_dir=cache_dir)
+
+
+def _stage_process(data_dir: str, cache_dir: str) -> Dict[str, Any]:
+    stage2 = _stage2(data_dir, cache_dir)
+    start_time = time.perf_counter()
+    stage2.process()
+    return {"seconds": time.perf_counter() - start_time}
+
+
+def _stage_encode(data_dir: str, cache_dir: str) -> Dict[str, Any]:
+    stage2 = _stage2(data_dir, cache_dir)
+    start_time = time.perf_counter()
+    stage2.to_encoded_mmap()
+    stage2.split_indices()
+    return {"seconds": time.perf_counter() - start_time}
+
+
+def _stage_input_pipeline(data_dir: str, cache_dir: str, batch_size: int) -> Dict[str, Any]:
+    from train import all_topic_labels
+
+    stage2 = _stage2(data_dir, cache_dir)
+    train_set, _, _ = stage2.to_batched_datasets(batch_size=batch_size, map_func=all_topic_labels)
+    start_time = time.perf_counter()
+    num_examples = sum(issue_bodies.shape[0] for issue_bodies, _ in train_set)
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "num_examples": num_examples, "examples_per_second": num_examples / seconds}
+
+
+def _stage_train(data_dir: str, cache_dir: str, batch_size: int, epochs: int) -> Dict[str, Any]:
+    import tensorflow as tf  # type: ignore
+
+    from issue_tagging_bot.multi_label import positive_class_weights, weighted_binary_crossentropy
+    from train import all_topic_labels
+
+    stage2 = _stage2(data_dir, cache_dir)
+    _, _, labels = stage2.to_encoded_mmap()
+    train_indices, _, _ = stage2.split_indices()
+    train_set, val_set, _ = stage2.to_batched_datasets(batch_size=batch_size, map_func=all_topic_labels)
+
+    # The same model as train.py's multi-label mode.
+    model = tf.keras.models.Sequential(
+        [
+            tf.keras.layers.Dense(300, input_shape=[stage2.input_text_len], activation="relu"),
+            tf.keras.layers.Dense(labels.shape[1], activation="sigmoid"),
+        ]
+    )
+    model.compile(loss=weighted_binary_crossentropy(positive_class_weights(labels[train_indices])), optimizer="adam")
+
+    start_time = time.perf_counter()
+    model.fit(train_set, epochs=epochs, validation_data=val_set, verbose=0)
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "examples_per_second": len(train_indices) * epochs / seconds}
+
+
+STAGES = ["fetch", "load", "stage1", "process", "encode", "input_pipeline", "train"]
+
+
+def bench_stages(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Time each stage of the pipeline, from fetching through training, on
+    synthetic corpora of each of the given sizes.  Each stage runs in a fresh
+    process, so its peak memory is its own.
+
+    The later stages need the caches written by the earlier ones, so the
+    stages should be run in order.  Any setup a stage needs (like loading the
+    Stage1PreprocData cache) isn't counted in its `seconds`.
+    """
+    results: List[Dict[str, Any]] = []
+    with scratch_dir(args.corpus_root, "synthetic-issue-corpora") as corpus_root:
+        for num_issues in args.scales:
+            data_dir = str(Path(corpus_root) / f"issues-{num_issues}")
+
+            start_time = time.perf_counter()
+            write_synthetic_corpus(data_dir, num_issues)
+            generate_seconds = time.perf_counter() - start_time
+            results.append(
+                {"benchmark": "stages", "stage": "generate", "num_issues": num_issues, "seconds": generate_seconds}
+            )
+
+            # A fresh cache for each run, so that nothing is left over from an
+            # earlier run.
+            with tempfile.TemporaryDirectory(prefix="preproc-cache-") as cache_dir:
+                stages: Dict[str, Tuple[Any, ...]] = {
+                    # Fetching is much slower than everything else, so it gets
+                    # its own (smaller) number of issues.
+                    "fetch": (_stage_fetch, min(num_issues, args.max_fetch_issues)),
+                    "load": (_stage_load, data_dir, cache_dir),
+                    "stage1": (_stage_stage1, data_dir, cache_dir),
+                    "process": (_stage_process, data_dir, cache_dir),
+                    "encode": (_stage_encode, data_dir, cache_dir),
+                    "input_pipeline": (_stage_input_pipeline, data_dir, cache_dir, args.batch_size),
+                    "train": (_stage_train, data_dir, cache_dir, args.batch_size, args.epochs),
+                }
+                for name in args.stages:
+                    func, *func_args = stages[name]
+                    result = run_in_fresh_process(func, *func_args)
+                    results.append({"benchmark": "stages", "stage": name, "num_issues": num_issues, **result})
+                    print_results(results[-1:])
+
+    return results
+
+
+# Modules that take a long time or a lot of memory to import.
+HEAVY_MODULES = ["tensorflow", "sklearn", "scipy", "pandas", "numpy", "pyarrow"]
+
+# Modules that must not import any of the `HEAVY_MODULES` just by being
+# imported, since the fetcher (and other light tools) use them.
+LIGHT_MODULES = [
+    "fetch_all_issues",
+    "issue_tagging_bot.issue_data",
+    "issue_tagging_bot.issue_store",
+    "issue_tagging_bot.label_index",
+    "issue_tagging_bot.metrics",
+]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start_time
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy_modules_loaded": heavy}}))
+"""
+
+
+def bench_imports(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Time importing each module in a fresh interpreter, and check that the
+    `LIGHT_MODULES` don't pull in any of the `HEAVY_MODULES`.
+    """
+    import subprocess
+
+    results: List[Dict[str, Any]] = []
+    for module in args.modules:
+        timings: List[float] = []
+        heavy: List[str] = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                cwd=Path(__file__).parent,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            measured = json.loads(output.strip().splitlines()[-1])
+            timings.append(measured["seconds"])
+            heavy = measured["heavy_modules_loaded"]
+        results.append(
+            {
+                "benchmark": "imports",
+                "module": module,
+                # The fastest run is the least affected by everything else
+                # going on on the machine.
+                "seconds": min(timings),
+                "heavy_modules_loaded": ",".join(heavy),
+                "ok": module not in LIGHT_MODULES or not heavy,
+            }
+        )
+    return results
+
+
+def run_metadata() -> Dict[str, Any]:
+    """
+    Return information about this run to save along with the results, so
+    results from different commits and machines can be told apart.
+    """
+    import platform
+    import subprocess
+
+    try:
+        git_commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_commit = None
+    return {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_commit": git_commit,
+        "hostname": platform.node(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path: str, results: List[Dict[str, Any]]) -> None:
+    """
+    Append each result to `path` as a line of JSON, along with the
+    `run_metadata`.
+    """
+    metadata = run_metadata()
+    with open(path, "a") as f:
+        for result in results:
+            f.write(json.dumps({**metadata, **result}) + "\n")
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    for result in results:
+        print(", ".join(f"{key}: {value:.4g}" if isinstance(value, float) else f"{key}: {value}" for key, value in result.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the issue tagging bot.")
+    parser.add_argument("--output", help="Append the results to this file as JSON lines.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Compare API requests per stored issue for each fetcher mode.")
+    fetch_parser.add_argument("--num-issues", type=int, default=2000)
+    fetch_parser.add_argument("--modes", nargs="+", default=["per-issue", "listing"])
+    fetch_parser.set_defaults(func=bench_fetch)
+
+    load_parser = subparsers.add_parser("load", help="Compare time and peak memory of the issue loaders.")
+    load_parser.add_argument("--num-issues", type=int, default=200000)
+    load_parser.add_argument("--data-dir", help="Where to write (or reuse) the synthetic corpus.")
+    load_parser.add_argument(
+        "--loaders",
+        nargs="+",
+        default=[
+            "read_json",
+            "json_stream",
+            "json_stream_projected",
+            "json_stream_parallel",
+            "parquet",
+            "parquet_projected",
+        ],
+    )
+    load_parser.add_argument(
+        "--num-processes", type=int, default=os.cpu_count(), help="Processes for the json_stream_parallel loader."
+    )
+    load_parser.set_defaults(func=bench_load)
+
+    records_parser = subparsers.add_parser(
+        "records", help="Compare memory and encode/decode time of dicts and IssueData for every issue."
+    )
+    records_parser.add_argument("--num-issues", type=int, default=200000)
+    records_parser.add_argument("--data-dir", help="Where to write (or reuse) the synthetic corpus.")
+    records_parser.set_defaults(func=bench_records)
+
+    labels_parser = subparsers.add_parser(
+        "labels", help="Compare building the topic matrix with MultiLabelBinarizer and the label index."
+    )
+    labels_parser.add_argument("--num-issues", type=int, default=200000)
+    labels_parser.add_argument("--data-dir", help="Where to write (or reuse) the synthetic corpus.")
+    labels_parser.set_defaults(func=bench_labels)
+
+    encode_parser = subparsers.add_parser("encode", help="Compare the original and vectorized text encoding.")
+    encode_parser.add_argument("--num-issues", type=int, default=20000)
+    encode_parser.add_argument("--data-dir", help="Where to write (or reuse) the synthetic corpus.")
+    encode_parser.add_argument("--input-text-len", type=int, default=1000)
+    encode_parser.set_defaults(func=bench_encode)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Compare examples/sec of the tf.data input pipelines.")
+    pipeline_parser.add_argument("--num-issues", type=int, default=20000)
+    pipeline_parser.add_argument("--data-dir", help="Where to write (or reuse) the synthetic corpus.")
+    pipeline_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 256])
+    pipeline_parser.add_argument("--epochs", type=int, default=2, help="Passes over the training set per pipeline.")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    serve_parser = subparsers.add_parser("serve", help="Measure latency and throughput of the inference server.")
+    serve_parser.add_argument("--model-dir", help="A model saved by train.py.  Defaults to an untrained model.")
+    serve_parser.add_argument("--num-requests", type=int, default=2000)
+    serve_parser.add_argument("--concurrency", type=int, default=32)
+    serve_parser.add_argument("--max-batch-sizes", type=int, nargs="+", default=[1, 64])
+    serve_parser.add_argument("--max-wait-ms", type=float, default=5)
+    serve_parser.add_argument("--input-text-len", type=int, default=1000)
+    serve_parser.set_defaults(func=bench_serve)
+
+    stages_parser = subparsers.add_parser("stages", help="Time each stage of the pipeline at several corpus sizes.")
+    stages_parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000])
+    stages_parser.add_argument("--corpus-root", help="Where to write (or reuse) the synthetic corpora.")
+    stages_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    stages_parser.add_argument("--max-fetch-issues", type=int, default=5000)
+    stages_parser.add_argument("--batch-size", type=int, default=64)
+    stages_parser.add_argument("--epochs", type=int, default=1)
+    stages_parser.set_defaults(func=bench_stages)
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Time importing modules, and check the light ones don't import heavy libraries."
+    )
+    imports_parser.add_argument("--modules", nargs="+", default=LIGHT_MODULES)
+    imports_parser.add_argument("--repeat", type=int, default=3)
+    imports_parser.set_defaults(func=bench_imports)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    if args.benchmark != "stages":
+        # The stages benchmark prints each result as soon as it has it.
+        print_results(results)
+    if args.output is not None:
+        write_results(args.output, results)
+    if any(result.get("ok") is False for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,107 +1,546 @@
 #!/usr/bin/env python3
 
+import bisect
 import json
 import os
+import random
+import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from time import sleep
-from typing import Optional
+from time import sleep, time
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 # PyGithub has gotten mypy types, but it has not been released yet:
 # https://github.com/PyGithub/PyGithub/pull/1231
 from github import Github, GithubException, Repository  # type: ignore
 from github.Issue import Issue  # type: ignore
+from github.PaginatedList import PaginatedList  # type: ignore
 
-from issue_tagging_bot.issue_data import IssueData, IssueFiles, MyEncoder
+from issue_tagging_bot.issue_data import IssueData, IssueFiles
+from issue_tagging_bot.issue_store import IssueStore
+from issue_tagging_bot.label_index import LabelIndex
+from issue_tagging_bot.metrics import METRICS, MetricsExporter
 
 
 class RateLimiter:
-    def __init__(self, github: Github) -> None:
+    """
+    Keeps track of how many GitHub API requests are left before the rate
+    limit resets.
+
+    The remaining request budget is only fetched with `get_rate_limit()` when
+    nothing is known about it yet or the reset time has passed.  After that,
+    each call to `maybe_wait` takes one request from the local budget, and
+    `update_from_headers` corrects the budget from the `X-RateLimit-*` headers
+    of the last response.
+
+    A single RateLimiter is shared by all the fetcher's worker threads, so
+    they all draw from the same budget.
+    """
+
+    def __init__(self, github: Github, max_backoff_seconds: float = 600) -> None:
         self.github = github
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lock = threading.Lock()
+        self.remaining: Optional[int] = None
+        # The time (in UTC) at which the rate limit is reset.
+        self.reset_time: Optional[datetime] = None
+
+    def backoff(self, attempt: int, base_seconds: float = 2) -> None:
+        """
+        Sleep before retrying a request that has failed `attempt` times in a
+        row.  This is exponential backoff with full jitter, capped at
+        `self.max_backoff_seconds`.
+        """
+        max_sleep = min(self.max_backoff_seconds, base_seconds * 2 ** attempt)
+        sleep_seconds = random.uniform(0, max_sleep)
+        print(f"sleeping for {sleep_seconds:.1f} seconds and trying again...\n")
+        METRICS.inc("fetcher_retries_total")
+        METRICS.inc("fetcher_backoff_sleep_seconds_total", sleep_seconds)
+        sleep(sleep_seconds)
+
+    def invalidate(self) -> None:
+        """
+        Forget the local budget, so the next call to `maybe_wait` fetches it
+        from the API.  This is used after a request fails in a way that might
+        mean the local budget is wrong.
+        """
+        with self.lock:
+            self.remaining = None
+
+    def refresh(self) -> None:
+        """
+        Fetch the remaining budget and reset time from the API.  This must be
+        called with `self.lock` held.
+        """
+        attempt = 0
+        while True:
+            METRICS.inc("fetcher_requests_total", endpoint="rate_limit")
+            try:
+                rate_limit = self.github.get_rate_limit()
+                break
+            except GithubException as err:
+                print(f"Got exception in RateLimiter.refresh(): {err}")
+                METRICS.inc("fetcher_request_errors_total", endpoint="rate_limit", status=err.status)
+                self.backoff(attempt)
+                attempt += 1
+
+        self.remaining = rate_limit.core.remaining
+        self.reset_time = rate_limit.core.reset
+        METRICS.set("fetcher_rate_limit_remaining", self.remaining)
+
+    def update_from_headers(self, github: Github) -> None:
+        """
+        Update the budget from the rate limit headers of the last response
+        `github` got.
+        """
+        remaining, _ = github.rate_limiting
+        reset_time = datetime.utcfromtimestamp(github.rate_limiting_resettime)
+
+        with self.lock:
+            if self.remaining is None or self.reset_time is None or reset_time > self.reset_time:
+                # This is a new rate limit window.
+                self.remaining = remaining
+                self.reset_time = reset_time
+            elif reset_time == self.reset_time:
+                # Other threads may have taken requests from the budget that
+                # are still in flight, so never raise the budget here.
+                self.remaining = min(self.remaining, remaining)
 
     def maybe_wait(self, buffer_amount: int = 10) -> None:
-        # get the current limit
-        try:
-            rate_limit = self.github.get_rate_limit()
-        except GithubException as err:
-            print(
-                f"Got exception in RateLimiter.maybe_wait(): {err}\nsleeping for 30 seconds and trying again...\n"
-            )
-            sleep(30)
-            return self.maybe_wait(buffer_amount=buffer_amount)
+        """
+        Take one request from the budget, sleeping until the rate limit resets
+        if there are less than `buffer_amount` requests left.
+        """
+        with self.lock:
+            now = datetime.utcnow()
+            if self.remaining is None or self.reset_time is None or now >= self.reset_time:
+                self.refresh()
 
-        remaining = rate_limit.core.remaining
+            assert self.remaining is not None and self.reset_time is not None
 
-        if remaining < buffer_amount:
+            if self.remaining < buffer_amount:
 
-            # The time at which the rate limit is reset.
-            reset_time = rate_limit.core.reset
+                # When to sleep until.  This is just reset_time plus one minute.
+                sleep_until_time = self.reset_time + timedelta(minutes=1)
 
-            # When to sleep until.  This is just reset_time plus one minute.
-            sleep_until_time = reset_time + timedelta(minutes=1)
+                # When to sleep until with a UTC timezone set.
+                utc_sleep_until_time = sleep_until_time.replace(tzinfo=timezone.utc)
 
-            # When to sleep until with a UTC timezone set.
-            utc_sleep_until_time = sleep_until_time.replace(tzinfo=timezone.utc)
+                # How much time until the the rate limit is reset.
+                sleep_delta = sleep_until_time - now
 
-            now = datetime.utcnow()
+                print(f"github rate limit remaining requests is {self.remaining},")
+                print(f"which is less than the buffer amount: {buffer_amount},")
+                print(
+                    f"so sleeping for {sleep_delta.seconds} seconds, until {utc_sleep_until_time.astimezone()}..."
+                )
+
+                # The lock is held while sleeping, so all the other workers
+                # wait for the reset as well.
+                METRICS.inc("fetcher_rate_limit_sleep_seconds_total", sleep_delta.seconds)
+                sleep(sleep_delta.seconds)
+                self.refresh()
+
+            self.remaining -= 1
+            METRICS.set("fetcher_rate_limit_remaining", self.remaining)
 
-            # How much time until the the rate limit is reset.
-            sleep_delta = sleep_until_time - now
 
-            print(f"github rate limit remaining requests is {remaining},")
-            print(f"which is less than the buffer amount: {buffer_amount},")
-            print(
-                f"so sleeping for {sleep_delta.seconds} seconds, until {utc_sleep_until_time.astimezone()}..."
-            )
+class FetchManifest:
+    """
+    A record of which issue numbers have already been fetched, so a crawl can
+    resume without listing the whole data directory.
 
-            sleep(sleep_delta.seconds)
+    It is a small text file in the output directory, like:
+
+        num_issues 41230
+        label_index 412
+        range 1 41876
+        range 41880 41880
+
+    Each `range` line is an inclusive range of issue numbers that have all
+    been fetched: either saved, or found not to exist.  `num_issues` is how
+    many different issues have been saved.  `label_index` is the generation
+    of the `LabelIndex` that has the labels of all of those issues.
+
+    The manifest is only ever written after the issues it covers are on
+    disk, so it can be behind the issue files after a crash, but never ahead
+    of them.
+    """
+
+    def __init__(self, path: Path, ranges: Optional[List[Tuple[int, int]]] = None, num_issues: int = 0) -> None:
+        self.path = path
+        # Sorted, non-overlapping and non-adjacent (low, high) ranges.
+        self.ranges: List[Tuple[int, int]] = []
+        self.num_issues = num_issues
+        # `None` for manifests from before the fetcher kept a label index.
+        self.label_index_generation: Optional[int] = None
+        for low, high in ranges or []:
+            self.add(low, high)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["FetchManifest"]:
+        """
+        Load the manifest at `path`, or return `None` if there isn't one.
+        """
+        if not path.exists():
+            return None
+        manifest = cls(path)
+        for line in path.read_text().splitlines():
+            key, *values = line.split()
+            if key == "num_issues":
+                manifest.num_issues = int(values[0])
+            elif key == "label_index":
+                manifest.label_index_generation = int(values[0])
+            elif key == "range":
+                manifest.add(int(values[0]), int(values[1]))
+        return manifest
+
+    def save(self) -> None:
+        """
+        Write the manifest.  It is written under a temporary name and renamed
+        into place, so a killed fetcher never leaves half a manifest.
+        """
+        lines = [f"num_issues {self.num_issues}"]
+        if self.label_index_generation is not None:
+            lines.append(f"label_index {self.label_index_generation}")
+        lines += [f"range {low} {high}" for low, high in self.ranges]
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def covers(self, issue_num: int) -> bool:
+        i = bisect.bisect_right(self.ranges, (issue_num, sys.maxsize))
+        return i > 0 and self.ranges[i - 1][1] >= issue_num
+
+    def add(self, low: int, high: int) -> None:
+        """
+        Record that every issue number from `low` to `high` has been fetched.
+        """
+        # Ranges `i` up to `j` overlap or touch the new one, so they get
+        # merged with it.  A listing crawl adds one range per issue, so this
+        # doesn't re-sort all of them.
+        i = bisect.bisect_left(self.ranges, (low, low))
+        if i > 0 and self.ranges[i - 1][1] >= low - 1:
+            i -= 1
+        j = bisect.bisect_right(self.ranges, (high + 1, sys.maxsize))
+        if i < j:
+            low = min(low, self.ranges[i][0])
+            high = max(high, self.ranges[j - 1][1])
+        self.ranges[i:j] = [(low, high)]
+
+    def lowest(self) -> Optional[int]:
+        """
+        Return the lowest issue number that has been fetched, or `None` if
+        nothing has been.
+        """
+        return self.ranges[0][0] if self.ranges else None
+
+    def highest(self) -> Optional[int]:
+        """
+        Return the highest issue number that has been fetched, or `None` if
+        nothing has been.
+        """
+        return self.ranges[-1][1] if self.ranges else None
 
 
 class Fetcher:
     def __init__(
         self,
-        github: Github,
+        github_factory: Callable[[], Github],
         repo_str: str = "NixOS/nixpkgs",
         data_dir_str: str = "issue-data",
+        num_workers: int = 1,
+        mode: str = "per-issue",
+        store_dir_str: Optional[str] = None,
+        batch_size: int = 100,
     ) -> None:
-        self.github = github
-        self.rate_limiter = RateLimiter(github)
+        self.github_factory = github_factory
+        self.github = github_factory()
+        self.rate_limiter = RateLimiter(self.github)
         self.rate_limiter.maybe_wait()
-        self.repo: Repository = github.get_repo(repo_str)
+        self.repo_str = repo_str
+        METRICS.inc("fetcher_requests_total", endpoint="repo")
+        self.repo: Repository = self.github.get_repo(repo_str)
         self.data_dir_str = data_dir_str
-        self.issue_files = IssueFiles(data_dir_str)
+        self.issue_files = IssueFiles(data_dir_str, store_dir=store_dir_str)
+        self.num_workers = num_workers
+
+        # If this is set, issues are saved to the Parquet IssueStore in
+        # `store_dir_str` instead of to one json file each in `data_dir_str`.
+        self.issue_store: Optional[IssueStore] = self.issue_files.issue_store
+
+        # The labels of every saved issue, kept up to date as issues are
+        # saved.  This is loaded (or built) on first use by
+        # `get_label_index`, committed along with each batch, and written out
+        # in full by `flush`.
+        self.label_index: Optional[LabelIndex] = None
+
+        # Saved issues are buffered, and written `batch_size` at a time by
+        # `write_batch`.  Only json files are buffered here, since the
+        # IssueStore buffers its own and writes them out every `flush_every`
+        # issues.  Rewriting a partition is much slower than writing a json
+        # file, so in that case each batch is whatever the store just wrote,
+        # and `batch_size` isn't used.
+        self.batch_size = batch_size
+        self.pending_issues: Dict[int, IssueData] = {}
+        self.num_unwritten = 0
+
+        # The newest `updated_at` that `sync_since` has saved every issue up
+        # to.  It is written out along with the next batch, once all of those
+        # issues are on disk.
+        self.pending_high_water_mark: Optional[datetime] = None
+
+        # Which issue numbers have been fetched.  This is loaded (or created)
+        # on first use by `get_manifest`.
+        self.manifest: Optional[FetchManifest] = None
+
+        # How to crawl the issues.  One of:
+        #
+        # - "per-issue": GET each issue number one at a time, walking down
+        #   from the highest issue number.
+        # - "listing": walk down the paginated issue listing, which returns up
+        #   to 100 issues per request.
+        # - "since": only refetch issues that have been created or updated
+        #   since the last crawl (see `sync_since`).
+        if mode not in ("per-issue", "listing", "since"):
+            raise ValueError(f"Unknown fetcher mode: {mode}")
+        self.mode = mode
+
+        # PyGithub objects are not safe to share between threads, so each
+        # worker thread lazily creates its own Github client and Repository.
+        self.thread_local = threading.local()
+        self.thread_local.github = self.github
+        self.thread_local.repo = self.repo
+
+    def thread_repo(self) -> Repository:
+        """
+        Return the Repository object belonging to the current thread.
+        """
+        repo: Optional[Repository] = getattr(self.thread_local, "repo", None)
+        if repo is None:
+            github = self.github_factory()
+            self.rate_limiter.maybe_wait()
+            METRICS.inc("fetcher_requests_total", endpoint="repo")
+            repo = github.get_repo(self.repo_str)
+            self.thread_local.github = github
+            self.thread_local.repo = repo
+        return repo
 
     def get_highest_issue_num(self) -> int:
         self.rate_limiter.maybe_wait()
-        all_issues = self.repo.get_issues(state="all")
-        return all_issues.totalCount
+        # The listing is sorted newest first, so the first issue in it has the
+        # highest number.  (Its totalCount is lower than the highest issue
+        # number whenever issues have been deleted.)
+        all_issues = self.repo.get_issues(state="all", sort="created", direction="desc")
+        METRICS.inc("fetcher_requests_total", endpoint="listing")
+        return all_issues[0].number
 
     def get_lowest_issue_num_already_downloaded(self) -> Optional[int]:
-        lowest: Optional[int] = None
-
-        # loop over all the files in the data directory
-        for issue_num, _ in self.issue_files.files():
-            if lowest is None or issue_num < lowest:
-                lowest = issue_num
-
-        return lowest
+        return self.get_manifest().lowest()
+
+    def manifest_path(self) -> Path:
+        return Path(self.output_dir_str()) / "fetch-manifest.txt"
+
+    def get_manifest(self) -> FetchManifest:
+        """
+        Return the manifest of fetched issues.
+
+        Output directories from before there was a manifest get one made from
+        the issues in them.  Issues were always fetched walking down from the
+        highest number, so everything from the lowest to the highest issue
+        on disk counts as fetched.
+        """
+        if self.manifest is not None:
+            return self.manifest
+
+        manifest: Optional[FetchManifest] = FetchManifest.load(self.manifest_path())
+        if manifest is None:
+            lowest: Optional[int] = None
+            highest: Optional[int] = None
+            num_issues = 0
+
+            # loop over all the issues already downloaded
+            for issue_num in self.issue_files.issue_nums():
+                if lowest is None or issue_num < lowest:
+                    lowest = issue_num
+                if highest is None or issue_num > highest:
+                    highest = issue_num
+                num_issues += 1
+
+            ranges = [] if lowest is None or highest is None else [(lowest, highest)]
+            manifest = FetchManifest(self.manifest_path(), ranges, num_issues)
+            if num_issues > 0:
+                manifest.save()
+
+        self.manifest = manifest
+        return manifest
+
+    def get_label_index(self) -> LabelIndex:
+        """
+        Return the label index of the saved issues.
+
+        The manifest records which generation of the index goes with the
+        issues it covers, and the index is always committed before the
+        manifest, so an index at least that new can be used as is.  Only if
+        there isn't one (like for output directories from before the fetcher
+        kept an index) is it checked against the issues themselves, which
+        means listing every issue.
+        """
+        if self.label_index is not None:
+            return self.label_index
+
+        manifest = self.get_manifest()
+        label_index: Optional[LabelIndex] = None
+        if manifest.label_index_generation is not None:
+            label_index = LabelIndex.load(LabelIndex.index_dir_for(self.issue_files))
+            if label_index is not None and label_index.generation < manifest.label_index_generation:
+                label_index = None
+        if label_index is None:
+            label_index = LabelIndex.open(self.issue_files, save=True)
+
+        self.label_index = label_index
+        return label_index
+
+    def mark_fetched(self, low: int, high: int) -> None:
+        """
+        Record that every issue number from `low` to `high` has been fetched.
+        This is written to the manifest with the next batch of issues.
+        """
+        self.get_manifest().add(low, high)
+
+    def high_water_mark_path(self) -> Path:
+        return Path(self.output_dir_str()) / "high-water-mark.txt"
+
+    def get_high_water_mark(self) -> Optional[datetime]:
+        """
+        Return the newest `updated_at` of all the issues already downloaded,
+        or `None` if no issues have been downloaded.
+
+        This is normally read from the high water mark file written by
+        `sync_since`, but if that doesn't exist yet, it is calculated from the
+        downloaded issue files.
+        """
+        path = self.high_water_mark_path()
+        if path.exists():
+            return datetime.fromisoformat(path.read_text().strip())
+
+        newest: Optional[str] = self.issue_files.newest_updated_at()
+        return None if newest is None else datetime.fromisoformat(newest)
+
+    def save_high_water_mark(self, high_water_mark: datetime) -> None:
+        # This isn't written until every issue up to the high water mark is
+        # actually on disk, which is at the end of the current batch.
+        self.pending_high_water_mark = high_water_mark
+
+    def output_dir_str(self) -> str:
+        """
+        Return the directory issues are saved to.
+        """
+        return self.data_dir_str if self.issue_store is None else self.issue_store.store_dir
+
+    def incoming_dir(self) -> Path:
+        """
+        Return the directory each batch of json files is written to before
+        being renamed into the data directory.
+        """
+        return Path(self.data_dir_str) / ".incoming"
 
     def create_data_dir(self) -> None:
-        Path(self.data_dir_str).mkdir(parents=True, exist_ok=True)
+        Path(self.output_dir_str()).mkdir(parents=True, exist_ok=True)
+        # Anything left in here is from a batch that a killed fetcher never
+        # finished writing.  Those issues aren't in the manifest, so they
+        # will be fetched again.
+        shutil.rmtree(self.incoming_dir(), ignore_errors=True)
 
     def save_issue(self, issue_num: int, issue_data: IssueData) -> None:
-        path = Path(self.data_dir_str) / f"{issue_num:06}.json"
-
-        issue_data_json = MyEncoder().encode(issue_data)
-
-        with path.open(mode="w") as f:
-            f.write(issue_data_json)
+        # These make it possible to see how far along a crawl is, and whether
+        # it has stalled.
+        METRICS.inc("fetcher_issues_saved_total")
+        METRICS.set("fetcher_last_saved_issue_number", issue_num)
+        METRICS.set("fetcher_last_saved_timestamp_seconds", time())
+
+        self.get_label_index().add_issue(issue_data)
+
+        manifest = self.get_manifest()
+        if not manifest.covers(issue_num):
+            manifest.num_issues += 1
+        manifest.add(issue_num, issue_num)
+
+        if self.issue_store is not None:
+            self.issue_store.add(issue_data.to_dict())
+            # The store just wrote out its buffer, so everything saved so far
+            # is on disk.
+            if not self.issue_store.buffer:
+                self.write_batch()
+            return
+
+        self.pending_issues[issue_num] = issue_data
+        self.num_unwritten += 1
+        if self.num_unwritten >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self) -> None:
+        """
+        Write out the issues buffered by `save_issue`, then their labels to
+        the label index, then the manifest and the high water mark.
+
+        Each json file is written in full to the incoming directory first,
+        and then atomically renamed into the data directory, so the data
+        directory never has a partly written file in it.  Like
+        `IssueStore.flush`, the files are renamed highest issue number first,
+        which keeps the issues on disk contiguous if the fetcher is killed
+        partway through.
+        """
+        if self.issue_store is not None:
+            self.issue_store.flush()
+        elif self.pending_issues:
+            incoming_dir = self.incoming_dir()
+            incoming_dir.mkdir(parents=True, exist_ok=True)
+
+            issue_nums = sorted(self.pending_issues, reverse=True)
+            for issue_num in issue_nums:
+                # Encoded to bytes once, both to write and to count.
+                issue_data_bytes = self.pending_issues[issue_num].to_json().encode("utf-8")
+                (incoming_dir / f"{issue_num:06}.json").write_bytes(issue_data_bytes)
+                METRICS.inc("issue_bytes_written_total", len(issue_data_bytes), format="json")
+            for issue_num in issue_nums:
+                os.replace(incoming_dir / f"{issue_num:06}.json", Path(self.data_dir_str) / f"{issue_num:06}.json")
+            incoming_dir.rmdir()
+            self.pending_issues = {}
+
+        if self.label_index is not None:
+            self.get_manifest().label_index_generation = self.label_index.commit()
+        if self.manifest is not None:
+            self.manifest.save()
+        if self.pending_high_water_mark is not None:
+            self.high_water_mark_path().write_text(f"{self.pending_high_water_mark}\n")
+            self.pending_high_water_mark = None
+        self.num_unwritten = 0
+        METRICS.inc("fetcher_batches_written_total")
+
+    def flush(self) -> None:
+        """
+        Write out any issues that `save_issue` has buffered, the manifest, and
+        the label index.
+        """
+        self.write_batch()
+        # Saving the index with the fingerprint of the issues lets
+        # `LabelIndex.open` use it without rebuilding it.  Fingerprinting
+        # lists every issue, so this is only done once, at the end of a run.
+        # It has to come after the issues themselves are written, so that the
+        # fingerprint is of the issues the index describes.
+        if self.label_index is not None:
+            self.label_index.save(self.issue_files.fingerprint())
 
     def get_issue_data_and_save_to_file(self, issue_num: int) -> None:
         issue_data: Optional[IssueData] = self.get_issue_data(issue_num)
         if issue_data is not None:
             self.save_issue(issue_num, issue_data)
+        else:
+            self.mark_fetched(issue_num, issue_num)
 
     def get_issue_data(self, issue_num: int) -> Optional[IssueData]:
         issue: Optional[Issue] = self.get_issue(issue_num)
@@ -110,42 +549,237 @@ class Fetcher:
         return None
 
     def get_issue(self, issue_num: int) -> Optional[Issue]:
-        self.rate_limiter.maybe_wait()
-
-        try:
-            issue: Issue = self.repo.get_issue(issue_num)
-        except GithubException as err:
-            if err.status == 404:
-                print(f"Issue not found: {issue_num}, skipping...")
-                return None
-            else:
-                print(
-                    f"Got exception in Fetcher.get_issue() while fetching issue number {issue_num}: {err}\nsleeping for 30 seconds and trying again...\n"
-                )
-                sleep(30)
-                return self.get_issue(issue_num=issue_num)
-
-        return issue
+        attempt = 0
+        while True:
+            self.rate_limiter.maybe_wait()
+
+            METRICS.inc("fetcher_requests_total", endpoint="issue")
+            try:
+                issue: Issue = self.thread_repo().get_issue(issue_num)
+                self.rate_limiter.update_from_headers(self.thread_local.github)
+                return issue
+            except GithubException as err:
+                if err.status == 404:
+                    self.rate_limiter.update_from_headers(self.thread_local.github)
+                    print(f"Issue not found: {issue_num}, skipping...")
+                    METRICS.inc("fetcher_not_found_total")
+                    return None
+                else:
+                    print(f"Got exception in Fetcher.get_issue() while fetching issue number {issue_num}: {err}")
+                    METRICS.inc("fetcher_request_errors_total", endpoint="issue", status=err.status)
+                    if err.status == 403:
+                        # This is most likely the rate limit being hit.
+                        self.rate_limiter.invalidate()
+                    self.rate_limiter.backoff(attempt)
+                    attempt += 1
 
     def get_issues_from(self, starting_issue_num: int) -> None:
+        if self.num_workers > 1:
+            self.get_issues_from_concurrently(starting_issue_num)
+            return
+
         for issue_num in range(starting_issue_num, 0, -1):
             if issue_num % 200 == 0:
                 print(f"Getting issue number {issue_num}...")
             self.get_issue_data_and_save_to_file(issue_num)
 
+    def get_issues_from_concurrently(self, starting_issue_num: int, window_size: Optional[int] = None) -> None:
+        """
+        Like `get_issues_from`, but with `self.num_workers` requests in flight
+        at once.
+
+        Issue numbers are handed out to the workers in windows, and the issues
+        in each window are saved in the same descending order that
+        `get_issues_from` uses.  This means every issue above the lowest one on
+        disk has always been fetched, so resuming with
+        `get_lowest_issue_num_already_downloaded` works exactly the same way.
+        """
+        if window_size is None:
+            window_size = self.num_workers * 8
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for window_start in range(starting_issue_num, 0, -window_size):
+                window = range(window_start, max(window_start - window_size, 0), -1)
+                for issue_num, issue_data in zip(window, executor.map(self.get_issue_data, window)):
+                    if issue_num % 200 == 0:
+                        print(f"Getting issue number {issue_num}...")
+                    if issue_data is not None:
+                        self.save_issue(issue_num, issue_data)
+                    else:
+                        self.mark_fetched(issue_num, issue_num)
+
+    def get_listing_page(self, listing: PaginatedList, page_num: int) -> List[Issue]:
+        """
+        Return page number `page_num` (starting from 0) of an issue listing,
+        retrying on errors.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.maybe_wait()
+            METRICS.inc("fetcher_requests_total", endpoint="listing")
+            try:
+                page: List[Issue] = listing.get_page(page_num)
+                self.rate_limiter.update_from_headers(self.github)
+                return page
+            except GithubException as err:
+                print(f"Got exception in Fetcher.get_listing_page() while fetching page {page_num}: {err}")
+                METRICS.inc("fetcher_request_errors_total", endpoint="listing", status=err.status)
+                if err.status == 403:
+                    self.rate_limiter.invalidate()
+                self.rate_limiter.backoff(attempt)
+                attempt += 1
+
+    def get_issues_from_listing(self, lowest_issue_num_already_downloaded: Optional[int]) -> None:
+        """
+        Save every issue that the manifest doesn't already have, reading them
+        from the paginated issue listing instead of GETting them one at a
+        time.
+
+        The listing is sorted by issue number, highest first, and contains
+        both issues and PRs, just like the files in the data directory.  So
+        the crawl can resume from about the page after the number of files
+        already downloaded.
+
+        Transferred issues are the exception: they get a new (high) number,
+        but keep their place in the listing.  So until the whole listing has
+        been read, only the issues actually seen are marked as fetched, not
+        the numbers between them, since a missing number may still be further
+        down the listing.
+        """
+        all_issues = self.repo.get_issues(state="all", sort="created", direction="desc")
+
+        page_num = 0
+        if lowest_issue_num_already_downloaded is not None:
+            num_already_downloaded = self.get_manifest().num_issues
+            page_num = num_already_downloaded // self.github.per_page
+
+            # If issues have been deleted since the last crawl, the start page
+            # may be a little too far along, so back up until it isn't.
+            while page_num > 0:
+                page = self.get_listing_page(all_issues, page_num)
+                if len(page) > 0 and page[0].number >= lowest_issue_num_already_downloaded:
+                    break
+                page_num -= 1
+
+        manifest = self.get_manifest()
+        while True:
+            page = self.get_listing_page(all_issues, page_num)
+            if len(page) == 0:
+                break
+
+            print(f"Getting issue listing page {page_num} (issue number {page[0].number})...")
+            for issue in page:
+                # `save_issue` marks each issue as fetched.
+                if not manifest.covers(issue.number):
+                    self.save_issue(issue.number, IssueData.from_listed_issue(issue))
+            page_num += 1
+
+        # The whole listing has been read, so any number up to the highest
+        # one that wasn't in it doesn't exist.
+        highest = manifest.highest()
+        if highest is not None:
+            self.mark_fetched(1, highest)
+
+    def sync_since(self) -> None:
+        """
+        Refetch every issue that has been created or updated since the high
+        water mark, overwriting the old files for those issues.
+
+        The issue listing is walked oldest update first, and the high water
+        mark is saved with the first batch written after each page.  Each
+        page is requested starting from the current high water mark (instead
+        of just asking for the next page number), so issues that get updated
+        during the sync and move to the end of the listing don't cause other
+        issues to be skipped.  That means each request returns the issues
+        updated at exactly the high water mark again, so those are skipped if
+        they were already saved.
+        """
+        high_water_mark: Optional[datetime] = self.get_high_water_mark()
+        print(f"Syncing issues updated since: {high_water_mark}")
+
+        page_num = 0
+        num_saved = 0
+        # The issues saved so far that were updated at the high water mark.
+        saved_at_high_water_mark: Set[int] = set()
+        while True:
+            if high_water_mark is None:
+                listing = self.repo.get_issues(state="all", sort="updated", direction="asc")
+            else:
+                listing = self.repo.get_issues(state="all", sort="updated", direction="asc", since=high_water_mark)
+            page = self.get_listing_page(listing, page_num)
+
+            for issue in page:
+                if issue.updated_at == high_water_mark and issue.number in saved_at_high_water_mark:
+                    continue
+                self.save_issue(issue.number, IssueData.from_listed_issue(issue))
+                num_saved += 1
+
+            if len(page) == 0:
+                break
+
+            newest_in_page: datetime = page[-1].updated_at
+            if newest_in_page == high_water_mark:
+                # A whole page of issues were all updated in the same second,
+                # so asking from the high water mark again would return this
+                # same page.
+                page_num += 1
+            else:
+                page_num = 0
+                high_water_mark = newest_in_page
+                self.save_high_water_mark(high_water_mark)
+                saved_at_high_water_mark = set()
+            saved_at_high_water_mark.update(issue.number for issue in page if issue.updated_at == high_water_mark)
+
+            if len(page) < self.github.per_page:
+                break
+
+        if high_water_mark is not None:
+            self.save_high_water_mark(high_water_mark)
+
+        print(f"Synced {num_saved} issues, up to: {high_water_mark}")
+
     @classmethod
     def from_env(cls):
         github_api_token: str = os.environ["GITHUB_API_TOKEN"]
-        github = Github(github_api_token)
-        return cls(github)
+        # This can be pointed at a local stub server (see
+        # issue_tagging_bot/stub_github.py) for testing.
+        github_api_url: str = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+        num_workers: int = int(os.environ.get("FETCHER_NUM_WORKERS", "1"))
+        mode: str = os.environ.get("FETCHER_MODE", "per-issue")
+        store_dir_str: Optional[str] = os.environ.get("FETCHER_STORE_DIR")
+        batch_size: int = int(os.environ.get("FETCHER_BATCH_SIZE", "100"))
+        return cls(
+            lambda: Github(github_api_token, base_url=github_api_url, per_page=100),
+            num_workers=num_workers,
+            mode=mode,
+            store_dir_str=store_dir_str,
+            batch_size=batch_size,
+        )
 
     def run(self) -> None:
         self.create_data_dir()
+        try:
+            self.crawl()
+        finally:
+            self.flush()
+
+    def crawl(self) -> None:
+        if self.mode == "since":
+            self.sync_since()
+            return
+
         lowest_issue_num_already_downloaded: Optional[
             int
         ] = self.get_lowest_issue_num_already_downloaded()
         start_issue_num: int
 
+        if self.mode == "listing":
+            if lowest_issue_num_already_downloaded is not None and lowest_issue_num_already_downloaded <= 1:
+                print("Already downloaded all issues! Ending.")
+                sys.exit(0)
+            self.get_issues_from_listing(lowest_issue_num_already_downloaded)
+            return
+
         if lowest_issue_num_already_downloaded is None:
             start_issue_num = self.get_highest_issue_num()
         elif lowest_issue_num_already_downloaded <= 1:
@@ -160,8 +794,9 @@ class Fetcher:
 
 
 def main() -> None:
-    fetcher = Fetcher.from_env()
-    fetcher.run()
+    with MetricsExporter.from_env():
+        fetcher = Fetcher.from_env()
+        fetcher.run()
 
 
 if __name__ == "__main__":
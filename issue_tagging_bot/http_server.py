@@ -0,0 +1,16 @@
+"""
+HTTP server plumbing shared by the inference server and the stub GitHub API.
+"""
+
+from http.server import ThreadingHTTPServer
+
+
+class BacklogHTTPServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server with a longer listen backlog.  The default backlog
+    of 5 makes connections from many concurrent clients (like the fetcher's
+    workers, or a burst of webhooks) get dropped and retried.
+    """
+
+    request_queue_size = 128
+    daemon_threads = True
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+"""
+Tagging new issues with a trained model.
+
+`train.py` saves the trained Keras model with `save_model`, which also writes
+the names of the topic labels the model predicts and how long the input text
+is.  This module loads that back, and serves predictions over HTTP:
+
+    $ python3 -m issue_tagging_bot.inference --model-dir trained-model --port 8080
+
+The server accepts a POST of a GitHub `issues` webhook payload (or just the
+issue object from one) and responds with the predicted topic labels:
+
+    $ curl -d '{"issue": {"user": {"login": "me"}, "title": "...", "body": "..."}}' localhost:8080/webhook
+    {"labels": ["6.topic: nixos"], "scores": {"6.topic: nixos": 0.93, ...}}
+
+Concurrent requests are micro-batched by `TopicPredictor`, so the model is
+called once for a batch of issues instead of once per issue.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np  # type: ignore
+
+from issue_tagging_bot.http_server import BacklogHTTPServer
+from issue_tagging_bot.issue_data import encode_texts, input_text
+
+# The file in the model directory with everything besides the model itself
+# that is needed to make predictions.
+METADATA_FILE = "tagging-bot.json"
+
+
+def save_model(
+    model: Any,
+    model_dir: str,
+    labels: List[str],
+    input_text_len: int = 1000,
+    thresholds: Optional[Dict[str, float]] = None,
+) -> None:
+    """
+    Save a trained Keras `model` to `model_dir`, along with the `labels` that
+    each of its outputs predicts, the `input_text_len` it was trained with,
+    and the score `thresholds` above which each label is predicted.
+    """
+    model.save(model_dir)
+    metadata = {
+        "labels": labels,
+        "input_text_len": input_text_len,
+        "thresholds": {} if thresholds is None else thresholds,
+    }
+    with open(Path(model_dir) / METADATA_FILE, "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def load_model(model_dir: str) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Load a model saved with `save_model`.  Returns the Keras model and a dict
+    with its `labels`, `input_text_len`, and `thresholds`.
+    """
+    import tensorflow as tf  # type: ignore
+
+    with open(Path(model_dir) / METADATA_FILE) as f:
+        metadata: Dict[str, Any] = json.load(f)
+    # The model is only used for predictions, so the (possibly custom) loss
+    # it was trained with is not needed.
+    return tf.keras.models.load_model(model_dir, compile=False), metadata
+
+
+def issue_fields(payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Return the author's username, title, and body from a GitHub `issues`
+    webhook payload, a bare GitHub issue, or a dict in the same format as the
+    downloaded `IssueData` json.
+    """
+    issue = payload.get("issue", payload)
+    user_login = issue["user"]["login"] if "user" in issue else issue.get("user_login")
+    return user_login, issue.get("title"), issue.get("body")
+
+
+class TopicPredictor:
+    """
+    Predicts topic labels for issues with a trained Keras model.
+
+    `predict` can be called from many threads at once.  Each call puts its
+    encoded issue on a queue, and a single worker thread takes up to
+    `max_batch_size` issues off the queue at a time and runs the model on
+    them together.  The worker waits at most `max_wait_seconds` after the
+    first issue for more issues to fill out the batch, so a lone request is
+    only delayed by that much.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        labels: List[str],
+        input_text_len: int = 1000,
+        thresholds: Optional[Dict[str, float]] = None,
+        default_threshold: float = 0.5,
+        max_batch_size: int = 64,
+        max_wait_seconds: float = 0.005,
+    ) -> None:
+        self.model = model
+        self.labels = labels
+        self.input_text_len = input_text_len
+        thresholds = {} if thresholds is None else thresholds
+        self.thresholds: np.ndarray = np.array([thresholds.get(label, default_threshold) for label in labels])
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+
+        self.requests: "queue.Queue[Tuple[np.ndarray, Future]]" = queue.Queue()
+        # The sizes of the most recent batches, for seeing how well requests
+        # are being batched.  Only the last few are kept, so a long-running
+        # server doesn't grow this forever.
+        self.batch_sizes: Deque[int] = collections.deque(maxlen=10000)
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def from_model_dir(cls, model_dir: str, **kwargs: Any) -> "TopicPredictor":
+        """
+        Load a model saved with `save_model`.
+        """
+        model, metadata = load_model(model_dir)
+        return cls(model, metadata["labels"], metadata["input_text_len"], metadata["thresholds"], **kwargs)
+
+    def encode(self, payload: Dict[str, Any]) -> np.ndarray:
+        """
+        Encode a single issue the same way `Stage2PreprocData` encodes the
+        training data.  Returns an int8 array of shape (input_text_len,).
+        """
+        text = input_text(*issue_fields(payload), input_text_len=self.input_text_len)
+        return encode_texts([text], self.input_text_len)[0]
+
+    def predict(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Return the predicted labels for a single issue (see `issue_fields`
+        for what `payload` can be), and the model's score for every label.
+        """
+        future: Future = Future()
+        self.requests.put((self.encode(payload), future))
+        scores: np.ndarray = future.result(timeout)
+        return {
+            "labels": [label for label, score, threshold in zip(self.labels, scores, self.thresholds) if score >= threshold],
+            "scores": {label: float(score) for label, score in zip(self.labels, scores)},
+        }
+
+    def _next_batch(self) -> List[Tuple[np.ndarray, Future]]:
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            self.batch_sizes.append(len(batch))
+            try:
+                scores = np.asarray(self.model.predict_on_batch(np.stack([encoded for encoded, _ in batch])))
+                scores = scores.reshape((len(batch), -1))
+            except Exception as e:
+                # Every waiting request has to be told, or it would wait
+                # forever.
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), issue_scores in zip(batch, scores):
+                future.set_result(issue_scores)
+
+
+class InferenceServer:
+    """
+    An HTTP server answering POSTs to `/webhook` with the predictions from a
+    `TopicPredictor`, and GETs to `/healthz` with a 200.
+
+    Can be used as a context manager, which serves in a background thread.
+
+    If the model fails, or a prediction takes longer than `timeout_seconds`,
+    the request gets a 500.
+    """
+
+    def __init__(
+        self, predictor: TopicPredictor, host: str = "127.0.0.1", port: int = 8080, timeout_seconds: float = 30
+    ) -> None:
+        self.predictor = predictor
+        self.timeout_seconds = timeout_seconds
+        self.httpd = BacklogHTTPServer((host, port), self._make_handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "InferenceServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "InferenceServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _make_handler(self):
+        predictor = self.predictor
+        timeout_seconds = self.timeout_seconds
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open between requests from the same client.
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, status: int, body: Any) -> None:
+                encoded = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def do_GET(self) -> None:
+                if self.path == "/healthz":
+                    self.send_json(200, {"status": "ok"})
+                else:
+                    self.send_json(404, {"message": "Not Found"})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", "0"))
+                raw_body = self.rfile.read(length)
+                if self.path.rstrip("/") != "/webhook":
+                    self.send_json(404, {"message": "Not Found"})
+                    return
+                try:
+                    payload = json.loads(raw_body)
+                    issue_fields(payload)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self.send_json(400, {"message": "Expected a GitHub issue or issues webhook payload"})
+                    return
+                try:
+                    prediction = predictor.predict(payload, timeout=timeout_seconds)
+                except concurrent.futures.TimeoutError:
+                    self.send_json(500, {"message": f"Timed out after {timeout_seconds}s waiting for the model"})
+                    return
+                except Exception as e:
+                    self.send_json(500, {"message": f"Prediction failed: {e}"})
+                    return
+                self.send_json(200, prediction)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve topic label predictions for new issues.")
+    parser.add_argument("--model-dir", default="trained-model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--timeout-seconds", type=float, default=30)
+    args = parser.parse_args()
+
+    predictor = TopicPredictor.from_model_dir(
+        args.model_dir, max_batch_size=args.max_batch_size, max_wait_seconds=args.max_wait_ms / 1000
+    )
+    server = InferenceServer(predictor, host=args.host, port=args.port, timeout_seconds=args.timeout_seconds)
+    print(f"Serving predictions for {len(predictor.labels)} labels on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
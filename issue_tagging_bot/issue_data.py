@@ -1,38 +1,83 @@
+from __future__ import annotations
+
+import abc
+import collections
+import hashlib
 import json
 import os
+import pickle
+import shutil
 import sys
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Iterator, List, Tuple
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
 
 from github import Issue  # type: ignore
-from sklearn.preprocessing import MultiLabelBinarizer  # type: ignore
-import numpy as np  # type: ignore
-import pandas as pd  # type: ignore
-import tensorflow as tf  # type: ignore
+
+from issue_tagging_bot.issue_store import DATE_COLUMNS, ISSUE_COLUMNS, IssueStore
+from issue_tagging_bot.label_index import LabelIndex
+from issue_tagging_bot.lazy_import import lazy_import
+from issue_tagging_bot.metrics import METRICS
+
+# These are only imported on first use, so that things that only need
+# `IssueData` or `IssueFiles.files()` (like the fetcher) start up quickly.
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+scipy_sparse = lazy_import("scipy.sparse")
+tf = lazy_import("tensorflow")
 
 
 class MyEncoder(json.JSONEncoder):
+    """
+    Encodes `IssueData` and `LabelData`.  `IssueData.to_json` is faster and
+    gives exactly the same json, so this is only kept for code that still
+    encodes them with it.
+    """
+
     def default(self, o):
         if isinstance(o, LabelData):
-            return o.__dict__
+            return o.to_dict()
         if isinstance(o, IssueData):
-            return o.__dict__
+            return o.to_dict()
         return super(MyEncoder, self).default(o)
 
 
 class LabelData:
+    # There are only a few hundred different labels, shared by hundreds of
+    # thousands of issues, so the strings are interned to keep only one copy
+    # of each in memory.
+    __slots__ = ("name", "url")
+
     def __init__(self, name, url) -> None:
-        self.name = name
-        self.url = url
+        self.name = sys.intern(name)
+        self.url = sys.intern(url)
 
     @classmethod
     def from_label(cls, label):
         label_data = cls(label.name, label.url)
         return label_data
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "url": self.url}
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "LabelData":
+        return cls(record["name"], record["url"])
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, LabelData) and self.name == other.name and self.url == other.url
+
+    def __repr__(self) -> str:
+        return f"LabelData({self.name!r}, {self.url!r})"
+
 
 class IssueData:
+    # Using slots instead of a `__dict__` for each issue saves a lot of memory
+    # when holding many of them.  The slots are the keys of the json, in
+    # order.
+    __slots__ = tuple(ISSUE_COLUMNS)
+
     def __init__(
         self,
         id_,
@@ -53,7 +98,7 @@ class IssueData:
         self.id = id_
         self.url = url
         self.number = number
-        self.state = state
+        self.state = sys.intern(state)
         self.title = title
         self.body = body
         self.user_login = user_login
@@ -65,8 +110,88 @@ class IssueData:
         self.updated_at = None if updated_at is None else str(updated_at)
         self.is_issue = pull_request is None
 
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return a dict with the same keys and values as the json written for
+        this issue.
+        """
+        # Spelled out rather than looping over `__slots__`, since this is
+        # called for every issue that is saved.
+        return {
+            "id": self.id,
+            "url": self.url,
+            "number": self.number,
+            "state": self.state,
+            "title": self.title,
+            "body": self.body,
+            "user_login": self.user_login,
+            "user_id": self.user_id,
+            "labels": [{"name": label.name, "url": label.url} for label in self.labels],
+            "comments": self.comments,
+            "closed_at": self.closed_at,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "is_issue": self.is_issue,
+        }
+
+    def to_json(self) -> str:
+        """
+        Return the json written for this issue.  This is exactly what
+        `MyEncoder().encode(self)` returns, but it is encoded entirely by the
+        json module's C encoder, without calling back into Python for each
+        object.
+        """
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "IssueData":
+        """
+        Return the `IssueData` for a dict like the ones returned by `to_dict`
+        (or read from an issue's json).
+        """
+        # `__init__` takes PyGithub objects, so the slots are filled in
+        # directly instead.
+        issue_data = cls.__new__(cls)
+        for field in ISSUE_COLUMNS:
+            setattr(issue_data, field, record[field])
+        issue_data.state = sys.intern(record["state"])
+        issue_data.labels = [LabelData(label["name"], label["url"]) for label in record["labels"]]
+        return issue_data
+
+    @classmethod
+    def from_json(cls, raw_json: str) -> "IssueData":
+        """
+        Return the `IssueData` for the json of an issue, as written by
+        `to_json`.  `from_json(issue_data.to_json()).to_json()` is always the
+        same as `issue_data.to_json()`.
+        """
+        return cls.from_dict(json.loads(raw_json))
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, IssueData) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"IssueData(number={self.number!r}, title={self.title!r})"
+
     @classmethod
     def from_issue(cls, issue: Issue):
+        return cls._from_issue(issue, issue.pull_request)
+
+    @classmethod
+    def from_listed_issue(cls, issue: Issue):
+        """
+        Like `from_issue`, but for an issue that came from a paginated listing
+        like `repo.get_issues()`.
+
+        PyGithub doesn't treat listed issues as complete, so reading an
+        attribute that is missing from the listing JSON makes it GET the whole
+        issue.  `pull_request` is only present in the JSON for PRs, so it is
+        read straight from the raw listing data instead.
+        """
+        return cls._from_issue(issue, issue._rawData.get("pull_request"))
+
+    @classmethod
+    def _from_issue(cls, issue: Issue, pull_request):
         issue_data = cls(
             issue.id,
             issue.url,
@@ -81,11 +206,40 @@ class IssueData:
             issue.closed_at,
             issue.created_at,
             issue.updated_at,
-            issue.pull_request,
+            pull_request,
         )
         return issue_data
 
 
+def parse_issue_files(files: List[Tuple[int, Path]], columns: List[str], only_issues: bool) -> pd.DataFrame:
+    """
+    Parse a list of issue json files into a DataFrame with only `columns`
+    (and only issues, not PRs, if `only_issues` is true).
+
+    `files` is a list of tuples of row indicies and paths.
+
+    This is a top-level function so that it can be run in a process pool by
+    `IssueFiles.data_frame_chunks`.
+    """
+    index: List[int] = []
+    values: Dict[str, List[Any]] = {column: [] for column in columns}
+    for position, path in files:
+        with open(path, "r") as f:
+            record: Dict[str, Any] = json.load(f)
+        if only_issues and not record["is_issue"]:
+            continue
+
+        index.append(position)
+        for column in columns:
+            values[column].append(record[column])
+
+    chunk = pd.DataFrame(values, index=index, columns=columns)
+    for column in DATE_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = pd.to_datetime(chunk[column])
+    return chunk
+
+
 class IssueFiles:
     """
     This class contains helpful functions for operating on the issue data that
@@ -94,8 +248,18 @@ class IssueFiles:
     downloaded issues (not PRs).
     """
 
-    def __init__(self, data_dir: str = "issue-data") -> None:
+    def __init__(self, data_dir: str = "issue-data", store_dir: Optional[str] = None, num_processes: int = 1) -> None:
+        """
+        If `store_dir` is given, issues are read from the Parquet
+        `IssueStore` in that directory instead of from the json files in
+        `data_dir`.
+
+        If `num_processes` is more than 1, json files are parsed in a pool of
+        that many processes.
+        """
         self.data_dir = data_dir
+        self.num_processes = num_processes
+        self.issue_store: Optional[IssueStore] = None if store_dir is None else IssueStore(store_dir)
 
     def files(self) -> Iterator[Tuple[int, Path]]:
         """
@@ -123,6 +287,50 @@ class IssueFiles:
                 # TODO: Should probably use actual path manipulation functions for this.
                 yield issue_num, Path(f"{self.data_dir}/{f}")
 
+    def fingerprint(self) -> str:
+        """
+        Return a short hash that changes whenever issues are added, changed,
+        or removed.
+
+        This is based on the names, sizes and modification times of the issue
+        files (or Parquet partitions), so it only needs to stat each file, not
+        read it.
+        """
+        paths: List[Path]
+        if self.issue_store is not None:
+            paths = self.issue_store.partition_paths()
+        else:
+            paths = [path for _, path in self.files()]
+
+        digest = hashlib.sha256()
+        for path in paths:
+            stat = path.stat()
+            digest.update(f"{path.name} {stat.st_size} {stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def issue_nums(self) -> Iterator[int]:
+        """
+        Return an iterator of the numbers of all the downloaded issues.
+        """
+        if self.issue_store is not None:
+            return self.issue_store.issue_nums()
+        return (issue_num for issue_num, _ in self.files())
+
+    def newest_updated_at(self) -> Optional[str]:
+        """
+        Return the newest `updated_at` of all the downloaded issues, or `None`
+        if there are no issues.
+        """
+        if self.issue_store is not None:
+            return self.issue_store.newest_updated_at()
+
+        newest: Optional[str] = None
+        for raw_json in self.raws():
+            updated_at: Optional[str] = json.loads(raw_json)["updated_at"]
+            if updated_at is not None and (newest is None or updated_at > newest):
+                newest = updated_at
+        return newest
+
     def raws(self) -> Iterator[str]:
         """
         Return an iterator of raw json files for each issue.
@@ -131,6 +339,15 @@ class IssueFiles:
             with open(path, "r") as f:
                 yield f.read()
 
+    def issues(self) -> Iterator[IssueData]:
+        """
+        Return an iterator of an `IssueData` for each downloaded issue (and
+        PR), lowest issue numbers first.
+        """
+        if self.issue_store is not None:
+            return map(IssueData.from_dict, self.issue_store.records())
+        return map(IssueData.from_json, self.raws())
+
     def data_frames(self) -> Iterator[pd.DataFrame]:
         """
         Return a DataFrame for each raw json issue.
@@ -138,25 +355,151 @@ class IssueFiles:
         for raw_json in self.raws():
             yield pd.read_json(f"[{raw_json}]", orient="records")
 
-    def data_frame(self) -> pd.DataFrame:
+    def data_frame_chunks(
+        self,
+        columns: Optional[List[str]] = None,
+        only_issues: bool = False,
+        chunk_size: int = 10000,
+        min_issue_num: int = 0,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Return an iterator of DataFrames, each containing info from up to
+        `chunk_size` issues.
+
+        Each json file is parsed on its own, and only the values for `columns`
+        (or all columns) are kept.  If `only_issues` is true, PRs are dropped
+        as they are parsed.  This means memory use only grows with the data
+        that is actually kept, not with the size of the json files.
+
+        If `self.num_processes` is more than 1, the chunks are parsed in a
+        pool of that many processes.  The chunks are still returned in the
+        same order, and only a couple of chunks per process are parsed ahead
+        of the one being returned, so memory use still only depends on
+        `chunk_size`.
+
+        The row indicies carry on from one chunk to the next, and are the same
+        as the ones `data_frame` would give each row.
+
+        Only issues numbered `min_issue_num` or higher are returned, and the
+        files of lower numbered issues are never opened.
+
+        When reading from an `IssueStore`, there is one chunk per partition
+        instead of per `chunk_size` issues.
+        """
+        if self.issue_store is not None:
+            yield from self.issue_store.data_frame_chunks(columns, only_issues, min_issue_num=min_issue_num)
+            return
+
+        keep: List[str] = ISSUE_COLUMNS if columns is None else columns
+
+        files: List[Tuple[int, Path]] = [
+            (position, path)
+            for position, (issue_num, path) in enumerate(self.files())
+            if issue_num >= min_issue_num
+        ]
+        shards = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+        if self.num_processes <= 1:
+            chunks: Iterator[pd.DataFrame] = (parse_issue_files(shard, keep, only_issues) for shard in shards)
+            yield from self._counted_chunks(shards, chunks)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.num_processes) as executor:
+            # Unlike `executor.map`, which would parse every shard straight
+            # away and hold on to all of them until they're used.
+            in_flight: Deque[Future] = collections.deque()
+            remaining_shards = iter(shards)
+
+            def submit_next() -> None:
+                for shard in remaining_shards:
+                    in_flight.append(executor.submit(parse_issue_files, shard, keep, only_issues))
+                    return
+
+            for _ in range(2 * self.num_processes):
+                submit_next()
+
+            def parsed_chunks() -> Iterator[pd.DataFrame]:
+                while in_flight:
+                    chunk = in_flight.popleft().result()
+                    submit_next()
+                    yield chunk
+
+            yield from self._counted_chunks(shards, parsed_chunks())
+
+    @staticmethod
+    def _counted_chunks(shards: List[List[Tuple[int, Path]]], chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        Record how many files each chunk was parsed from, and drop the empty
+        chunks.
+        """
+        for shard, chunk in zip(shards, chunks):
+            METRICS.inc("issue_files_parsed_total", len(shard))
+            if len(chunk) > 0:
+                yield chunk
+
+    def data_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Return a single dataframe containing info from all issues.
+
+        If `columns` is given, only those columns are returned.  When reading
+        from an `IssueStore`, the other columns are never even read from disk.
         """
-        all_raws = ",".join(self.raws())
-        final_raw_str = f"[{all_raws}]"
-        all_data: pd.DataFrame = pd.read_json(final_raw_str, orient="records")
+        if self.issue_store is not None:
+            return self.issue_store.data_frame(columns)
+
+        chunks = list(self.data_frame_chunks(columns))
+        if not chunks:
+            return pd.DataFrame(columns=ISSUE_COLUMNS if columns is None else columns)
+        all_data: pd.DataFrame = pd.concat(chunks, ignore_index=True)
         return all_data
 
-    def issues_data_frame(self) -> pd.DataFrame:
+    def issues_data_frame(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Return a single dataframe containing data ONLY from issues (not PRs).
 
-        This returns a dataframe of shape (NUM_ISSUES, 14).
+        This returns a dataframe of shape (NUM_ISSUES, 14), or (NUM_ISSUES,
+        len(columns)) if `columns` is given.  PRs are dropped while the issues
+        are being read, so they never take up any memory.
 
         The row indicies are issue numbers (so they do not go from 1...NUM_ISSUES).
         """
-        all_issues = self.data_frame()
-        return all_issues[all_issues.is_issue]
+        if self.issue_store is not None:
+            return self.issue_store.data_frame(columns, only_issues=True)
+
+        chunks = list(self.data_frame_chunks(columns, only_issues=True))
+        if not chunks:
+            return pd.DataFrame(columns=ISSUE_COLUMNS if columns is None else columns)
+        return pd.concat(chunks)
+
+
+# How many entries each preprocessing stage keeps in its cache directory.
+# Entries are keyed by the version of the downloaded issues (among other
+# things), so this is roughly how many different corpora (or settings) can be
+# switched between without redoing the preprocessing.
+MAX_CACHE_ENTRIES = 3
+
+
+def touch_cache_entry(path: Path) -> None:
+    """
+    Mark the cache file or directory at `path` as just used, so
+    `prune_cache` keeps it.
+    """
+    os.utime(path)
+
+
+def prune_cache(cache_dir: Path, prefix: str, keep: int = MAX_CACHE_ENTRIES) -> None:
+    """
+    Delete all but the `keep` most recently used cache entries (files or
+    directories) in `cache_dir` whose names start with `prefix`.  Entries
+    that are still being written (ending in ".tmp") are left alone.
+    """
+    entries = [path for path in cache_dir.glob(f"{prefix}*") if not path.name.endswith(".tmp")]
+    entries.sort(key=lambda path: path.stat().st_mtime_ns, reverse=True)
+    for old_path in entries[keep:]:
+        if old_path.is_dir():
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            old_path.unlink()
 
 
 class Stage1PreprocData:
@@ -165,78 +508,149 @@ class Stage1PreprocData:
     we care about are pulled out into one-hot-encoded columns.
     """
 
-    def __init__(self) -> None:
-        issue_files = IssueFiles()
+    # Bump this whenever the preprocessing below changes, so that old cache
+    # files are not used.
+    CACHE_VERSION = 2
+
+    def __init__(
+        self,
+        issue_files: Optional[IssueFiles] = None,
+        cache_dir: Optional[str] = "preproc-cache",
+        sparse_labels: bool = False,
+    ) -> None:
+        """
+        The results of preprocessing are cached in `cache_dir`, keyed by
+        `issue_files.fingerprint()`.  When the downloaded issues haven't
+        changed, they are just loaded from the cache.  Pass `cache_dir=None`
+        to disable the cache.
+
+        If `sparse_labels` is true, `self.topics` is a sparse DataFrame
+        instead of a dense one.
+        """
+        issue_files = IssueFiles() if issue_files is None else issue_files
+
+        # This identifies the version of the downloaded issues this was
+        # created from.  Later stages use it to key their own caches.
+        self.fingerprint: str = issue_files.fingerprint()
+
+        cache_path: Optional[Path] = None
+        if cache_dir is not None:
+            cache_path = Path(cache_dir) / f"stage1-v{self.CACHE_VERSION}-{self.fingerprint}.pickle"
+
+        if cache_path is not None and cache_path.exists():
+            METRICS.inc("preproc_cache_hits_total", stage="stage1")
+            touch_cache_entry(cache_path)
+            with cache_path.open("rb") as f:
+                cached: Dict[str, Any] = pickle.load(f)
+        else:
+            METRICS.inc("preproc_cache_misses_total", stage="stage1")
+            with METRICS.stage("stage1") as stage_timer:
+                cached = self.preprocess(issue_files)
+                stage_timer.rows = len(cached["only_issues"])
+            if cache_path is not None:
+                self.save_cache(cache_path, cached)
+
+        self.only_issues: pd.DataFrame = cached["only_issues"]
+        self.topic_classes: np.ndarray = cached["topic_classes"]
+
+        # This is a sparse one-hot matrix with a 1 for each issue that has a
+        # given topic-label.  This is of shape (NUM_ISSUES, NUM_TOPIC_LABELS).
+        # Normally around (15000, 50).
+        self.topic_matrix: scipy_sparse.csr_matrix = cached["topic_matrix"]
+
+        # A DataFrame of the topic_matrix, where the row indicies are the same
+        # as only_issues, and the columns are topic labels.
+        self.topics: pd.DataFrame
+        if sparse_labels:
+            self.topics = pd.DataFrame.sparse.from_spmatrix(
+                self.topic_matrix, index=self.only_issues.index, columns=self.topic_classes
+            )
+        else:
+            self.topics = pd.DataFrame(
+                data=self.topic_matrix.toarray(), index=self.only_issues.index, columns=self.topic_classes
+            )
+
+    @property
+    def only_issues_with_labels(self) -> pd.DataFrame:
+        """
+        This is the same as only_issues, but it has all the one-hot-encoded
+        topic labels as columns as well.
+
+        This is built when it is asked for, since it is a full copy of
+        only_issues.
+        """
+        return pd.concat([self.only_issues, self.topics], axis="columns")
+
+    @staticmethod
+    def save_cache(cache_path: Path, cached: Dict[str, Any]) -> None:
+        """
+        Write `cached` to `cache_path`, and delete all but the most recently
+        used stage 1 cache files.
+        """
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
 
+        tmp_path = cache_path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        prune_cache(cache_path.parent, "stage1-")
+
+    @staticmethod
+    def preprocess(issue_files: IssueFiles) -> Dict[str, Any]:
+        """
+        Do the actual preprocessing.  This returns a dict with `only_issues`,
+        `topic_classes`, and `topic_matrix`.
+        """
         # Get a single dataframe with only issues data.
         # The row indicies are non-sequential, and sort of correspond to
         # issues numbers on GitHub, but are slightly different.
         only_issues: pd.DataFrame = issue_files.issues_data_frame()
 
-        # Create a series that has the labels on each issue.  This returns a Series
-        # that is NUM_LABELS long (normally around 100 labels).
-        label_series: pd.Series = only_issues.labels.apply(
-            lambda val: set(map(lambda l: l["name"], val))
-        )
-
-        mlb: MultiLabelBinarizer = MultiLabelBinarizer()
-
-        # This is a one-hot-encoded numpy array with ones for each label.  This is
-        # of size (NUM_ISSUES, NUM_LABELS).  Normally around (15000, 100).
-        one_hot_labels: np.ndarray = mlb.fit_transform(label_series)
-
-        # This is a boolean array with True for each label that starts with "6.".
-        # These are the topic labels we want to be able to predict, like "Haskell",
-        # "QT", "Rust", etc.  This is of shape (NUM_LABELS,).
-        topic_label_selector: np.ndarray = np.char.startswith(
-            mlb.classes_.astype(str), "6."
-        )
+        # The labels of every issue come from the corpus-wide label index,
+        # which has them as integer codes, so nothing here has to loop over
+        # the issues.  This is the row of each issue in the index.
+        label_index: LabelIndex = LabelIndex.open(issue_files)
+        rows: np.ndarray = label_index.rows(only_issues["number"].to_numpy())
 
         # This is a string array that contains only the labels that start with
-        # "6.".  This is of shape (NUM_TOPIC_LABELS,).  Normally around (50,).
-        topic_classes: np.ndarray = mlb.classes_[topic_label_selector]
-
-        # This is a one-hot array with a 1 for each issue that has a given
-        # topic-label.  This is of shape (NUM_ISSUES, NUM_TOPIC_LABELS).  Normally
-        # around (15000, 50).
-        topic_labels: np.ndarray = one_hot_labels[:, topic_label_selector]
-
-        # A DataFrame where the rows are all an index from 0 to NUM_ISSUES, and
-        # the columns are topic labels.  This is of shape (NUM_ISSUES,
-        # NUM_TOPIC_LABELS).  Normally around (15000, 50).
-        topics: pd.DataFrame = pd.DataFrame(data=topic_labels, columns=topic_classes)
-
-        # A list of indicies of only the issues.
-        only_issues_indicies: pd.Int64Index = only_issues.index
-
-        # This is the same as topics above, but the indicies are almost the indicies of
-        # the actual issues on GitHub (not 0 to NUM_ISSUES), but are slightly off in
-        # certain cases.
-        topics_with_index: pd.DataFrame = topics.set_index(only_issues_indicies)
-
-        # This is the same as only_issues, but it has all the one-hot-encoded
-        # topic labels as columns as well.
-        only_issues_with_labels: pd.DataFrame = pd.concat(
-            [only_issues, topics_with_index], axis="columns"
-        )
-
-        self.only_issues: pd.DataFrame = only_issues
-        self.topic_classes: np.ndarray = topic_classes
-        self.topics: pd.DataFrame = topics_with_index
-        self.only_issues_with_labels: pd.DataFrame = only_issues_with_labels
+        # "6.", that are on at least one issue.  These are the topic labels we
+        # want to be able to predict, like "Haskell", "QT", "Rust", etc.  This
+        # is of shape (NUM_TOPIC_LABELS,).  Normally around (50,).
+        topic_classes: np.ndarray = label_index.topic_classes(rows)
+
+        # This is a sparse one-hot matrix with a 1 for each issue that has a
+        # given topic-label.  This is of shape (NUM_ISSUES, NUM_TOPIC_LABELS).
+        # Normally around (15000, 50).
+        topic_matrix: scipy_sparse.csr_matrix = label_index.one_hot(topic_classes, rows)
+
+        return {
+            "only_issues": only_issues,
+            "topic_classes": topic_classes,
+            "topic_matrix": topic_matrix,
+        }
 
     def only_topics(self) -> pd.DataFrame:
         """
-        Return only the columns in the `only_issues` DataFrame that are topic
-        labels.
+        Return only the columns in the `only_issues_with_labels` DataFrame
+        that are topic labels.
 
         Returns a DataFrame of shape (NUM_ISSUES, NUM_TOPIC_LABELS).
         Normally around (15000, 50).
 
         The row indicies are sort of (but not exactly) issue numbers on GitHub (not 0...15000).
         """
-        # TODO: Don't hardcode 14 here, but calculate it from self.only_issues
-        return self.only_issues_with_labels.iloc[:, 14:]
+        return self.topics
+
+    def dense_topics(self, topic_labels: Sequence[str]) -> pd.DataFrame:
+        """
+        Return a dense DataFrame with only the given topic label columns.
+
+        Returns a DataFrame of shape (NUM_ISSUES, len(topic_labels)).
+        """
+        positions: np.ndarray = np.searchsorted(self.topic_classes, topic_labels)
+        return pd.DataFrame(
+            data=self.topic_matrix[:, positions].toarray(), index=self.only_issues.index, columns=topic_labels
+        )
 
     def topic_totals(self) -> pd.Series:
         """
@@ -245,7 +659,8 @@ class Stage1PreprocData:
 
         Returns a `Series` of shape (NUM_TOPIC_LABELS,).
         """
-        return self.only_topics().sum().sort_values(0)
+        totals: np.ndarray = np.asarray(self.topic_matrix.sum(axis=0)).ravel()
+        return pd.Series(totals, index=self.topic_classes).sort_values()
 
     def top_n_topics(self, n=15) -> pd.DataFrame:
         """
@@ -255,6 +670,61 @@ class Stage1PreprocData:
         """
         return self.topic_totals()[-n:]
 
+
+def input_text(
+    user_login: Optional[str], title: Optional[str], body: Optional[str], input_text_len: Optional[int] = 1000
+) -> str:
+    """
+    Return the text the model is given for a single issue: the author's
+    username, the issue title, and the issue body, each on its own line,
+    chopped to the first `input_text_len` characters (or not chopped at all
+    if `input_text_len` is None).
+
+    This is the same as what `Stage2PreprocData.process` builds for every
+    downloaded issue, so it can be used to encode new issues the same way.
+    """
+    return f"{user_login}\n{title}\n{body}"[:input_text_len]
+
+
+def input_texts(issues: pd.DataFrame, input_text_len: Optional[int] = 1000) -> pd.Series:
+    """
+    Like `input_text`, but for every row of a DataFrame of issues with
+    `user_login`, `title`, and `body` columns, built a whole column at a time.
+    """
+    # astype(str) turns a missing body into "None", just like the f-string
+    # in `input_text` would.
+    return (
+        issues["user_login"].astype(str) + "\n" + issues["title"].astype(str) + "\n" + issues["body"].astype(str)
+    ).str[:input_text_len]
+
+
+def encode_texts(
+    texts: Sequence[str], input_text_len: int = 1000, chunk_size: int = 10000, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Convert each string in `texts` to an array of `input_text_len` ascii
+    codes.  Characters that are not ascii become 0, and each string is padded
+    with 0s (or cut off) to `input_text_len`.
+
+    Returns an int8 array of shape (len(texts), input_text_len).  If `out` is
+    given (for instance a memory-mapped array), the codes are written into it
+    instead of into a new array.
+
+    Each chunk of strings is put in a fixed-width numpy unicode array, which
+    stores every character as a 32-bit code point padded out with 0s.
+    Viewing that as uint32 gives all the code points at once, without looping
+    over the characters in Python.
+    """
+    encoded: np.ndarray = np.zeros((len(texts), input_text_len), dtype="int8") if out is None else out
+
+    for start in range(0, len(texts), chunk_size):
+        chunk = np.array(texts[start : start + chunk_size], dtype=f"<U{input_text_len}")
+        code_points = chunk.view(np.uint32).reshape((len(chunk), input_text_len))
+        encoded[start : start + len(chunk)] = np.where(code_points > 127, 0, code_points)
+
+    return encoded
+
+
 class Stage2PreprocData:
     """
     This is the second stage of preprocessing the issue data.
@@ -263,10 +733,25 @@ class Stage2PreprocData:
     we can operate on.
     """
 
-    def __init__(self, stage1: pd.DataFrame = None, input_text_len: int = 1000, top_n_topics: int = 15) -> None:
+    # Bump this whenever the encoding changes, so that old cache files are
+    # not used.
+    CACHE_VERSION = 1
+
+    def __init__(
+        self,
+        stage1: Stage1PreprocData = None,
+        input_text_len: int = 1000,
+        top_n_topics: int = 15,
+        cache_dir: str = "preproc-cache",
+    ) -> None:
+        """
+        The encoded issues are saved as .npy files in `cache_dir`, and
+        memory-mapped from there when building Datasets.
+        """
         self.stage1 = Stage1PreprocData() if stage1 is None else stage1
         self.input_text_len = input_text_len
         self.top_n_topics = top_n_topics
+        self.cache_dir = cache_dir
 
     def process(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
@@ -278,51 +763,147 @@ class Stage2PreprocData:
 
         Y is a `DataFrame` of one-hot-encoded topic labels.
         """
-        def create_input_text(row: pd.Series) -> pd.Series:
-            # print(type(row))
-            author = row["user_login"]
-            title = row["title"]
-            body = row["body"]
-            issue_num = row["number"]
-            return pd.Series([issue_num, f"{author}\n{title}\n{body}"[:self.input_text_len]], index=["issue_num", "issue_text"])
+        issues = self.stage1.only_issues
 
-        X: pd.Series = self.stage1.only_issues.apply(create_input_text, axis=1)
-        Y: pd.DataFrame = self.stage1.only_topics()[self.stage1.top_n_topics(self.top_n_topics).index]
+        with METRICS.stage("stage2_process") as stage_timer:
+            # This is f"{author}\n{title}\n{body}" for each issue.
+            issue_text: pd.Series = input_texts(issues, self.input_text_len)
+
+            X: pd.DataFrame = pd.DataFrame({"issue_num": issues["number"], "issue_text": issue_text})
+            Y: pd.DataFrame = self.stage1.dense_topics(self.topic_labels())
+            stage_timer.rows = len(X)
 
         return X, Y
 
+    def encode_texts(self, texts: Sequence[str], chunk_size: int = 10000, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Convert each string in `texts` to an array of `self.input_text_len`
+        ascii codes.  See the module-level `encode_texts`.
+        """
+        return encode_texts(texts, self.input_text_len, chunk_size=chunk_size, out=out)
+
+    def topic_labels(self) -> List[str]:
+        """
+        Return the names of the top N topic labels, in the same order as the
+        columns of Y from `process`.
+        """
+        return list(self.stage1.top_n_topics(self.top_n_topics).index)
+
     def to_encoded(self) -> Tuple[pd.Series, np.ndarray, pd.DataFrame]:
         X, Y = self.process()
 
-        issue_body = X.iloc[:, 1]
+        # This is a (NUM_ISSUES, TEXT_LEN) array of ascii-encoded issue bodies.
+        # This is normally around (15000, 1000)
+        issue_body_ascii: np.ndarray = self.encode_texts(X["issue_text"].tolist())
 
-        num_issues = issue_body.shape[0]
+        return X["issue_num"], issue_body_ascii, Y
 
-        def to_ascii(c: str) -> int:
-            """
-            Convert a character to ascii.  Returns 0 for all characters that
-            are not ascii.15916
-            """
-            val = ord(c)
-            return 0 if val > 127 else val
+    def encoded_cache_path(self) -> Path:
+        """
+        Return the directory the encoded issues are saved in.  This is keyed
+        by everything the encoding depends on.
+        """
+        return Path(self.cache_dir) / (
+            f"stage2-v{self.CACHE_VERSION}-stage1v{self.stage1.CACHE_VERSION}-{self.stage1.fingerprint}"
+            f"-len{self.input_text_len}-top{self.top_n_topics}"
+        )
 
-        def to_ascii_array(iss_bod: str) -> np.ndarray:
-            padded_issue_body = iss_bod.ljust(self.input_text_len, "\0")
-            new_array = np.fromiter((to_ascii(c) for c in padded_issue_body), dtype="int8")
-            assert len(new_array) == self.input_text_len
-            return new_array
+    def to_encoded_mmap(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Like `to_encoded`, but the arrays are memory-mapped from .npy files in
+        `self.encoded_cache_path()`, so they don't have to fit in memory.  The
+        files are created the first time this is called.
 
-        # This is a (NUM_ISSUES * TEXT_LEN,) array of ascii-encoded issue bodies.
-        issue_body_ascii: np.ndarray = np.concatenate([to_ascii_array(iss) for iss in issue_body])
+        Returns the issue numbers of shape (NUM_ISSUES,), the ascii-encoded
+        issue bodies of shape (NUM_ISSUES, TEXT_LEN), and the topic labels of
+        shape (NUM_ISSUES, NUM_TOP_N_TOPIC_LABELS).
+        """
+        path = self.encoded_cache_path()
+
+        if path.exists():
+            METRICS.inc("preproc_cache_hits_total", stage="stage2_encode")
+            touch_cache_entry(path)
+        else:
+            METRICS.inc("preproc_cache_misses_total", stage="stage2_encode")
+            X, Y = self.process()
+
+            with METRICS.stage("stage2_encode") as stage_timer:
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.mkdir(parents=True, exist_ok=True)
+
+                np.save(tmp_path / "issue_nums.npy", X["issue_num"].to_numpy(dtype="int64"))
+                np.save(tmp_path / "labels.npy", Y.to_numpy(dtype="int64"))
+
+                # The encoded issue bodies are written straight into the .npy
+                # file, so the whole matrix is never in memory at once.
+                encoded: np.ndarray = np.lib.format.open_memmap(
+                    tmp_path / "encoded.npy", mode="w+", dtype="int8", shape=(X.shape[0], self.input_text_len)
+                )
+                self.encode_texts(X["issue_text"].tolist(), out=encoded)
+                encoded.flush()
+                del encoded
+
+                os.replace(tmp_path, path)
+                stage_timer.rows = X.shape[0]
+            prune_cache(path.parent, "stage2-")
+
+        return (
+            np.load(path / "issue_nums.npy", mmap_mode="r"),
+            np.load(path / "encoded.npy", mmap_mode="r"),
+            np.load(path / "labels.npy", mmap_mode="r"),
+        )
 
-        # This is a (NUM_ISSUES, TEXT_LEN) array of ascii-encoded issue bodies.
-        # This is normally around (15000, 1000)
-        issue_body_ascii_reshaped: np.ndarray = issue_body_ascii.reshape((num_issues, self.input_text_len))
+    def dataset_from_indices(
+        self, indices: np.ndarray, block_size: int = 1024, reshuffle_each_iteration: bool = False
+    ) -> tf.data.Dataset:
+        """
+        Return a Dataset of the encoded issues at `indices` (row numbers into
+        the arrays from `to_encoded_mmap`), in that order.
 
-        return X["issue_num"], issue_body_ascii_reshaped, Y
+        Rows are read from the memory-mapped arrays `block_size` at a time, so
+        only a few blocks are ever in memory.
+
+        If `reshuffle_each_iteration` is true, the order of the blocks and the
+        order of the issues within nearby blocks changes on each pass over the
+        Dataset.  This is meant for the training set.
+
+        Each element has the same three tensors as `to_tf`.
+        """
+        issue_nums, encoded, labels = self.to_encoded_mmap()
+        indices = np.asarray(indices, dtype="int64")
+
+        def read_block(start: np.int64) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            block = indices[start : start + block_size]
+            return encoded[block], labels[block], issue_nums[block]
+
+        def set_shapes(issue_body, label, issue_num):
+            return (
+                tf.ensure_shape(issue_body, [None, self.input_text_len]),
+                tf.ensure_shape(label, [None, labels.shape[1]]),
+                tf.ensure_shape(issue_num, [None]),
+            )
+
+        dataset = tf.data.Dataset.range(0, len(indices), block_size)
+        if reshuffle_each_iteration:
+            dataset = dataset.shuffle(buffer_size=len(indices) // block_size + 1, reshuffle_each_iteration=True)
+        dataset = dataset.map(
+            lambda start: tf.numpy_function(read_block, [start], (tf.int8, tf.int64, tf.int64)),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        )
+        dataset = dataset.map(set_shapes).unbatch()
+        if reshuffle_each_iteration:
+            dataset = dataset.shuffle(buffer_size=block_size * 4, reshuffle_each_iteration=True)
+        return dataset
 
     def to_tf(self) -> tf.data.Dataset:
-        issue_nums, issue_body_ascii, Y = self.to_encoded()
+        """
+        Return a Dataset of all the encoded issues, shuffled.
+
+        The rows are streamed from the memory-mapped arrays from
+        `to_encoded_mmap`, so the encoded issues never have to be copied into
+        memory all at once.
+        """
+        issue_nums, _, _ = self.to_encoded_mmap()
 
         # This is a dataset where each element has three tensors.  The first one
         # is the input ascii issue body.  It is shape (TEXT_LEN,).  It is
@@ -333,12 +914,73 @@ class Stage2PreprocData:
         #
         # The third tensor are the issue numbers.  This should be ignored while
         # training.
-        dataset = tf.data.Dataset.from_tensor_slices((issue_body_ascii, Y.values, issue_nums))
-
-        # Shuffle the dataset.
-        dataset = dataset.shuffle(buffer_size=20000, seed=42, reshuffle_each_iteration=False)
-
-        return dataset
+        #
+        # The dataset is shuffled by shuffling the row numbers, instead of
+        # with a shuffle buffer holding copies of the rows.
+        shuffled_indices: np.ndarray = np.random.RandomState(42).permutation(len(issue_nums))
+        return self.dataset_from_indices(shuffled_indices)
+
+    def split_indices(
+        self, test_set_size: int = 1500, val_set_size: int = 1600, seed: int = 42
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Split the encoded issues into a training set, a validation set, and a
+        testing set.  Returns the row numbers (into the arrays from
+        `to_encoded_mmap`) of the issues in each set, in that order.
+
+        The split is stratified over the top N topic labels, so that each set
+        has close to the same ratio of each label.  Issues have multiple
+        labels, so each issue is put in a group by its rarest top N label (or
+        in a group of its own if it has none of them).  Each set then gets its
+        share of every group.
+
+        The split is saved next to the encoded issues, so it is only computed
+        once and is the same every time.
+        """
+        path = self.encoded_cache_path() / f"splits-test{test_set_size}-val{val_set_size}-seed{seed}.npz"
+        if not path.exists():
+            _, _, labels_mmap = self.to_encoded_mmap()
+            labels: np.ndarray = np.asarray(labels_mmap) > 0
+            num_issues, num_labels = labels.shape
+            if test_set_size + val_set_size > num_issues:
+                raise ValueError(
+                    f"test_set_size ({test_set_size}) plus val_set_size ({val_set_size}) is more than the "
+                    f"{num_issues} issues available"
+                )
+
+            label_counts = labels.sum(axis=0)
+            rarest_label = np.argmin(np.where(labels, label_counts, num_issues + 1), axis=1)
+            groups = np.where(labels.any(axis=1), rarest_label, num_labels)
+
+            # Order the issues by group, randomly within each group.
+            rand = np.random.RandomState(seed)
+            order = np.lexsort((rand.random_sample(num_issues), groups))
+
+            def every_nth(total: int, size: int) -> np.ndarray:
+                # A mask picking `size` evenly spaced positions out of `total`.
+                # Applied to issues ordered by group, this picks the same
+                # share of each group.
+                positions = np.arange(total)
+                return (positions + 1) * size // total > positions * size // total
+
+            test_mask = every_nth(num_issues, test_set_size)
+            test_indices, rest = order[test_mask], order[~test_mask]
+
+            val_mask = every_nth(len(rest), val_set_size)
+            val_indices, train_indices = rest[val_mask], rest[~val_mask]
+
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    train=rand.permutation(train_indices),
+                    val=rand.permutation(val_indices),
+                    test=rand.permutation(test_indices),
+                )
+            os.replace(tmp_path, path)
+
+        with np.load(path) as splits:
+            return splits["train"], splits["val"], splits["test"]
 
     def to_datasets(self, test_set_size: int = 1500, val_set_size: int = 1600) -> Tuple[tf.data.Dataset, tf.data.Dataset, tf.data.Dataset]:
         """
@@ -357,18 +999,383 @@ class Stage2PreprocData:
         - ((1600,), (15,), ())
         - ((1500,), (15,), ())
 
-        TODO: These three datasets haven't been stratified (which means that
-        the ratio of issue labels in each dataset may be slightly different due
-        to randomness).
+        The three datasets are stratified over the topic labels.  See
+        `split_indices`.  The training data is reshuffled on each pass over
+        it.
         """
-        dataset = self.to_tf()
+        train_indices, val_indices, test_indices = self.split_indices(test_set_size, val_set_size)
+
+        train_set = self.dataset_from_indices(train_indices, reshuffle_each_iteration=True)
+        val_set = self.dataset_from_indices(val_indices)
+        test_set = self.dataset_from_indices(test_indices)
+
+        return train_set, val_set, test_set
 
-        test_set = dataset.take(test_set_size)
-        dataset = dataset.skip(test_set_size)
+    @staticmethod
+    def input_pipeline(
+        dataset: tf.data.Dataset,
+        batch_size: int = 64,
+        map_func: Optional[Callable[..., Any]] = None,
+        cache: Optional[str] = None,
+        shuffle_buffer_size: int = 0,
+    ) -> tf.data.Dataset:
+        """
+        Turn a Dataset of single issues (like the ones from `to_datasets`)
+        into a Dataset of batches that is ready to pass to `model.fit`.
+
+        The stages are applied in this order:
+
+        - `map_func` is mapped over each issue in parallel.
+        - The mapped issues are cached, if `cache` is not None.  An empty
+          string caches them in memory.  Anything else is the path prefix of
+          files to cache them to.  The cache files are reused as-is on later
+          runs, so they have to be deleted if `map_func` or the underlying
+          data changes.
+        - If `shuffle_buffer_size` is more than 0, the issues are shuffled on
+          each pass.  This comes after the cache, so the cache doesn't freeze
+          the order.
+        - The issues are batched into `batch_size` batches.
+        - Batches are prefetched, so the next batch is ready while the model
+          is training on the current one.
+        """
+        if map_func is not None:
+            dataset = dataset.map(map_func, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        if cache is not None:
+            dataset = dataset.cache(cache)
+        if shuffle_buffer_size > 0:
+            dataset = dataset.shuffle(buffer_size=shuffle_buffer_size, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    def to_batched_datasets(
+        self,
+        batch_size: int = 64,
+        map_func: Optional[Callable[..., Any]] = None,
+        cache_dir: Optional[str] = None,
+        shuffle_buffer_size: int = 10000,
+        test_set_size: int = 1500,
+        val_set_size: int = 1600,
+    ) -> Tuple[tf.data.Dataset, tf.data.Dataset, tf.data.Dataset]:
+        """
+        Like `to_datasets`, but each Dataset is passed through
+        `input_pipeline`, so the elements are batches of `batch_size` issues.
 
-        val_set = dataset.take(val_set_size)
-        dataset = dataset.skip(val_set_size)
-        train_set = dataset
+        If `cache_dir` is given, each Dataset is cached to files in it.  An
+        empty string caches them in memory instead.  When cached, the
+        training set is read in the same order on every pass and shuffled
+        with a `shuffle_buffer_size` shuffle buffer after the cache.
+        """
+        train_indices, val_indices, test_indices = self.split_indices(test_set_size, val_set_size)
+
+        def cache_path(name: str) -> Optional[str]:
+            if cache_dir is None or cache_dir == "":
+                return cache_dir
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            return str(Path(cache_dir) / name)
+
+        if cache_dir is None:
+            train_set = self.dataset_from_indices(train_indices, reshuffle_each_iteration=True)
+            train_shuffle_buffer_size = 0
+        else:
+            train_set = self.dataset_from_indices(train_indices)
+            train_shuffle_buffer_size = shuffle_buffer_size
+
+        train_set = self.input_pipeline(
+            train_set, batch_size, map_func, cache_path("train"), shuffle_buffer_size=train_shuffle_buffer_size
+        )
+        val_set = self.input_pipeline(self.dataset_from_indices(val_indices), batch_size, map_func, cache_path("val"))
+        test_set = self.input_pipeline(self.dataset_from_indices(test_indices), batch_size, map_func, cache_path("test"))
 
         return train_set, val_set, test_set
 
+
+class Vectorizer(abc.ABC):
+    """
+    Turns issue texts into feature vectors.  This is an alternative to the
+    fixed-length ascii codes from `Stage2PreprocData.encode_texts`, which
+    throw away non-ascii characters and everything past the first 1000
+    characters.
+
+    A Vectorizer is fit once on the training texts, pickled along with the
+    features in `VectorizedData`'s cache, and then used to transform texts in
+    bulk (or new issues one at a time).  Subclasses implement `fit` and
+    `transform`, and list everything that affects their output in `params`.
+    """
+
+    # A short name for this kind of vectorizer, used in cache file names.
+    name = "vectorizer"
+
+    def params(self) -> Dict[str, Any]:
+        return {}
+
+    def cache_key(self) -> str:
+        """
+        Return a string identifying this vectorizer and its parameters.
+        """
+        params_json = json.dumps(self.params(), sort_keys=True)
+        return f"{self.name}-{hashlib.sha256(params_json.encode('utf-8')).hexdigest()[:12]}"
+
+    @abc.abstractmethod
+    def fit(self, texts: Sequence[str]) -> "Vectorizer":
+        """
+        Learn whatever this vectorizer needs from the training `texts`, and
+        return `self`.
+        """
+
+    @abc.abstractmethod
+    def transform(self, texts: Sequence[str]) -> Any:
+        """
+        Return a matrix with one row of features for each string in `texts`.
+        This is either a `scipy.sparse.csr_matrix` or a numpy array.
+        """
+
+    def transform_all(self, texts: Sequence[str], chunk_size: int = 10000) -> Any:
+        """
+        Like `transform`, but transform `chunk_size` texts at a time, so the
+        intermediate data for all the texts never has to be in memory at once.
+        """
+        chunks = [self.transform(texts[start : start + chunk_size]) for start in range(0, len(texts), chunk_size)]
+        if chunks and scipy_sparse.issparse(chunks[0]):
+            return scipy_sparse.vstack(chunks, format="csr")
+        return np.concatenate(chunks)
+
+
+class HashedNgramVectorizer(Vectorizer):
+    """
+    Hashes word (or character) n-grams into `n_features` buckets.  This
+    doesn't have to learn a vocabulary, so fitting it does nothing, and it
+    can't run into words it hasn't seen before.
+
+    Returns a sparse matrix of shape (NUM_TEXTS, n_features).
+    """
+
+    name = "hashed"
+
+    def __init__(self, n_features: int = 2 ** 18, ngram_range: Tuple[int, int] = (1, 2), analyzer: str = "word") -> None:
+        from sklearn.feature_extraction.text import HashingVectorizer  # type: ignore
+
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.analyzer = analyzer
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, ngram_range=ngram_range, analyzer=analyzer, alternate_sign=False, dtype=np.float32
+        )
+
+    def params(self) -> Dict[str, Any]:
+        return {"n_features": self.n_features, "ngram_range": list(self.ngram_range), "analyzer": self.analyzer}
+
+    def fit(self, texts: Sequence[str]) -> "HashedNgramVectorizer":
+        # There is nothing to learn.
+        return self
+
+    def transform(self, texts: Sequence[str]) -> scipy_sparse.csr_matrix:
+        return self.vectorizer.transform(texts)
+
+
+class TfidfNgramVectorizer(Vectorizer):
+    """
+    TF-IDF weighted word (or character) n-grams, with a vocabulary of the
+    `max_features` most common n-grams that appear in at least `min_df` of
+    the training texts.
+
+    Returns a sparse matrix of shape (NUM_TEXTS, VOCABULARY_SIZE).
+    """
+
+    name = "tfidf"
+
+    def __init__(
+        self,
+        max_features: int = 50000,
+        ngram_range: Tuple[int, int] = (1, 2),
+        analyzer: str = "word",
+        min_df: int = 2,
+    ) -> None:
+        from sklearn.feature_extraction.text import TfidfVectorizer  # type: ignore
+
+        self.max_features = max_features
+        self.ngram_range = ngram_range
+        self.analyzer = analyzer
+        self.min_df = min_df
+        self.vectorizer = TfidfVectorizer(
+            max_features=max_features,
+            ngram_range=ngram_range,
+            analyzer=analyzer,
+            min_df=min_df,
+            sublinear_tf=True,
+            dtype=np.float32,
+        )
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            "max_features": self.max_features,
+            "ngram_range": list(self.ngram_range),
+            "analyzer": self.analyzer,
+            "min_df": self.min_df,
+        }
+
+    def fit(self, texts: Sequence[str]) -> "TfidfNgramVectorizer":
+        self.vectorizer.fit(texts)
+        return self
+
+    def transform(self, texts: Sequence[str]) -> scipy_sparse.csr_matrix:
+        return self.vectorizer.transform(texts)
+
+
+class TextVectorizationVectorizer(Vectorizer):
+    """
+    A Keras `TextVectorization` layer with a vocabulary of the `max_tokens`
+    most common words in the training texts.  Each text becomes a sequence of
+    `output_sequence_length` word indicies, for models that start with an
+    `Embedding` layer.
+
+    Returns an int64 array of shape (NUM_TEXTS, output_sequence_length).
+
+    Keras layers can't be pickled, so only the vocabulary is pickled, and the
+    layer is rebuilt from it when unpickled.
+    """
+
+    name = "text_vectorization"
+
+    def __init__(self, max_tokens: int = 20000, output_sequence_length: int = 300) -> None:
+        self.max_tokens = max_tokens
+        self.output_sequence_length = output_sequence_length
+        self.layer = self._make_layer()
+
+    def _make_layer(self) -> Any:
+        # This moved out of experimental.preprocessing in TensorFlow 2.6.
+        layer_class = getattr(tf.keras.layers, "TextVectorization", None)
+        if layer_class is None:
+            layer_class = tf.keras.layers.experimental.preprocessing.TextVectorization
+        return layer_class(max_tokens=self.max_tokens, output_sequence_length=self.output_sequence_length)
+
+    def params(self) -> Dict[str, Any]:
+        return {"max_tokens": self.max_tokens, "output_sequence_length": self.output_sequence_length}
+
+    def fit(self, texts: Sequence[str]) -> "TextVectorizationVectorizer":
+        self.layer.adapt(tf.data.Dataset.from_tensor_slices(list(texts)).batch(1024))
+        return self
+
+    def transform(self, texts: Sequence[str]) -> np.ndarray:
+        return self.layer(tf.constant(list(texts))).numpy()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.params(), "vocabulary": self.layer.get_vocabulary()}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.max_tokens = state["max_tokens"]
+        self.output_sequence_length = state["output_sequence_length"]
+        self.layer = self._make_layer()
+        self.layer.set_vocabulary(state["vocabulary"])
+
+
+# The available vectorizers, by name.
+VECTORIZERS: Dict[str, Callable[..., Vectorizer]] = {
+    HashedNgramVectorizer.name: HashedNgramVectorizer,
+    TfidfNgramVectorizer.name: TfidfNgramVectorizer,
+    TextVectorizationVectorizer.name: TextVectorizationVectorizer,
+}
+
+
+class VectorizedData:
+    """
+    This is an alternative to the encoding in Stage2PreprocData.  It takes
+    the full text of every issue (not chopped to the first 1000 characters)
+    and turns it into features with a `Vectorizer`.
+
+    The vectorizer is only fit on the training set from
+    `Stage2PreprocData.split_indices`, so nothing about the validation or
+    testing sets leaks into the features.  The rows of `features` are in the
+    same order as the arrays from `Stage2PreprocData.to_encoded_mmap`, so the
+    same labels and split indices can be used with them.
+
+    The fitted vectorizer and the features are cached in `cache_dir`, keyed
+    by the version of the downloaded issues, the vectorizer and its
+    parameters, and the split.
+    """
+
+    # Bump this whenever the way features are made changes, so that old
+    # cache files are not used.
+    CACHE_VERSION = 1
+
+    def __init__(
+        self,
+        stage2: Optional[Stage2PreprocData] = None,
+        vectorizer: Optional[Vectorizer] = None,
+        cache_dir: str = "preproc-cache",
+        test_set_size: int = 1500,
+        val_set_size: int = 1600,
+    ) -> None:
+        self.stage2 = Stage2PreprocData() if stage2 is None else stage2
+        self.test_set_size = test_set_size
+        self.val_set_size = val_set_size
+
+        vectorizer = HashedNgramVectorizer() if vectorizer is None else vectorizer
+        cache_path = Path(cache_dir) / (
+            f"vectorized-v{self.CACHE_VERSION}-stage2v{self.stage2.CACHE_VERSION}"
+            f"-stage1v{self.stage2.stage1.CACHE_VERSION}-{self.stage2.stage1.fingerprint}-{vectorizer.cache_key()}"
+            f"-test{test_set_size}-val{val_set_size}"
+        )
+
+        if cache_path.exists():
+            touch_cache_entry(cache_path)
+        else:
+            self.save_cache(cache_path, *self.vectorize(vectorizer))
+
+        with open(cache_path / "vectorizer.pickle", "rb") as f:
+            self.vectorizer: Vectorizer = pickle.load(f)
+
+        # This is of shape (NUM_ISSUES, NUM_FEATURES), and is either a
+        # scipy.sparse.csr_matrix or a numpy array, depending on the
+        # vectorizer.
+        self.features: Any
+        if (cache_path / "features.npz").exists():
+            self.features = scipy_sparse.load_npz(cache_path / "features.npz")
+        else:
+            self.features = np.load(cache_path / "features.npy", mmap_mode="r")
+
+    def vectorize(self, vectorizer: Vectorizer) -> Tuple[Vectorizer, Any]:
+        """
+        Fit `vectorizer` on the training issues, and transform all the issues
+        with it.
+        """
+        texts: List[str] = input_texts(self.stage2.stage1.only_issues, input_text_len=None).tolist()
+        train_indices, _, _ = self.stage2.split_indices(self.test_set_size, self.val_set_size)
+        with METRICS.stage(f"vectorize_{vectorizer.name}") as stage_timer:
+            vectorizer.fit([texts[i] for i in train_indices])
+            features = vectorizer.transform_all(texts)
+            stage_timer.rows = len(texts)
+        return vectorizer, features
+
+    @staticmethod
+    def save_cache(cache_path: Path, vectorizer: Vectorizer, features: Any) -> None:
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path / "vectorizer.pickle", "wb") as f:
+            pickle.dump(vectorizer, f)
+        if scipy_sparse.issparse(features):
+            scipy_sparse.save_npz(tmp_path / "features.npz", features.tocsr())
+        else:
+            np.save(tmp_path / "features.npy", features)
+        os.replace(tmp_path, cache_path)
+        prune_cache(cache_path.parent, "vectorized-")
+
+    def labels(self) -> np.ndarray:
+        """
+        Return the top N topic labels, of shape (NUM_ISSUES,
+        NUM_TOP_N_TOPIC_LABELS).
+        """
+        _, _, labels = self.stage2.to_encoded_mmap()
+        return np.asarray(labels)
+
+    def splits(self) -> Tuple[Tuple[Any, np.ndarray], Tuple[Any, np.ndarray], Tuple[Any, np.ndarray]]:
+        """
+        Return the features and labels of the training set, the validation
+        set, and the testing set, as `(X, Y)` tuples.
+        """
+        labels = self.labels()
+        train_indices, val_indices, test_indices = self.stage2.split_indices(self.test_set_size, self.val_set_size)
+        return (
+            (self.features[train_indices], labels[train_indices]),
+            (self.features[val_indices], labels[val_indices]),
+            (self.features[test_indices], labels[test_indices]),
+        )
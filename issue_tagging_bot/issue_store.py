@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+A columnar (Parquet) store for downloaded issues.
+
+Instead of one NNNNNN.json file per issue, issues are kept in Parquet files
+that each hold a fixed range of issue numbers, like
+`issues-000000-009999.parquet`.  Loading the whole corpus is then a handful of
+file reads instead of one per issue, and only the columns that are needed
+have to be read.
+
+An existing directory of json files can be migrated with:
+
+    $ python3 -m issue_tagging_bot.issue_store issue-data issue-store
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from issue_tagging_bot.lazy_import import lazy_import
+from issue_tagging_bot.metrics import METRICS
+
+# These are only imported when the store is actually read or written, so
+# that the fetcher doesn't pay for them when it isn't using a store.
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+# The names of the columns of the store.  These are the same (and in the same
+# order) as the keys in the json files written for each `IssueData`.
+ISSUE_COLUMNS = [
+    "id",
+    "url",
+    "number",
+    "state",
+    "title",
+    "body",
+    "user_login",
+    "user_id",
+    "labels",
+    "comments",
+    "closed_at",
+    "created_at",
+    "updated_at",
+    "is_issue",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def issue_schema() -> pa.Schema:
+    """
+    Return the Arrow schema of the store, with the columns in
+    `ISSUE_COLUMNS`.
+    """
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("url", pa.string()),
+            ("number", pa.int64()),
+            ("state", pa.string()),
+            ("title", pa.string()),
+            ("body", pa.string()),
+            ("user_login", pa.string()),
+            ("user_id", pa.int64()),
+            ("labels", pa.list_(pa.struct([("name", pa.string()), ("url", pa.string())]))),
+            ("comments", pa.int64()),
+            ("closed_at", pa.string()),
+            ("created_at", pa.string()),
+            ("updated_at", pa.string()),
+            ("is_issue", pa.bool_()),
+        ]
+    )
+
+
+# Columns that hold timestamps.  These get converted to datetimes when loaded
+# into a DataFrame, the same way `pd.read_json` converts them.
+DATE_COLUMNS = ["closed_at", "created_at", "updated_at"]
+
+# The Parquet code below sticks to pyarrow APIs that are in the (0.1x)
+# version shell.nix pins, so filtering and sorting are done in Python or
+# pandas rather than with pyarrow.compute.
+
+
+def records_to_table(records: List[Dict[str, Any]], columns: Optional[List[str]] = None) -> pa.Table:
+    """
+    Return a Table of `records` (dicts like an `IssueData`'s json) with the
+    store's schema, or only the given `columns` of it.
+    """
+    fields = [issue_schema().field(name) for name in (ISSUE_COLUMNS if columns is None else columns)]
+    arrays = [pa.array([record[field.name] for record in records], type=field.type) for field in fields]
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def table_to_records(table: pa.Table) -> List[Dict[str, Any]]:
+    """
+    Return a dict for each row of `table`, the inverse of `records_to_table`.
+    """
+    columns: Dict[str, List[Any]] = table.to_pydict()
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+class IssueStore:
+    """
+    A directory of Parquet files, each holding the issues with numbers in the
+    range `[start, start + partition_size)`.  The `partition_size` must stay
+    the same for the whole life of a store.
+
+    Issues are added with `add`, which buffers them in memory.  They are only
+    written out by `flush`, which rewrites each affected partition file and
+    atomically renames it into place.
+    """
+
+    def __init__(self, store_dir: str = "issue-store", partition_size: int = 10000, flush_every: int = 1000) -> None:
+        self.store_dir = store_dir
+        self.partition_size = partition_size
+        self.flush_every = flush_every
+        self.buffer: Dict[int, Dict[str, Any]] = {}
+
+    def exists(self) -> bool:
+        return Path(self.store_dir).is_dir()
+
+    def partition_path(self, issue_num: int) -> Path:
+        start = issue_num - issue_num % self.partition_size
+        end = start + self.partition_size - 1
+        return Path(self.store_dir) / f"issues-{start:06}-{end:06}.parquet"
+
+    def partition_paths(self) -> List[Path]:
+        """
+        Return the paths to all partition files, lowest issue numbers first.
+        """
+        if not self.exists():
+            return []
+        return [
+            Path(self.store_dir) / f
+            for f in sorted(os.listdir(self.store_dir))
+            if f.startswith("issues-") and f.endswith(".parquet")
+        ]
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """
+        Add (or replace) an issue.  `record` is a dict with the same keys as
+        the json for an `IssueData`.
+        """
+        self.buffer[record["number"]] = record
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered issues to their partition files.
+
+        Partitions are written highest issue numbers first.  The fetcher saves
+        issues walking down from the highest issue number, so this keeps the
+        issues in the store contiguous even if the process is killed partway
+        through a flush.
+        """
+        if not self.buffer:
+            return
+
+        Path(self.store_dir).mkdir(parents=True, exist_ok=True)
+
+        by_partition: Dict[Path, List[Dict[str, Any]]] = {}
+        for issue_num in sorted(self.buffer, reverse=True):
+            by_partition.setdefault(self.partition_path(issue_num), []).append(self.buffer[issue_num])
+
+        for path, records in by_partition.items():
+            by_number: Dict[int, Dict[str, Any]] = {}
+            if path.exists():
+                by_number = {record["number"]: record for record in table_to_records(pq.read_table(path))}
+            by_number.update((record["number"], record) for record in records)
+            new_table = records_to_table([by_number[issue_num] for issue_num in sorted(by_number)])
+
+            tmp_path = path.with_suffix(".parquet.tmp")
+            pq.write_table(new_table, tmp_path)
+            METRICS.inc("issue_bytes_written_total", tmp_path.stat().st_size, format="parquet")
+            os.replace(tmp_path, path)
+
+        self.buffer = {}
+
+    def table(self, columns: Optional[List[str]] = None) -> pa.Table:
+        """
+        Return a Table of all the issues in the store, sorted by issue number,
+        with only the given `columns` (or all columns).
+        """
+        tables = [pq.read_table(path, columns=columns) for path in self.partition_paths()]
+        METRICS.inc("issue_store_partitions_read_total", len(tables))
+        if not tables:
+            return records_to_table([], columns)
+        return pa.concat_tables(tables)
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """
+        Return an iterator of a dict for each issue in the store, with the
+        same keys and values as its json.  Only one partition is read into
+        memory at a time.
+        """
+        for path in self.partition_paths():
+            METRICS.inc("issue_store_partitions_read_total")
+            yield from table_to_records(pq.read_table(path))
+
+    def issue_nums(self) -> Iterator[int]:
+        """
+        Return an iterator of the numbers of all the issues in the store.
+        """
+        return iter(self.table(columns=["number"]).column("number").to_pylist())
+
+    def newest_updated_at(self) -> Optional[str]:
+        """
+        Return the newest `updated_at` of all the issues in the store, or
+        `None` if the store is empty.
+        """
+        updated_ats = self.table(columns=["updated_at"]).column("updated_at").to_pylist()
+        return max((updated_at for updated_at in updated_ats if updated_at is not None), default=None)
+
+    def data_frame(self, columns: Optional[List[str]] = None, only_issues: bool = False) -> pd.DataFrame:
+        """
+        Return a DataFrame of all the issues in the store.  This is the same as
+        what `IssueFiles.data_frame` returns for the equivalent json files.
+
+        If `only_issues` is true, PRs are filtered out.  The row indicies are still the positions of
+        the issues in the whole store, like `IssueFiles.issues_data_frame`.
+        """
+        return self._to_data_frame(self.table(self._read_columns(columns, only_issues)), columns, only_issues)
+
+    def data_frame_chunks(
+        self, columns: Optional[List[str]] = None, only_issues: bool = False, min_issue_num: int = 0
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Like `data_frame`, but return an iterator of one DataFrame per
+        partition, so only one partition is in memory at a time.
+
+        Only issues numbered `min_issue_num` or higher are returned.
+        Partitions that are entirely below that are not read at all.
+        """
+        read_columns = self._read_columns(columns, only_issues)
+        if read_columns is not None and "number" not in read_columns:
+            read_columns = read_columns + ["number"]
+
+        position = 0
+        for path in self.partition_paths():
+            end = int(path.stem.split("-")[2])
+            if end < min_issue_num:
+                # Only the number of rows is needed to keep the positions
+                # right, and that is in the file's metadata.
+                position += pq.ParquetFile(path).metadata.num_rows
+                continue
+
+            table = pq.read_table(path, columns=read_columns)
+            METRICS.inc("issue_store_partitions_read_total")
+            chunk = self._to_data_frame(
+                table, columns, only_issues, first_position=position, min_issue_num=min_issue_num
+            )
+            position += table.num_rows
+            if len(chunk) > 0:
+                yield chunk
+
+    @staticmethod
+    def _read_columns(columns: Optional[List[str]], only_issues: bool) -> Optional[List[str]]:
+        if columns is None or not only_issues or "is_issue" in columns:
+            return columns
+        return columns + ["is_issue"]
+
+    @staticmethod
+    def _to_data_frame(
+        table: pa.Table,
+        columns: Optional[List[str]],
+        only_issues: bool,
+        first_position: int = 0,
+        min_issue_num: int = 0,
+    ) -> pd.DataFrame:
+        """
+        Convert a Table read with `_read_columns` to a DataFrame, keeping only
+        `columns` (and only issues if `only_issues` is true, and only issues
+        numbered `min_issue_num` or higher).  The rows are indexed by their
+        position in the store, starting from `first_position` for the first
+        row of `table`.
+        """
+        all_data: pd.DataFrame = table.to_pandas()
+        all_data.index = np.arange(first_position, first_position + len(all_data))
+        keep: np.ndarray = np.ones(len(all_data), dtype=bool)
+        if only_issues:
+            keep &= all_data["is_issue"].to_numpy(dtype=bool)
+        if min_issue_num > 0:
+            keep &= all_data["number"].to_numpy() >= min_issue_num
+        if not keep.all():
+            all_data = all_data[keep]
+        if columns is not None:
+            all_data = all_data[columns]
+        for column in DATE_COLUMNS:
+            if column in all_data.columns:
+                all_data[column] = pd.to_datetime(all_data[column])
+        if "labels" in all_data.columns:
+            # `to_pandas` gives each issue's labels as an array of dicts, but
+            # `pd.read_json` gives a list of them.
+            all_data["labels"] = [list(labels) for labels in all_data["labels"]]
+        return all_data
+
+    def migrate(self, raws: Iterable[str]) -> int:
+        """
+        Add every issue from an iterable of raw json strings (like
+        `IssueFiles.raws()`) to the store.  Returns the number of issues
+        migrated.
+        """
+        count = 0
+        for raw_json in raws:
+            self.add(json.loads(raw_json))
+            count += 1
+        self.flush()
+        return count
+
+
+def main() -> None:
+    from issue_tagging_bot.issue_data import IssueFiles
+
+    parser = argparse.ArgumentParser(description="Migrate a directory of issue json files to a Parquet issue store.")
+    parser.add_argument("data_dir", nargs="?", default="issue-data")
+    parser.add_argument("store_dir", nargs="?", default="issue-store")
+    args = parser.parse_args()
+
+    store = IssueStore(args.store_dir, flush_every=20000)
+    count = store.migrate(IssueFiles(args.data_dir).raws())
+    print(f"Migrated {count} issues from {args.data_dir} to {args.store_dir}")
+
+
+if __name__ == "__main__":
+    main()
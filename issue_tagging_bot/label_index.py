@@ -0,0 +1,507 @@
+"""
+A corpus-wide index of the labels on every downloaded issue.
+
+Every issue's json repeats the full name and url of each of its labels, and
+there are only a few hundred different labels.  The index gives each label
+an integer code, and stores the codes of each issue's labels as a ragged
+array: `values[offsets[i]:offsets[i + 1]]` are the (sorted) label codes of
+the issue in row `i`.  Rows are sorted by issue number.
+
+With that, things like the one-hot matrix of topic labels, or how many issues
+have each label, or which issues have a given label, are a few NumPy
+operations instead of a loop over every issue.
+
+The index lives in a `label-index` directory next to the issues it indexes
+(in the data directory or the store directory), as these files:
+
+- `labels.json`: the label vocabulary, as a list of `{"name", "url"}` in
+  code order, plus the fingerprint of the issues the index was built from.
+- `index.npz`: the `issue_nums`, `is_issue`, `offsets` and `values` arrays.
+- `journal.jsonl`: the issues committed since the arrays were last written,
+  one line per batch.
+
+The fetcher keeps it up to date as it saves issues, appending each batch to
+the journal with `commit`, and rewriting the whole index with the fingerprint
+of the issues once at the end of a run.  The fetcher is the only thing that
+writes the index.  Everything else reads it with `LabelIndex.open`, which
+builds a new one in memory whenever it doesn't match the issues (like while
+a crawl is running) and leaves the one on disk alone.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from issue_tagging_bot.lazy_import import lazy_import
+from issue_tagging_bot.metrics import METRICS
+
+if TYPE_CHECKING:
+    from issue_tagging_bot.issue_data import IssueData, IssueFiles
+
+np = lazy_import("numpy")
+scipy_sparse = lazy_import("scipy.sparse")
+
+# The name of the directory the index is kept in, inside the data or store
+# directory.
+INDEX_DIR_NAME = "label-index"
+
+
+class LabelIndex:
+    """
+    The label vocabulary and integer-coded labels of every issue (and PR).
+
+    Issues are added with `add` (or `add_issue`), which buffers them.  Adding
+    an issue that is already in the index replaces its labels.  Label codes
+    never change once given out, so the vocabulary only grows.
+
+    Each `commit` appends the issues added since the last one to the journal
+    and bumps the `generation`, so a caller can tell how far along the index
+    on disk is without looking at the issues (the fetcher records it in its
+    manifest).  `save` writes out everything and empties the journal.
+    """
+
+    # Bump this whenever the format of the index files changes, so that old
+    # indexes get rebuilt.
+    VERSION = 2
+
+    def __init__(self, index_dir: str, merge_every: int = 10000) -> None:
+        self.index_dir = index_dir
+        self.merge_every = merge_every
+
+        # The vocabulary.  `label_names[code]` and `label_urls[code]` are the
+        # name and url of the label with that code.
+        self.label_names: List[str] = []
+        self.label_urls: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+        # One row per issue, sorted by issue number.
+        self.issue_nums: np.ndarray = np.zeros(0, dtype="int64")
+        self.is_issue: np.ndarray = np.zeros(0, dtype=bool)
+        self.offsets: np.ndarray = np.zeros(1, dtype="int64")
+        self.values: np.ndarray = np.zeros(0, dtype="int32")
+
+        # The fingerprint of the issues this index was last saved for, or
+        # `None` if it wasn't saved for a known version of them.
+        self.fingerprint: Optional[str] = None
+
+        # Issues that have been added but not merged into the arrays yet.
+        self.pending: Dict[int, Tuple[bool, List[int]]] = {}
+
+        # How many batches of issues have been committed to disk, with
+        # `commit` or `save`.
+        self.generation = 0
+
+        # Issues that have been added since the last commit, and how big the
+        # vocabulary was then.
+        self.uncommitted: Dict[int, Tuple[bool, List[int]]] = {}
+        self.num_committed_labels = 0
+
+        # How many issues are in the arrays on disk and in the journal, and
+        # how long the journal is up to the end of its last whole line.
+        self.num_saved = 0
+        self.num_journaled = 0
+        self.journal_bytes = 0
+        # The inode of the journal, so that `commit` can tell if the journal
+        # was replaced or removed by something else.  `None` if there isn't
+        # one.
+        self.journal_inode: Optional[int] = None
+
+    @staticmethod
+    def index_dir_for(issue_files: IssueFiles) -> str:
+        """
+        Return the directory the index for `issue_files` is kept in.
+        """
+        issues_dir = issue_files.data_dir if issue_files.issue_store is None else issue_files.issue_store.store_dir
+        return str(Path(issues_dir) / INDEX_DIR_NAME)
+
+    @classmethod
+    def open(cls, issue_files: IssueFiles, save: bool = False) -> "LabelIndex":
+        """
+        Return the index for `issue_files`.  It is loaded from disk if it was
+        saved for the current version of the issues, and otherwise rebuilt
+        from the issues.
+
+        The rebuilt index is only saved if `save` is true, which only the
+        fetcher should pass.  There's no locking, so anything else writing
+        the index could overwrite the one a running fetcher is keeping up to
+        date.
+        """
+        index_dir = cls.index_dir_for(issue_files)
+        fingerprint = issue_files.fingerprint()
+
+        label_index = cls.load(index_dir)
+        if label_index is not None and label_index.fingerprint == fingerprint:
+            METRICS.inc("label_index_loads_total")
+            return label_index
+
+        METRICS.inc("label_index_builds_total")
+        label_index = cls.build(issue_files, index_dir)
+        if save:
+            label_index.save(fingerprint)
+        else:
+            # Nothing is going to commit these.
+            label_index.uncommitted = {}
+        return label_index
+
+    @classmethod
+    def build(cls, issue_files: IssueFiles, index_dir: str) -> "LabelIndex":
+        """
+        Build the index by reading the labels of every issue in
+        `issue_files`.
+        """
+        label_index = cls(index_dir)
+        for chunk in issue_files.data_frame_chunks(["number", "is_issue", "labels"]):
+            for issue_num, is_issue, labels in zip(chunk["number"], chunk["is_issue"], chunk["labels"]):
+                label_index.add(int(issue_num), bool(is_issue), ((label["name"], label["url"]) for label in labels))
+        label_index.merge()
+        return label_index
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["LabelIndex"]:
+        """
+        Load the index saved in `index_dir`, including any batches committed
+        to its journal, or return `None` if there isn't one (or it is from an
+        older version).
+        """
+        labels_path = Path(index_dir) / "labels.json"
+        arrays_path = Path(index_dir) / "index.npz"
+        if not labels_path.exists() or not arrays_path.exists():
+            return None
+
+        with labels_path.open() as f:
+            vocabulary: Dict[str, Any] = json.load(f)
+        with np.load(arrays_path) as arrays:
+            if (
+                vocabulary["version"] != cls.VERSION
+                or str(arrays["fingerprint"]) != (vocabulary["fingerprint"] or "")
+                or int(arrays["generation"]) != vocabulary["generation"]
+            ):
+                # Either an old format, or the process was killed between
+                # writing the two files.
+                return None
+            label_index = cls(index_dir)
+            label_index.issue_nums = arrays["issue_nums"]
+            label_index.is_issue = arrays["is_issue"]
+            label_index.offsets = arrays["offsets"]
+            label_index.values = arrays["values"]
+            label_index.num_saved = len(label_index.issue_nums)
+
+        label_index.fingerprint = vocabulary["fingerprint"]
+        label_index.generation = vocabulary["generation"]
+        for label in vocabulary["labels"]:
+            label_index.code(label["name"], label["url"])
+        label_index.replay_journal()
+        return label_index
+
+    def journal_path(self) -> Path:
+        return Path(self.index_dir) / "journal.jsonl"
+
+    def replay_journal(self) -> None:
+        """
+        Add the issues from every batch in the journal that is newer than the
+        arrays.
+
+        The journal ends at the first line that isn't a whole batch.  That is
+        normally a line that was only partly written when the process was
+        killed, and it is overwritten by the next `commit`.
+        """
+        path = self.journal_path()
+        if not path.exists():
+            return
+
+        with path.open("rb") as f:
+            self.journal_inode = os.fstat(f.fileno()).st_ino
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    batch: Dict[str, Any] = json.loads(line)
+                except ValueError:
+                    break
+                self.journal_bytes += len(line)
+                if batch["generation"] <= self.generation:
+                    # Already in the arrays, if the process was killed before
+                    # `save` could empty the journal.
+                    continue
+                for label in batch["labels"]:
+                    self.code(label["name"], label["url"])
+                for issue_num, is_issue, codes in batch["issues"]:
+                    self.pending[issue_num] = (is_issue, codes)
+                self.num_journaled += len(batch["issues"])
+                self.generation = batch["generation"]
+                # The fingerprint is only for the issues in the arrays.
+                self.fingerprint = None
+
+        self.num_committed_labels = len(self.label_names)
+        self.merge()
+
+    def commit(self) -> int:
+        """
+        Append the issues added since the last commit to the journal, as the
+        next generation of the index, and return that generation.
+
+        Only the new issues are written, so this is cheap enough to do for
+        every batch of issues.  Once the journal has as many issues in it as
+        the arrays on disk (or `merge_every`), the whole index is rewritten
+        by `save` instead, which keeps the total amount written proportional
+        to the number of issues.
+        """
+        if not self.uncommitted and self.num_committed_labels == len(self.label_names):
+            return self.generation
+
+        self.generation += 1
+        self.num_journaled += len(self.uncommitted)
+        if self.num_journaled >= max(self.merge_every, self.num_saved) or not self.journal_is_ours():
+            # The arrays don't describe a known version of the issues any
+            # more, so no fingerprint.
+            self.save(None)
+            return self.generation
+
+        batch = {
+            "generation": self.generation,
+            "labels": [
+                {"name": name, "url": url}
+                for name, url in zip(
+                    self.label_names[self.num_committed_labels :], self.label_urls[self.num_committed_labels :]
+                )
+            ],
+            "issues": [[issue_num, is_issue, codes] for issue_num, (is_issue, codes) in self.uncommitted.items()],
+        }
+        Path(self.index_dir).mkdir(parents=True, exist_ok=True)
+        with self.journal_path().open("ab") as f:
+            # Drop anything after the last whole line, so that this batch
+            # starts on a line of its own.  `journal_is_ours` made sure the
+            # file is at least that long, so this never grows it.
+            f.truncate(self.journal_bytes)
+            f.write((json.dumps(batch) + "\n").encode("utf-8"))
+            self.journal_bytes = f.tell()
+            self.journal_inode = os.fstat(f.fileno()).st_ino
+
+        self.uncommitted = {}
+        self.num_committed_labels = len(self.label_names)
+        return self.generation
+
+    def journal_is_ours(self) -> bool:
+        """
+        Return whether the journal on disk is still the one this index last
+        loaded or appended to.  It isn't if something else saved the index
+        since (which removes the journal), and then maybe started a new one.
+        """
+        try:
+            stat = self.journal_path().stat()
+        except FileNotFoundError:
+            return self.journal_inode is None
+        return stat.st_ino == self.journal_inode and stat.st_size >= self.journal_bytes
+
+    def save(self, fingerprint: Optional[str]) -> None:
+        """
+        Write the index to `self.index_dir`, recording that it is for the
+        issues with the given `fingerprint`, and empty the journal.
+
+        Each file is written under a temporary name and renamed into place.
+        Both files record the fingerprint and generation, so `load` can tell
+        if only one of them was replaced.
+        """
+        self.merge()
+        self.fingerprint = fingerprint
+        Path(self.index_dir).mkdir(parents=True, exist_ok=True)
+
+        arrays_path = Path(self.index_dir) / "index.npz"
+        tmp_arrays_path = Path(self.index_dir) / "index.tmp.npz"
+        np.savez(
+            tmp_arrays_path,
+            fingerprint=np.array(fingerprint or ""),
+            generation=np.array(self.generation),
+            issue_nums=self.issue_nums,
+            is_issue=self.is_issue,
+            offsets=self.offsets,
+            values=self.values,
+        )
+        os.replace(tmp_arrays_path, arrays_path)
+
+        labels_path = Path(self.index_dir) / "labels.json"
+        tmp_labels_path = labels_path.with_suffix(".json.tmp")
+        vocabulary = {
+            "version": self.VERSION,
+            "fingerprint": fingerprint,
+            "generation": self.generation,
+            "labels": [{"name": name, "url": url} for name, url in zip(self.label_names, self.label_urls)],
+        }
+        tmp_labels_path.write_text(json.dumps(vocabulary, indent=2))
+        os.replace(tmp_labels_path, labels_path)
+
+        if self.journal_path().exists():
+            self.journal_path().unlink()
+        self.uncommitted = {}
+        self.num_committed_labels = len(self.label_names)
+        self.num_saved = len(self.issue_nums)
+        self.num_journaled = 0
+        self.journal_bytes = 0
+        self.journal_inode = None
+
+    def code(self, name: str, url: str) -> int:
+        """
+        Return the code of the label `name`, adding it to the vocabulary if it
+        is new.
+        """
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.label_names)
+            self.codes[name] = code
+            self.label_names.append(name)
+            self.label_urls.append(url)
+        return code
+
+    def add(self, issue_num: int, is_issue: bool, labels: Iterable[Tuple[str, str]]) -> None:
+        """
+        Add (or replace) the labels of an issue.  `labels` are (name, url)
+        pairs.
+        """
+        entry = (is_issue, sorted({self.code(name, url) for name, url in labels}))
+        self.pending[issue_num] = entry
+        self.uncommitted[issue_num] = entry
+        if len(self.pending) >= self.merge_every:
+            self.merge()
+
+    def add_issue(self, issue_data: IssueData) -> None:
+        """
+        Add (or replace) the labels of an `IssueData`.
+        """
+        self.add(issue_data.number, issue_data.is_issue, ((label.name, label.url) for label in issue_data.labels))
+
+    def merge(self) -> None:
+        """
+        Merge the issues buffered by `add` into the arrays.
+        """
+        if not self.pending:
+            return
+
+        new_issue_nums = np.fromiter(self.pending, dtype="int64", count=len(self.pending))
+        new_is_issue = np.array([is_issue for is_issue, _ in self.pending.values()], dtype=bool)
+        new_lengths = np.array([len(codes) for _, codes in self.pending.values()], dtype="int64")
+        new_values = np.array([code for _, codes in self.pending.values() for code in codes], dtype="int32")
+
+        # Drop the rows of issues that are being replaced.
+        keep = ~np.isin(self.issue_nums, new_issue_nums)
+        lengths = np.diff(self.offsets)
+        issue_nums = np.concatenate([self.issue_nums[keep], new_issue_nums])
+        is_issue = np.concatenate([self.is_issue[keep], new_is_issue])
+        lengths = np.concatenate([lengths[keep], new_lengths])
+        values = np.concatenate([self.values[np.repeat(keep, np.diff(self.offsets))], new_values])
+
+        # Sort the rows by issue number, moving each row's values along with
+        # it.
+        order = np.argsort(issue_nums, kind="stable")
+        new_row = np.empty_like(order)
+        new_row[order] = np.arange(len(order))
+        value_order = np.argsort(np.repeat(new_row, lengths), kind="stable")
+
+        self.issue_nums = issue_nums[order]
+        self.is_issue = is_issue[order]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths[order])]).astype("int64")
+        self.values = values[value_order]
+        self.pending = {}
+
+    def rows(self, issue_nums: Sequence[int]) -> np.ndarray:
+        """
+        Return the row of each of the given issue numbers.  Raises a
+        `KeyError` if any of them aren't in the index.
+        """
+        self.merge()
+        issue_nums = np.asarray(issue_nums, dtype="int64")
+        rows = np.searchsorted(self.issue_nums, issue_nums)
+        found = rows < len(self.issue_nums)
+        found[found] = self.issue_nums[rows[found]] == issue_nums[found]
+        if not found.all():
+            raise KeyError(f"Issues not in the label index: {issue_nums[~found][:10].tolist()}")
+        return rows
+
+    def issue_rows(self) -> np.ndarray:
+        """
+        Return the rows of all the issues (not PRs).
+        """
+        self.merge()
+        return np.flatnonzero(self.is_issue)
+
+    def _gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the number of labels of each of `rows`, and all their label
+        codes concatenated.
+        """
+        lengths = np.diff(self.offsets)[rows]
+        starts = self.offsets[:-1][rows]
+        # The position of each value within its row.
+        within_row = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return lengths, self.values[np.repeat(starts, lengths) + within_row]
+
+    def label_counts(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return how many of `rows` (or of all rows) have each label, indexed by
+        label code.
+        """
+        self.merge()
+        values = self.values if rows is None else self._gather(rows)[1]
+        return np.bincount(values, minlength=len(self.label_names))
+
+    def issues_with_label(self, name: str, only_issues: bool = False) -> np.ndarray:
+        """
+        Return the numbers of all the issues with the label `name`, in order.
+        If `only_issues` is true, PRs are left out.
+        """
+        self.merge()
+        code = self.codes.get(name)
+        if code is None:
+            return np.zeros(0, dtype="int64")
+        row_of_value = np.repeat(np.arange(len(self.issue_nums)), np.diff(self.offsets))
+        rows = row_of_value[self.values == code]
+        if only_issues:
+            rows = rows[self.is_issue[rows]]
+        return self.issue_nums[rows]
+
+    def topic_classes(self, rows: Optional[np.ndarray] = None, prefix: str = "6.") -> np.ndarray:
+        """
+        Return the sorted names of the labels starting with `prefix` that at
+        least one of `rows` (or of all rows) has.
+
+        This is the same as the classes a `MultiLabelBinarizer` would find in
+        those rows, filtered by prefix, including being an object array.
+        """
+        counts = self.label_counts(rows)
+        names = sorted(
+            name for code, name in enumerate(self.label_names) if counts[code] > 0 and name.startswith(prefix)
+        )
+        classes = np.empty(len(names), dtype=object)
+        classes[:] = names
+        return classes
+
+    def one_hot(self, label_names: Sequence[str], rows: Optional[np.ndarray] = None) -> scipy_sparse.csr_matrix:
+        """
+        Return a sparse matrix of shape (len(rows), len(label_names)) with a 1
+        where an issue has a label.  Labels that aren't in the vocabulary get
+        an empty column.
+        """
+        self.merge()
+        if rows is None:
+            rows = np.arange(len(self.issue_nums))
+
+        # The column of each label code, or -1 for labels that aren't wanted.
+        column_of_code = np.full(len(self.label_names), -1, dtype="int64")
+        for column, name in enumerate(label_names):
+            if name in self.codes:
+                column_of_code[self.codes[name]] = column
+
+        lengths, values = self._gather(rows)
+        columns = column_of_code[values]
+        keep = columns >= 0
+        row_of_value = np.repeat(np.arange(len(rows)), lengths)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(row_of_value[keep], minlength=len(rows)))])
+
+        matrix: scipy_sparse.csr_matrix = scipy_sparse.csr_matrix(
+            (np.ones(int(keep.sum()), dtype="int64"), columns[keep], indptr),
+            shape=(len(rows), len(label_names)),
+        )
+        matrix.sort_indices()
+        return matrix
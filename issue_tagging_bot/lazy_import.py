@@ -0,0 +1,50 @@
+"""
+Importing TensorFlow, scikit-learn, pandas and friends takes seconds and
+hundreds of MB, which the fetcher (and anything else that only needs
+`IssueData` or the issue files) shouldn't have to pay for.
+
+Modules that use those libraries import them with `lazy_import` instead:
+
+    np = lazy_import("numpy")
+
+which gives a stand-in module that only really imports numpy the first time
+one of its attributes is used.  Those modules also use
+`from __future__ import annotations`, so type annotations like
+`pd.DataFrame` don't count as a use.
+"""
+
+import importlib
+import types
+from typing import Any
+
+
+class LazyModule(types.ModuleType):
+    """
+    A stand-in for the module `name`, which is imported when one of its
+    attributes is first looked up.
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self._lazy_module: Any = None
+
+    def _load(self) -> Any:
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    def __getattr__(self, attr: str) -> Any:
+        # This is only called for attributes that aren't found on the
+        # stand-in itself, which is all of the real module's attributes.
+        return getattr(self._load(), attr)
+
+    def __dir__(self) -> Any:
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> Any:
+    """
+    Return a stand-in for the module `name` (like "numpy" or
+    "pyarrow.parquet") that imports it on first use.
+    """
+    return LazyModule(name)
@@ -0,0 +1,215 @@
+"""
+Counters, gauges and timers for the fetcher and the preprocessing stages.
+
+Everything records into the module-level `METRICS`.  The metrics can be
+written out as JSON lines (one line per metric, appended each time) or as a
+Prometheus text file (overwritten each time, for node_exporter's textfile
+collector).  `MetricsExporter` does this every few seconds in the background,
+so a long crawl or preprocessing run can be watched while it is going:
+
+    $ METRICS_JSON_LINES_PATH=metrics.jsonl METRICS_PROMETHEUS_PATH=metrics.prom ./fetch_all_issues.py
+
+Metric names follow the Prometheus conventions: counters end in `_total`, and
+anything measured in seconds or bytes says so in its name.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# A metric is identified by its name and its labels, as sorted (key, value)
+# pairs.
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class StageTimer:
+    """
+    Returned by `Metrics.stage`.  Set `rows` to the number of rows the stage
+    processed, so the rows per second can be recorded.
+    """
+
+    def __init__(self) -> None:
+        self.rows: int = 0
+
+
+class Metrics:
+    """
+    A thread-safe collection of counters and gauges.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        """
+        Add `amount` to a counter.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """
+        Set a gauge to `value`.
+        """
+        key = _key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """
+        Add the seconds spent in the `with` block to the counter `name`.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - start_time, **labels)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[StageTimer]:
+        """
+        Time a preprocessing stage.  This records the seconds spent and rows
+        processed in the stage, the rows per second of the last run of it, and
+        when it last finished.
+
+            with METRICS.stage("stage1") as stage_timer:
+                ...
+                stage_timer.rows = len(data)
+        """
+        stage_timer = StageTimer()
+        start_time = time.perf_counter()
+        yield stage_timer
+        seconds = time.perf_counter() - start_time
+        self.inc("preproc_stage_seconds_total", seconds, stage=stage)
+        self.inc("preproc_stage_rows_total", stage_timer.rows, stage=stage)
+        self.set("preproc_stage_rows_per_second", stage_timer.rows / seconds if seconds > 0 else 0, stage=stage)
+        self.set("preproc_stage_last_finished_timestamp_seconds", time.time(), stage=stage)
+
+    def samples(self) -> List[Tuple[str, str, Dict[str, str], float]]:
+        """
+        Return the type ("counter" or "gauge"), name, labels and value of every
+        metric, sorted by name.
+        """
+        with self.lock:
+            samples = [("counter", name, dict(labels), value) for (name, labels), value in self.counters.items()]
+            samples += [("gauge", name, dict(labels), value) for (name, labels), value in self.gauges.items()]
+        return sorted(samples, key=lambda sample: (sample[1], sorted(sample[2].items())))
+
+    def write_json_lines(self, path: str) -> None:
+        """
+        Append a line of JSON for every metric to `path`.  All the lines
+        written at once have the same timestamp.
+        """
+        timestamp = time.time()
+        with open(path, "a") as f:
+            for metric_type, name, labels, value in self.samples():
+                record = {"timestamp": timestamp, "type": metric_type, "name": name, "labels": labels, "value": value}
+                f.write(json.dumps(record) + "\n")
+
+    def prometheus_text(self) -> str:
+        """
+        Return all the metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        typed: Dict[str, str] = {}
+        for metric_type, name, labels, value in self.samples():
+            if name not in typed:
+                typed[name] = metric_type
+                lines.append(f"# TYPE {name} {metric_type}")
+            label_str = ",".join(f'{key}="{_escape(label)}"' for key, label in sorted(labels.items()))
+            lines.append(f"{name}{{{label_str}}} {value!r}" if label_str else f"{name} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Write all the metrics to `path` in the Prometheus text format.  The
+        file is replaced atomically, so a scraper never sees half of it.
+        """
+        tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+        tmp_path.write_text(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The metrics that everything records into.
+METRICS = Metrics()
+
+
+class MetricsExporter:
+    """
+    Writes `metrics` to a JSON lines file and/or a Prometheus text file every
+    `interval_seconds` in a background thread, and once more when stopped.
+
+    Can be used as a context manager around a run.
+    """
+
+    def __init__(
+        self,
+        json_lines_path: Optional[str] = None,
+        prometheus_path: Optional[str] = None,
+        interval_seconds: float = 15,
+        metrics: Metrics = METRICS,
+    ) -> None:
+        self.json_lines_path = json_lines_path
+        self.prometheus_path = prometheus_path
+        self.interval_seconds = interval_seconds
+        self.metrics = metrics
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "MetricsExporter":
+        """
+        Create an exporter configured from the `METRICS_JSON_LINES_PATH`,
+        `METRICS_PROMETHEUS_PATH`, and `METRICS_EXPORT_INTERVAL_SECONDS`
+        environment variables.  If neither path is set, the exporter does
+        nothing.
+        """
+        return cls(
+            json_lines_path=os.environ.get("METRICS_JSON_LINES_PATH"),
+            prometheus_path=os.environ.get("METRICS_PROMETHEUS_PATH"),
+            interval_seconds=float(os.environ.get("METRICS_EXPORT_INTERVAL_SECONDS", "15")),
+        )
+
+    def export(self) -> None:
+        if self.json_lines_path is not None:
+            self.metrics.write_json_lines(self.json_lines_path)
+        if self.prometheus_path is not None:
+            self.metrics.write_prometheus(self.prometheus_path)
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval_seconds):
+            self.export()
+
+    def start(self) -> "MetricsExporter":
+        if self.json_lines_path is not None or self.prometheus_path is not None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.export()
+
+    def __enter__(self) -> "MetricsExporter":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,100 @@
+"""
+Helpers for training one model that predicts all of the top N topic labels at
+once, with a sigmoid output per topic.
+
+Topics are very unbalanced (most issues don't have any given topic), so each
+topic's positive examples get a weight in the loss, and each topic gets its
+own threshold above which it is predicted, picked on the validation set.
+"""
+
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np  # type: ignore
+import tensorflow as tf  # type: ignore
+
+
+def positive_class_weights(labels: np.ndarray, max_weight: float = 50) -> np.ndarray:
+    """
+    Return a weight for the positive examples of each topic, so that the
+    positive and negative examples of each topic count for about the same in
+    the loss.
+
+    `labels` is of shape (NUM_ISSUES, NUM_TOPICS).  Returns an array of shape
+    (NUM_TOPICS,), where each weight is the number of negative examples over
+    the number of positive examples, kept between 1 and `max_weight`.
+    """
+    positives: np.ndarray = np.asarray(labels).sum(axis=0).astype("float64")
+    negatives: np.ndarray = len(labels) - positives
+    return np.clip(negatives / np.maximum(positives, 1), 1, max_weight).astype("float32")
+
+
+def weighted_binary_crossentropy(pos_weights: np.ndarray) -> Callable[[tf.Tensor, tf.Tensor], tf.Tensor]:
+    """
+    Return a Keras loss that is the binary crossentropy of each topic, with
+    the positive examples of each topic weighted by `pos_weights`, averaged
+    over the topics.
+    """
+    weights = tf.constant(pos_weights, dtype=tf.float32)
+    epsilon = tf.keras.backend.epsilon()
+
+    def loss(y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.clip_by_value(y_pred, epsilon, 1 - epsilon)
+        losses = -(weights * y_true * tf.math.log(y_pred) + (1 - y_true) * tf.math.log(1 - y_pred))
+        return tf.reduce_mean(losses, axis=-1)
+
+    return loss
+
+
+def f1_scores(labels: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """
+    Return the F1 score of each topic, given the true `labels` and the
+    predicted 0/1 `predictions`, both of shape (NUM_ISSUES, NUM_TOPICS).
+    """
+    labels = np.asarray(labels, dtype=bool)
+    predictions = np.asarray(predictions, dtype=bool)
+    true_positives = (labels & predictions).sum(axis=0)
+    false_positives = (~labels & predictions).sum(axis=0)
+    false_negatives = (labels & ~predictions).sum(axis=0)
+    return 2 * true_positives / np.maximum(2 * true_positives + false_positives + false_negatives, 1)
+
+
+def calibrate_thresholds(
+    labels: np.ndarray,
+    scores: np.ndarray,
+    topic_labels: Sequence[str],
+    candidates: Sequence[float] = tuple(np.linspace(0.05, 0.95, 19)),
+    default_threshold: float = 0.5,
+) -> Dict[str, float]:
+    """
+    Pick the threshold for each topic that gives the best F1 score on a held
+    out set (normally the validation set).
+
+    `labels` are the true labels and `scores` are the model's sigmoid outputs,
+    both of shape (NUM_ISSUES, NUM_TOPICS).  Topics without any positive
+    examples in the held out set get `default_threshold`.
+
+    Returns a dict of topic label names to thresholds, which can be passed to
+    `inference.save_model`.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    thresholds: Dict[str, float] = {}
+    for topic, (topic_labels_col, topic_scores) in enumerate(zip(labels.T, np.asarray(scores).T)):
+        if not topic_labels_col.any():
+            thresholds[topic_labels[topic]] = default_threshold
+            continue
+        # Shape (NUM_ISSUES, len(candidates)), one column per candidate
+        # threshold.
+        predictions = topic_scores[:, None] >= np.asarray(candidates)[None, :]
+        candidate_f1s = f1_scores(np.repeat(topic_labels_col[:, None], len(candidates), axis=1), predictions)
+        thresholds[topic_labels[topic]] = float(candidates[int(np.argmax(candidate_f1s))])
+    return thresholds
+
+
+def predict_with_thresholds(scores: np.ndarray, topic_labels: List[str], thresholds: Dict[str, float]) -> np.ndarray:
+    """
+    Return the 0/1 predictions of shape (NUM_ISSUES, NUM_TOPICS) for the
+    model's `scores`, using each topic's threshold.
+    """
+    threshold_array = np.array([thresholds[label] for label in topic_labels])
+    return (np.asarray(scores) >= threshold_array[None, :]).astype("int64")
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""
+A small local HTTP server that mimics the parts of the GitHub REST API that
+the fetcher uses.  This makes it possible to run fetch_all_issues.py end-to-end
+without a GitHub API token or any network access:
+
+    $ python3 -m issue_tagging_bot.stub_github --num-issues 2000 --port 8000
+    $ GITHUB_API_URL=http://127.0.0.1:8000 GITHUB_API_TOKEN=dummy ./fetch_all_issues.py
+"""
+
+import argparse
+import json
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from issue_tagging_bot.http_server import BacklogHTTPServer
+
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+TOPIC_LABELS = [
+    "6.topic: haskell",
+    "6.topic: nixos",
+    "6.topic: python",
+    "6.topic: qt/kde",
+    "6.topic: rust",
+    "6.topic: darwin",
+    "6.topic: printing",
+    "6.topic: emacs",
+]
+
+OTHER_LABELS = [
+    "0.kind: bug",
+    "0.kind: enhancement",
+    "0.kind: question",
+    "2.status: stale",
+    "9.needs: reporter feedback",
+]
+
+WORDS = "nix package build fails with error when running on the latest channel update module option service".split()
+
+
+def make_stub_issue(
+    number: int,
+    labels: List[str],
+    is_pull_request: bool = False,
+    body: str = "",
+    updated_at: Optional[datetime] = None,
+    created_at: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    Return a dict that looks like the JSON GitHub returns for a single issue.
+    The `url` fields are relative, and get filled in by the server when the
+    issue is served.
+
+    Issues are created one hour apart in number order.  An issue transferred
+    from another repository gets a new number but keeps its creation time,
+    which can be faked by passing an earlier `created_at`.
+    """
+    created_at = datetime(2015, 1, 1) + timedelta(hours=number) if created_at is None else created_at
+    updated_at = created_at + timedelta(days=1) if updated_at is None else updated_at
+    issue: Dict[str, Any] = {
+        "id": 100000000 + number,
+        "url": f"/issues/{number}",
+        "number": number,
+        "state": "closed" if number % 3 == 0 else "open",
+        "title": f"Issue number {number}",
+        "body": body,
+        "user": {"login": f"user{number % 97}", "id": number % 97},
+        "labels": [{"name": name, "url": f"/labels/{name}"} for name in labels],
+        "comments": number % 7,
+        "closed_at": updated_at.strftime(GITHUB_DATE_FORMAT) if number % 3 == 0 else None,
+        "created_at": created_at.strftime(GITHUB_DATE_FORMAT),
+        "updated_at": updated_at.strftime(GITHUB_DATE_FORMAT),
+    }
+    if is_pull_request:
+        issue["pull_request"] = {"url": f"/pulls/{number}"}
+    return issue
+
+
+def iter_stub_issues(num_issues: int, seed: int = 42, missing_ratio: float = 0.02) -> Iterator[Dict[str, Any]]:
+    """
+    Generate a random corpus of issues numbered 1 to `num_issues`, one issue
+    at a time, so that large corpora never have to be in memory at once.
+    Roughly `missing_ratio` of the issue numbers are left out, so that the
+    server returns a 404 for them (like deleted or transferred issues on
+    GitHub).
+    """
+    rand = random.Random(seed)
+    for number in range(1, num_issues + 1):
+        if rand.random() < missing_ratio:
+            continue
+        labels = rand.sample(TOPIC_LABELS, rand.randint(0, 2)) + rand.sample(OTHER_LABELS, rand.randint(0, 2))
+        body = " ".join(rand.choice(WORDS) for _ in range(rand.randint(10, 200)))
+        yield make_stub_issue(number, labels, is_pull_request=rand.random() < 0.4, body=body)
+
+
+def make_stub_issues(num_issues: int, seed: int = 42, missing_ratio: float = 0.02) -> Dict[int, Dict[str, Any]]:
+    """
+    Like `iter_stub_issues`, but return a dict of all the issues by number.
+    """
+    return {issue["number"]: issue for issue in iter_stub_issues(num_issues, seed, missing_ratio)}
+
+
+class StubGitHubServer:
+    """
+    A threaded HTTP server serving a fixed set of issues for a single
+    repository.  `request_counts` counts how many requests were made to each
+    kind of endpoint, which is handy for comparing fetch strategies.
+
+    Can be used as a context manager:
+
+        with StubGitHubServer(make_stub_issues(100)) as server:
+            github = Github("dummy", base_url=server.base_url)
+    """
+
+    def __init__(
+        self,
+        issues: Dict[int, Dict[str, Any]],
+        repo_str: str = "NixOS/nixpkgs",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        rate_limit: int = 5000,
+    ) -> None:
+        self.issues = issues
+        self.repo_str = repo_str
+        self.rate_limit = rate_limit
+        self.rate_limit_remaining = rate_limit
+        self.rate_limit_reset = datetime.utcnow() + timedelta(hours=1)
+        self.request_counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.httpd = BacklogHTTPServer((host, port), self._make_handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def repo_url(self) -> str:
+        return f"{self.base_url}/repos/{self.repo_str}"
+
+    def start(self) -> "StubGitHubServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubGitHubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    def _absolute_issue(self, issue: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return a copy of `issue` with all the relative urls made absolute.
+        """
+        issue = dict(issue)
+        issue["url"] = self.repo_url + issue["url"]
+        issue["labels"] = [{**label, "url": self.repo_url + label["url"]} for label in issue["labels"]]
+        if "pull_request" in issue:
+            issue["pull_request"] = {"url": self.repo_url + issue["pull_request"]["url"]}
+        return issue
+
+    def _list_issues(self, query: Dict[str, str]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Return one page of the issue listing endpoint, along with the extra
+        headers (the pagination `Link` header) to send.
+        """
+        state = query.get("state", "open")
+        sort = query.get("sort", "created")
+        direction = query.get("direction", "desc")
+        since = query.get("since")
+        per_page = min(int(query.get("per_page", "30")), 100)
+        page = int(query.get("page", "1"))
+
+        issues = list(self.issues.values())
+        if state != "all":
+            issues = [i for i in issues if i["state"] == state]
+        if since is not None:
+            since_time = since.replace("+00:00", "Z")
+            issues = [i for i in issues if i["updated_at"] >= since_time]
+        # Sorting by creation time is only the same as sorting by number if
+        # no issues have been transferred in (see `make_stub_issue`).
+        sort_key = "updated_at" if sort == "updated" else "created_at"
+        issues.sort(key=lambda i: i[sort_key], reverse=direction == "desc")
+
+        last_page = max(1, -(-len(issues) // per_page))
+        page_issues = issues[(page - 1) * per_page : page * per_page]
+
+        def page_url(page_num: int) -> str:
+            return f"{self.repo_url}/issues?" + urlencode({**query, "per_page": per_page, "page": page_num})
+
+        links = []
+        if page < last_page:
+            links.append(f'<{page_url(page + 1)}>; rel="next"')
+            links.append(f'<{page_url(last_page)}>; rel="last"')
+        if page > 1:
+            links.append(f'<{page_url(1)}>; rel="first"')
+            links.append(f'<{page_url(page - 1)}>; rel="prev"')
+        headers = {"Link": ", ".join(links)} if links else {}
+
+        return [self._absolute_issue(i) for i in page_issues], headers
+
+    def _rate_limit_json(self) -> Dict[str, Any]:
+        core = {
+            "limit": self.rate_limit,
+            "remaining": self.rate_limit_remaining,
+            "reset": int((self.rate_limit_reset - datetime(1970, 1, 1)).total_seconds()),
+        }
+        return {"resources": {"core": core, "search": core, "graphql": core}, "rate": core}
+
+    def handle_get(self, path: str, query: Dict[str, str]) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        Return the status code, the JSON body, and the extra headers for a GET
+        request.
+        """
+        repo_path = f"/repos/{self.repo_str}"
+
+        if path == "/rate_limit":
+            self.request_counts["rate_limit"] += 1
+            return 200, self._rate_limit_json(), {}
+
+        with self.lock:
+            self.rate_limit_remaining = max(0, self.rate_limit_remaining - 1)
+
+        if path == repo_path:
+            self.request_counts["repo"] += 1
+            name = self.repo_str.split("/")[1]
+            return 200, {"id": 1, "name": name, "full_name": self.repo_str, "url": self.repo_url}, {}
+
+        if path == f"{repo_path}/issues":
+            self.request_counts["list_issues"] += 1
+            page_issues, headers = self._list_issues(query)
+            return 200, page_issues, headers
+
+        if path.startswith(f"{repo_path}/issues/"):
+            self.request_counts["get_issue"] += 1
+            try:
+                issue = self.issues.get(int(path.rsplit("/", 1)[1]))
+            except ValueError:
+                issue = None
+            if issue is None:
+                return 404, {"message": "Not Found"}, {}
+            return 200, self._absolute_issue(issue), {}
+
+        self.request_counts["unknown"] += 1
+        return 404, {"message": "Not Found"}, {}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                parsed = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                status, body, headers = server.handle_get(parsed.path.rstrip("/"), query)
+                encoded = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.send_header("X-RateLimit-Limit", str(server.rate_limit))
+                self.send_header("X-RateLimit-Remaining", str(server.rate_limit_remaining))
+                self.send_header("X-RateLimit-Reset", str(server._rate_limit_json()["rate"]["reset"]))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake GitHub issues API for testing the fetcher.")
+    parser.add_argument("--num-issues", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--repo", default="NixOS/nixpkgs")
+    args = parser.parse_args()
+
+    server = StubGitHubServer(make_stub_issues(args.num_issues), repo_str=args.repo, port=args.port)
+    print(f"Serving {len(server.issues)} issues for {args.repo} on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+Score every downloaded issue with a trained model, for back-labeling issues
+that never got topic labels.
+
+    $ ./score_all_issues.py --model-dir trained-model --only-unlabeled
+
+The scores are written to Parquet files in the output directory, one file per
+chunk of issues, named by the range of issue numbers in the chunk, like
+`scores-000001-010000.parquet`.  Each file has a `number` column and one
+float32 column of scores per topic label.  Running this again carries on
+after the highest issue number that has already been scored.
+"""
+
+import argparse
+import os
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+
+from issue_tagging_bot.inference import load_model
+from issue_tagging_bot.issue_data import IssueFiles, encode_texts, input_texts
+from issue_tagging_bot.metrics import METRICS, MetricsExporter
+
+
+class BatchScorer:
+    """
+    Reads issues from `issue_files` a chunk at a time, runs the model on them
+    `batch_size` issues at a time, and writes out the scores for each chunk
+    before reading the next one.  Memory use only depends on `chunk_size` (and,
+    when the json files are parsed in a pool of processes, on how many
+    processes there are, since each parses a couple of chunks ahead), not on
+    how many issues there are.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        labels: List[str],
+        issue_files: IssueFiles,
+        input_text_len: int = 1000,
+        output_dir: str = "issue-scores",
+        batch_size: int = 512,
+        chunk_size: int = 10000,
+        only_unlabeled: bool = False,
+    ) -> None:
+        """
+        If `only_unlabeled` is true, only issues without any topic labels
+        (labels starting with "6.") are scored.
+        """
+        self.model = model
+        self.labels = labels
+        self.issue_files = issue_files
+        self.input_text_len = input_text_len
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.only_unlabeled = only_unlabeled
+
+    def part_paths(self) -> List[Path]:
+        """
+        Return the paths to all the score files written so far, lowest issue
+        numbers first.
+        """
+        if not os.path.isdir(self.output_dir):
+            return []
+        return [
+            Path(self.output_dir) / f
+            for f in sorted(os.listdir(self.output_dir))
+            if f.startswith("scores-") and f.endswith(".parquet")
+        ]
+
+    def last_scored_issue_num(self) -> int:
+        """
+        Return the highest issue number that has already been scored, or 0 if
+        nothing has been scored yet.  This only looks at the file names.
+        """
+        return max((int(path.stem.split("-")[2]) for path in self.part_paths()), default=0)
+
+    def score_chunk(self, issues: pd.DataFrame) -> pa.Table:
+        """
+        Return a Table with the issue number and the score for every label for
+        each issue in `issues`.
+        """
+        encoded: np.ndarray = encode_texts(input_texts(issues, self.input_text_len).tolist(), self.input_text_len)
+
+        scores: np.ndarray = np.zeros((len(issues), len(self.labels)), dtype="float32")
+        for start in range(0, len(issues), self.batch_size):
+            batch_scores = np.asarray(self.model.predict_on_batch(encoded[start : start + self.batch_size]))
+            scores[start : start + self.batch_size] = batch_scores.reshape((-1, len(self.labels)))
+
+        columns = {"number": pa.array(issues["number"].to_numpy(dtype="int64"))}
+        for i, label in enumerate(self.labels):
+            columns[label] = pa.array(scores[:, i])
+        return pa.table(columns)
+
+    def write_part(self, first_issue_num: int, last_issue_num: int, table: pa.Table) -> None:
+        """
+        Write the scores for a chunk of issues.  The file is written under a
+        temporary name and renamed into place, so a killed run never leaves a
+        partial file that would be skipped when resuming.
+        """
+        Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+        path = Path(self.output_dir) / f"scores-{first_issue_num:06}-{last_issue_num:06}.parquet"
+        tmp_path = path.with_suffix(".parquet.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def run(self) -> int:
+        """
+        Score all the issues that haven't been scored yet.  Returns how many
+        issues were scored.
+        """
+        start_after = self.last_scored_issue_num()
+        if start_after > 0:
+            print(f"Resuming after issue {start_after}")
+
+        chunks = self.issue_files.data_frame_chunks(
+            ["number", "user_login", "title", "body", "labels"],
+            only_issues=True,
+            chunk_size=self.chunk_size,
+            min_issue_num=start_after + 1,
+        )
+
+        num_scored = 0
+        for chunk in chunks:
+            first_issue_num = int(chunk["number"].iloc[0])
+            last_issue_num = int(chunk["number"].iloc[-1])
+
+            if self.only_unlabeled:
+                has_topic = chunk["labels"].apply(lambda labels: any(l["name"].startswith("6.") for l in labels))
+                chunk = chunk[~has_topic]
+
+            # A chunk with nothing left to score still gets a (empty) file, so
+            # that resuming doesn't read it again.
+            with METRICS.stage("score") as stage_timer:
+                self.write_part(first_issue_num, last_issue_num, self.score_chunk(chunk))
+                stage_timer.rows = len(chunk)
+            num_scored += len(chunk)
+            print(f"Scored {len(chunk)} issues from {first_issue_num} to {last_issue_num}")
+
+        return num_scored
+
+    def scores(self) -> pd.DataFrame:
+        """
+        Return a DataFrame of all the scores written so far, indexed by issue
+        number.
+        """
+        tables = [pq.read_table(path) for path in self.part_paths()]
+        if not tables:
+            return pd.DataFrame(columns=self.labels)
+        return pa.concat_tables(tables).to_pandas().set_index("number")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score all downloaded issues with a trained model.")
+    parser.add_argument("--model-dir", default="trained-model")
+    parser.add_argument("--data-dir", default="issue-data")
+    parser.add_argument("--store-dir", help="Read issues from this Parquet issue store instead of --data-dir.")
+    parser.add_argument("--output-dir", default="issue-scores")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--num-processes", type=int, default=1)
+    parser.add_argument("--only-unlabeled", action="store_true", help="Only score issues without topic labels.")
+    args = parser.parse_args()
+
+    with MetricsExporter.from_env():
+        model, metadata = load_model(args.model_dir)
+        scorer = BatchScorer(
+            model,
+            metadata["labels"],
+            IssueFiles(args.data_dir, store_dir=args.store_dir, num_processes=args.num_processes),
+            input_text_len=metadata["input_text_len"],
+            output_dir=args.output_dir,
+            batch_size=args.batch_size,
+            chunk_size=args.chunk_size,
+            only_unlabeled=args.only_unlabeled,
+        )
+        num_scored = scorer.run()
+        print(f"Scored {num_scored} issues into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
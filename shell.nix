@@ -16,8 +16,10 @@ let
     extraLibs = with python37Packages; [
       numpy
       pandas
+      pyarrow
       PyGithub
       scikitlearn
+      scipy
       tensorflow-bin
 
       # dev tools
@@ -0,0 +1,277 @@
+"""
+Tests for resuming the fetcher, against the stub GitHub server.
+
+    $ python3 -m pytest tests
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from github import Github  # type: ignore
+
+from fetch_all_issues import Fetcher
+from issue_tagging_bot.issue_data import IssueFiles
+from issue_tagging_bot.label_index import LabelIndex
+from issue_tagging_bot.stub_github import StubGitHubServer, make_stub_issue, make_stub_issues
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Runs a fetcher against the stub server at `base_url`, and kills it with
+# `os._exit` (so nothing gets flushed) on the `kill_at`th call to `target`.
+KILLED_FETCHER = """
+import os, sys
+from github import Github
+import fetch_all_issues
+from issue_tagging_bot.label_index import LabelIndex
+
+base_url, data_dir, mode, target, kill_at = sys.argv[1:]
+owner, name = {
+    "replace": (os, "replace"),
+    "commit": (LabelIndex, "commit"),
+    "manifest": (fetch_all_issues.FetchManifest, "save"),
+}[target]
+original = getattr(owner, name)
+calls = [0]
+
+def killing(*args, **kwargs):
+    calls[0] += 1
+    if calls[0] == int(kill_at):
+        os._exit(9)
+    return original(*args, **kwargs)
+
+setattr(owner, name, killing)
+fetch_all_issues.Fetcher(
+    lambda: Github("dummy-token", base_url=base_url, per_page=100), data_dir_str=data_dir, mode=mode, batch_size=37
+).run()
+"""
+
+
+class Crash(Exception):
+    pass
+
+
+class CountingFetcher(Fetcher):
+    """
+    A fetcher that remembers the number of every issue it saves.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.saved: List[int] = []
+
+    def save_issue(self, issue_num: int, issue_data: Any) -> None:
+        self.saved.append(issue_num)
+        super().save_issue(issue_num, issue_data)
+
+
+class CrashingFetcher(Fetcher):
+    """
+    A fetcher that stops with a `Crash` when it gets to listing page
+    `crash_at_page`.
+    """
+
+    crash_at_page = -1
+
+    def get_listing_page(self, listing: Any, page_num: int) -> List[Any]:
+        if page_num == self.crash_at_page:
+            raise Crash()
+        return super().get_listing_page(listing, page_num)
+
+
+class RebuildingFetcher(Fetcher):
+    """
+    A fetcher that, when it gets to listing page 2, has something else
+    rebuild and save the label index, replacing the one it is appending to.
+    At page 3, it remembers the journal and the index on disk.
+    """
+
+    def get_listing_page(self, listing: Any, page_num: int) -> List[Any]:
+        index_dir = LabelIndex.index_dir_for(self.issue_files)
+        if page_num == 2:
+            LabelIndex.open(IssueFiles(self.data_dir_str), save=True)
+        if page_num == 3:
+            self.journal = (Path(index_dir) / "journal.jsonl").read_bytes()
+            self.index_on_disk = LabelIndex.load(index_dir)
+            self.issue_nums_on_disk = sorted(self.issue_files.issue_nums())
+        return super().get_listing_page(listing, page_num)
+
+
+class ReadingFetcher(Fetcher):
+    """
+    A fetcher that opens the label index the way `Stage1PreprocData` does when
+    it gets to listing page 2, and remembers what the index looked like on
+    disk before and after.
+    """
+
+    def get_listing_page(self, listing: Any, page_num: int) -> List[Any]:
+        if page_num == 2:
+            index_dir = Path(LabelIndex.index_dir_for(self.issue_files))
+            self.index_files_before = {path.name: path.read_bytes() for path in index_dir.iterdir()}
+            self.issue_nums_on_disk = sorted(IssueFiles(self.data_dir_str).issue_nums())
+            self.reader_index = LabelIndex.open(IssueFiles(self.data_dir_str))
+            self.index_files_after = {path.name: path.read_bytes() for path in index_dir.iterdir()}
+        return super().get_listing_page(listing, page_num)
+
+
+def index_labels(label_index: LabelIndex) -> Dict[int, Set[str]]:
+    """
+    Return the label names of every issue in `label_index`, by issue number.
+    """
+    return {
+        int(issue_num): {label_index.label_names[code] for code in label_index.values[start:end]}
+        for issue_num, start, end in zip(label_index.issue_nums, label_index.offsets[:-1], label_index.offsets[1:])
+    }
+
+
+def make_fetcher(server: StubGitHubServer, data_dir: str, mode: str, cls: type = Fetcher, **kwargs: Any) -> Fetcher:
+    return cls(
+        lambda: Github("dummy-token", base_url=server.base_url, per_page=100),
+        data_dir_str=data_dir,
+        mode=mode,
+        **kwargs,
+    )
+
+
+class ListingResumeTest(unittest.TestCase):
+    def test_transferred_issue_is_fetched_after_a_crash(self) -> None:
+        issues = make_stub_issues(450)
+        # A transferred issue keeps its creation time, so it is listed with
+        # the oldest issues even though it has one of the highest numbers.
+        issues[440] = make_stub_issue(440, ["6.topic: rust"], created_at=datetime(2014, 1, 1))
+
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            fetcher = make_fetcher(server, data_dir, "listing", cls=CrashingFetcher)
+            fetcher.crash_at_page = 2
+            with self.assertRaises(Crash):
+                fetcher.run()
+            self.assertNotIn(440, set(IssueFiles(data_dir).issue_nums()))
+
+            make_fetcher(server, data_dir, "listing").run()
+            self.assertEqual(sorted(IssueFiles(data_dir).issue_nums()), sorted(issues))
+
+
+class CrashResumeTest(unittest.TestCase):
+    """
+    Kill the fetcher at various points, then check that it resumes to the
+    same issues and label index as a crawl that was never interrupted.
+    """
+
+    def check_resume(self, mode: str, target: str, kill_at: int) -> None:
+        issues = make_stub_issues(450)
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            killed = subprocess.run(
+                [sys.executable, "-c", KILLED_FETCHER, server.base_url, data_dir, mode, target, str(kill_at)],
+                cwd=REPO_DIR,
+                env={**os.environ, "PYTHONPATH": str(REPO_DIR)},
+                stdout=subprocess.DEVNULL,
+            )
+            self.assertEqual(killed.returncode, 9)
+            num_saved = len(list(IssueFiles(data_dir).issue_nums()))
+            self.assertGreater(num_saved, 0)
+            self.assertLess(num_saved, len(issues))
+
+            make_fetcher(server, data_dir, mode, batch_size=37).run()
+
+            issue_files = IssueFiles(data_dir)
+            self.assertEqual(sorted(issue_files.issue_nums()), sorted(issues))
+            # Check the index on disk, not one `open` would rebuild.
+            index_dir = LabelIndex.index_dir_for(issue_files)
+            saved_index = LabelIndex.load(index_dir)
+            self.assertIsNotNone(saved_index)
+            self.assertEqual(saved_index.fingerprint, issue_files.fingerprint())
+            self.assertEqual(index_labels(saved_index), index_labels(LabelIndex.build(issue_files, index_dir)))
+
+    def test_killed_while_writing_issues(self) -> None:
+        for mode in ["per-issue", "listing"]:
+            with self.subTest(mode=mode):
+                self.check_resume(mode, "replace", 100)
+
+    def test_killed_while_committing_the_label_index(self) -> None:
+        for mode in ["per-issue", "listing"]:
+            with self.subTest(mode=mode):
+                self.check_resume(mode, "commit", 4)
+
+    def test_killed_before_saving_the_manifest(self) -> None:
+        for mode in ["per-issue", "listing"]:
+            with self.subTest(mode=mode):
+                self.check_resume(mode, "manifest", 5)
+
+
+class LabelIndexTest(unittest.TestCase):
+    def test_index_replaced_during_a_crawl(self) -> None:
+        issues = make_stub_issues(450)
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            fetcher = make_fetcher(server, data_dir, "listing", cls=RebuildingFetcher, batch_size=30)
+            fetcher.run()
+
+            # In the middle of the crawl, the index on disk has every issue
+            # that is.
+            self.assertNotIn(b"\0", fetcher.journal)
+            self.assertEqual(fetcher.index_on_disk.issue_nums.tolist(), fetcher.issue_nums_on_disk)
+
+            issue_files = IssueFiles(data_dir)
+            index_dir = LabelIndex.index_dir_for(issue_files)
+            self.assertEqual(
+                index_labels(LabelIndex.load(index_dir)), index_labels(LabelIndex.build(issue_files, index_dir))
+            )
+
+    def test_journal_ends_at_a_bad_line(self) -> None:
+        for bad_line in [b'{"generation": 2, "lab', b"\0" * 10 + b"\n", b"\0" * 10 + b'{"generation": 2}\n']:
+            with self.subTest(bad_line=bad_line), tempfile.TemporaryDirectory() as index_dir:
+                label_index = LabelIndex(index_dir)
+                label_index.save(None)
+                label_index.add(1, True, [("6.topic: rust", "/labels/rust")])
+                label_index.commit()
+                journal_path = Path(index_dir) / "journal.jsonl"
+                with journal_path.open("ab") as f:
+                    f.write(bad_line)
+
+                loaded = LabelIndex.load(index_dir)
+                self.assertEqual(index_labels(loaded), {1: {"6.topic: rust"}})
+
+                # The next commit replaces the bad line.
+                loaded.add(2, False, [])
+                loaded.commit()
+                self.assertNotIn(b"\0", journal_path.read_bytes())
+                self.assertEqual(index_labels(LabelIndex.load(index_dir)), {1: {"6.topic: rust"}, 2: set()})
+
+    def test_readers_leave_the_fetchers_index_alone(self) -> None:
+        issues = make_stub_issues(450)
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            fetcher = make_fetcher(server, data_dir, "listing", cls=ReadingFetcher, batch_size=30)
+            fetcher.run()
+
+            self.assertEqual(fetcher.index_files_after, fetcher.index_files_before)
+            # The reader still got an index of every issue on disk then.
+            self.assertEqual(fetcher.reader_index.issue_nums.tolist(), fetcher.issue_nums_on_disk)
+
+            issue_files = IssueFiles(data_dir)
+            self.assertEqual(
+                index_labels(LabelIndex.open(issue_files)),
+                index_labels(LabelIndex.build(issue_files, LabelIndex.index_dir_for(issue_files))),
+            )
+
+
+class SyncSinceTest(unittest.TestCase):
+    def test_each_issue_is_saved_once(self) -> None:
+        issues = make_stub_issues(450)
+        # More than a page of issues updated in the same second.
+        for number in range(100, 350):
+            if number in issues:
+                issues[number]["updated_at"] = "2016-01-01T00:00:00Z"
+
+        with StubGitHubServer(issues) as server, tempfile.TemporaryDirectory() as data_dir:
+            fetcher = make_fetcher(server, data_dir, "since", cls=CountingFetcher)
+            fetcher.run()
+            self.assertEqual(sorted(fetcher.saved), sorted(issues))
+
+
+if __name__ == "__main__":
+    unittest.main()
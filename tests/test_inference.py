@@ -0,0 +1,164 @@
+"""
+Tests for the webhook inference server, using a stub model so TensorFlow
+isn't needed.
+
+    $ python3 -m pytest tests
+"""
+
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Tuple
+
+import numpy as np  # type: ignore
+
+from issue_tagging_bot.inference import InferenceServer, TopicPredictor
+
+LABELS = ["6.topic: haskell", "6.topic: python", "6.topic: rust"]
+
+
+class StubModel:
+    """
+    Scores every issue the same, 0.9, 0.3 and 0.6 for the three labels, and
+    remembers the batches it was called with.
+    """
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        self.batches.append(batch)
+        return np.tile(np.array([0.9, 0.3, 0.6], dtype="float32"), (len(batch), 1))
+
+
+class BrokenModel:
+    """
+    Returns the wrong number of scores for a batch of more than one issue.
+    """
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        return np.zeros(3, dtype="float32")
+
+
+class RaisingModel:
+    """
+    Fails every batch.
+    """
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        raise RuntimeError("out of memory")
+
+
+class SlowModel(StubModel):
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        time.sleep(1)
+        return super().predict_on_batch(batch)
+
+
+def post(url: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read())
+
+
+class InferenceServerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.model = StubModel()
+        # Haskell is above its 0.5 default threshold but below its own, and
+        # Python is below the default but above its own.
+        thresholds = {"6.topic: haskell": 0.95, "6.topic: python": 0.25}
+        predictor = TopicPredictor(self.model, LABELS, input_text_len=100, thresholds=thresholds)
+        self.server = InferenceServer(predictor, port=0).start()
+        self.addCleanup(self.server.stop)
+
+    def test_webhook_payload(self) -> None:
+        payload = {"action": "opened", "issue": {"user": {"login": "me"}, "title": "ghc", "body": "cabal"}}
+        status, body = post(self.server.url + "/webhook", json.dumps(payload).encode("utf-8"))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body["labels"], ["6.topic: python", "6.topic: rust"])
+        self.assertEqual(set(body["scores"]), set(LABELS))
+        self.assertAlmostEqual(body["scores"]["6.topic: haskell"], 0.9, places=5)
+
+        # The model got the issue encoded to `input_text_len`.
+        self.assertEqual(self.model.batches[0].shape, (1, 100))
+
+    def test_bare_issue_and_issue_data(self) -> None:
+        for payload in [
+            {"user": {"login": "me"}, "title": "ghc", "body": None},
+            {"user_login": "me", "title": "ghc", "body": "cabal", "number": 1},
+        ]:
+            status, body = post(self.server.url + "/webhook", json.dumps(payload).encode("utf-8"))
+            self.assertEqual(status, 200)
+            self.assertEqual(body["labels"], ["6.topic: python", "6.topic: rust"])
+
+    def test_invalid_payloads(self) -> None:
+        for raw_body in [b"not json", b"[1, 2]", b'{"issue": {"user": "me"}}']:
+            status, body = post(self.server.url + "/webhook", raw_body)
+            self.assertEqual(status, 400, raw_body)
+            self.assertIn("message", body)
+        self.assertEqual(self.model.batches, [])
+
+    def test_unknown_path(self) -> None:
+        status, _ = post(self.server.url + "/other", b"{}")
+        self.assertEqual(status, 404)
+
+    def test_healthz(self) -> None:
+        with urllib.request.urlopen(self.server.url + "/healthz", timeout=10) as response:
+            self.assertEqual(response.status, 200)
+
+
+class InferenceServerErrorTest(unittest.TestCase):
+    def serve(self, model: Any, **kwargs: Any) -> InferenceServer:
+        predictor = TopicPredictor(model, LABELS, input_text_len=100)
+        server = InferenceServer(predictor, port=0, **kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_model_failure(self) -> None:
+        server = self.serve(RaisingModel())
+        status, body = post(server.url + "/webhook", b'{"user_login": "me", "title": "t", "body": "b"}')
+        self.assertEqual(status, 500)
+        self.assertIn("out of memory", body["message"])
+
+    def test_timeout(self) -> None:
+        server = self.serve(SlowModel(), timeout_seconds=0.1)
+        status, body = post(server.url + "/webhook", b'{"user_login": "me", "title": "t", "body": "b"}')
+        self.assertEqual(status, 500)
+        self.assertIn("Timed out", body["message"])
+
+
+class TopicPredictorTest(unittest.TestCase):
+    def test_malformed_batch_fails_every_request(self) -> None:
+        # A long wait makes sure the two requests end up in one batch.
+        predictor = TopicPredictor(BrokenModel(), LABELS, input_text_len=100, max_batch_size=2, max_wait_seconds=1)
+        errors = []
+
+        def predict() -> None:
+            try:
+                predictor.predict({"user_login": "me", "title": "t", "body": "b"}, timeout=10)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=predict) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors), errors)
+
+    def test_batch_sizes_are_bounded(self) -> None:
+        predictor = TopicPredictor(StubModel(), LABELS, input_text_len=100, max_wait_seconds=0)
+        self.assertIsNotNone(predictor.batch_sizes.maxlen)
+
+
+if __name__ == "__main__":
+    unittest.main()
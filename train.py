@@ -1,25 +1,39 @@
 #!/usr/bin/env python3
 
-import tensorflow as tf
-
-from issue_tagging_bot.issue_data import Stage1PreprocData, Stage2PreprocData
+import argparse
+import os
 
-def only_nixos_labels(dataset: tf.data.Dataset) -> tf.data.Dataset:
-    return dataset.map(lambda issue_body, labels, issue_num: (issue_body, labels[-1], issue_num))
+import numpy as np
+import tensorflow as tf
 
-def main() -> None:
+from issue_tagging_bot.inference import save_model
+from issue_tagging_bot.issue_data import IssueFiles, Stage1PreprocData, Stage2PreprocData
+from issue_tagging_bot.metrics import METRICS, MetricsExporter
+from issue_tagging_bot.multi_label import (
+    calibrate_thresholds,
+    f1_scores,
+    positive_class_weights,
+    predict_with_thresholds,
+    weighted_binary_crossentropy,
+)
 
-    stage2 = Stage2PreprocData()
-    train_set, val_set, test_set = stage2.to_datasets()
+def only_nixos_label(issue_body: tf.Tensor, labels: tf.Tensor, issue_num: tf.Tensor):
+    # The issue number is dropped, since Keras would take a third element as
+    # sample weights.
+    return (issue_body, labels[-1])
 
-    train_set = train_set.shuffle(buffer_size=100000, seed=42, reshuffle_each_iteration=True)
+def all_topic_labels(issue_body: tf.Tensor, labels: tf.Tensor, issue_num: tf.Tensor):
+    # The issue number is dropped, since Keras would take a third element as
+    # sample weights.
+    return (tf.cast(issue_body, tf.float32), tf.cast(labels, tf.float32))
 
-    train_set = only_nixos_labels(train_set)
-    val_set = only_nixos_labels(val_set)
-    test_set = only_nixos_labels(test_set)
+def train_nixos_only(stage2: Stage2PreprocData, args: argparse.Namespace) -> None:
+    # Not cached: the issues are streamed from the memory-mapped encoded
+    # arrays on each epoch, instead of keeping a copy of them all in memory.
+    train_set, val_set, test_set = stage2.to_batched_datasets(batch_size=args.batch_size, map_func=only_nixos_label)
 
     model = tf.keras.models.Sequential([
-        tf.keras.layers.Dense(300, input_shape=[1000], activation="relu"),
+        tf.keras.layers.Dense(300, input_shape=[stage2.input_text_len], activation="relu"),
         tf.keras.layers.Dense(1, activation="softmax")
     ])
 
@@ -27,7 +41,88 @@ def main() -> None:
 
     model.compile(loss="sparse_categorical_crossentropy", optimizer="sgd", metrics=["accuracy"])
 
-    history = model.fit(train_set, epochs=10, validation_data = val_set)
+    history = model.fit(train_set, epochs=args.epochs, validation_data = val_set)
+
+    # The model only predicts the last of the top N topic labels.
+    save_model(model, args.model_dir, stage2.topic_labels()[-1:], stage2.input_text_len)
+
+def train_multi_label(stage2: Stage2PreprocData, args: argparse.Namespace) -> None:
+    """
+    Train a single model with a sigmoid output for each of the top N topics.
+    """
+    topic_labels = stage2.topic_labels()
+    _, _, labels = stage2.to_encoded_mmap()
+    train_indices, val_indices, test_indices = stage2.split_indices()
+
+    # Weight each topic's positive examples by how rare the topic is in the
+    # training set.
+    pos_weights = positive_class_weights(labels[train_indices])
+
+    # Not cached: the issues are streamed from the memory-mapped encoded
+    # arrays on each epoch.  Caching after `all_topic_labels` would keep a
+    # float32 copy of the whole training set (4 times the size of the int8
+    # encoded issues) in memory.
+    train_set, val_set, test_set = stage2.to_batched_datasets(batch_size=args.batch_size, map_func=all_topic_labels)
+
+    model = tf.keras.models.Sequential([
+        tf.keras.layers.Dense(300, input_shape=[stage2.input_text_len], activation="relu"),
+        tf.keras.layers.Dense(len(topic_labels), activation="sigmoid")
+    ])
+
+    model.summary()
+
+    model.compile(
+        loss=weighted_binary_crossentropy(pos_weights),
+        optimizer="adam",
+        metrics=[tf.keras.metrics.AUC(multi_label=True)],
+    )
+
+    with METRICS.stage("train") as stage_timer:
+        history = model.fit(train_set, epochs=args.epochs, validation_data = val_set)
+        stage_timer.rows = len(train_indices) * args.epochs
+
+    # The validation and testing sets are always in the same order as their
+    # indices, so the predictions line up with labels[val_indices].
+    thresholds = calibrate_thresholds(labels[val_indices], model.predict(val_set), topic_labels)
+
+    test_predictions = predict_with_thresholds(model.predict(test_set), topic_labels, thresholds)
+    test_f1s = f1_scores(labels[test_indices], test_predictions)
+    for topic, f1 in zip(topic_labels, test_f1s):
+        print(f"{topic}: threshold {thresholds[topic]:.2f}, test F1 {f1:.3f}")
+    print(f"Mean test F1: {np.mean(test_f1s):.3f}")
+
+    save_model(model, args.model_dir, topic_labels, stage2.input_text_len, thresholds)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train a model to predict topic labels for issues.")
+    parser.add_argument(
+        "--mode",
+        choices=["multi-label", "nixos"],
+        default="multi-label",
+        help="Train one model for all the top N topics, or only for the most common topic.",
+    )
+    parser.add_argument("--top-n-topics", type=int, default=15)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--model-dir", default="trained-model")
+    parser.add_argument("--data-dir", default="issue-data")
+    parser.add_argument("--store-dir", help="Read issues from this Parquet issue store instead of --data-dir.")
+    parser.add_argument(
+        "--num-processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes to parse the issue json files with, when preprocessing isn't cached.",
+    )
+    args = parser.parse_args()
+
+    with MetricsExporter.from_env():
+        issue_files = IssueFiles(args.data_dir, store_dir=args.store_dir, num_processes=args.num_processes)
+        stage2 = Stage2PreprocData(Stage1PreprocData(issue_files), top_n_topics=args.top_n_topics)
+
+        if args.mode == "nixos":
+            train_nixos_only(stage2, args)
+        else:
+            train_multi_label(stage2, args)
 
 
 if __name__ == "__main__":